@@ -1,30 +1,1019 @@
-from flask import Flask, render_template, request, abort
-from werkzeug.security import check_password_hash
+from flask import Flask, render_template, request, abort, g, has_app_context, url_for
+from flask import before_render_template, template_rendered, send_file, send_from_directory
+from flask import stream_template, session, flash, get_flashed_messages
+from markupsafe import Markup, escape
+from collections import OrderedDict, Counter
+from datetime import datetime, timezone
+from dataclasses import dataclass, asdict
+from typing import NamedTuple
+from werkzeug.security import check_password_hash, safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 import sqlite3
 import code_params
 import os
+import queue
+import atexit
+import threading
+import time
+import functools
+import hashlib
+import shutil
+import json
+import bisect
+import contextlib
+import csv
+import gzip
+import io
+import mimetypes
+import re
+import secrets
+import zipfile
+import asyncio
+import concurrent.futures
+import sys
+import tempfile
+import posixpath
+import urllib.parse
+import click
+
+# Pillow is only needed to make smaller copies of uploaded images.
+# Without it, the original images are served on their own.
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+# Brotli and Zstandard are only needed to send responses compressed with them.
+# Without them, responses are only compressed with gzip.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# uvicorn is only needed to serve the app as an ASGI app with "flask serve-asgi".
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
 
 app = Flask(__name__)
 DATABASE = "LC.db"
 app.config["UPLOAD_FOLDER"] = code_params.upload_folder
+app.config["DB_POOL_SIZE"] = code_params.db_pool_size
+app.config["REFERENCE_DATA_CHECK_INTERVAL"] = code_params.reference_data_check_interval
+app.config["PAGE_CACHE_MAX_BYTES"] = code_params.page_cache_max_bytes
+app.config["MIGRATE_ON_STARTUP"] = code_params.migrate_on_startup
+app.config["SLOW_QUERY_SECONDS"] = code_params.slow_query_seconds
+app.config["METRICS_ENABLED"] = code_params.metrics_enabled
+app.config["STATIC_MAX_AGE"] = code_params.static_max_age
+app.config["COMPRESS_MIN_BYTES"] = code_params.compress_min_bytes
+app.config["COMPRESS_LEVELS"] = code_params.compress_levels
+app.config["STREAM_PAGES"] = code_params.stream_pages
+app.config["STREAM_CHUNK_BYTES"] = code_params.stream_chunk_bytes
+app.config["ASGI_THREADS"] = code_params.asgi_threads
+app.config["ASGI_SPOOL_BYTES"] = code_params.asgi_spool_bytes
+app.config["MEMORY_SNAPSHOT"] = code_params.memory_snapshot
+app.config["MEMORY_SNAPSHOT_CHECK"] = code_params.memory_snapshot_check
+app.config["DB_JOURNAL_MODE"] = code_params.db_journal_mode
+app.config["DB_SYNCHRONOUS"] = code_params.db_synchronous
+app.config["DB_MMAP_SIZE"] = code_params.db_mmap_size
+app.config["DB_CACHE_SIZE"] = code_params.db_cache_size
+app.config["DB_TEMP_STORE"] = code_params.db_temp_store
+app.config["DB_BUSY_TIMEOUT"] = code_params.db_busy_timeout
+app.config["STATIC_EXPORT_FOLDER"] = code_params.static_export_folder
+
+
+def load_secret_key():
+    '''Gets the key that sessions are signed with, creating it the first time the app starts'''
+    # Every worker has to sign sessions with the same key,
+    # so it is either given to all of them, or kept in a file they all read.
+    if os.environ.get("LC_SECRET_KEY"):
+        return os.environ["LC_SECRET_KEY"]
+    path = code_params.secret_key_file
+    if not os.path.exists(path):
+        # The key is written to a temporary file and then linked into place,
+        # so workers starting at the same time can't read half a key or make two.
+        temporary = f"{path}.{os.getpid()}"
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+            file.write(secrets.token_hex(32))
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+    with open(path) as file:
+        return file.read().strip()
+
+
+# Whether the user is signed in as an admin, and the messages shown after
+# logging in and after a rejected admin form, are kept in each user's signed session cookie,
+# so that every worker sees the same thing for a user, and users don't share them.
+app.config["SECRET_KEY"] = load_secret_key()
+app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+
+
+def is_admin():
+    '''Checks if the user is signed in as an admin'''
+    return session.get("admin", False)
+
+
+def get_message(category):
+    '''Gets the message flashed to the user for a page, or an empty string'''
+    # Flask removes every flashed message from the session when any of them are read,
+    # so they are all read once per request, and only the ones for this page are used up.
+    if "flashed_messages" not in g:
+        g.flashed_messages = get_flashed_messages(with_categories=True)
+    messages = [message for message_category, message in g.flashed_messages if message_category == category]
+    g.flashed_messages = [(message_category, message) for message_category, message in g.flashed_messages
+                          if message_category != category]
+    return messages[-1] if messages else ""
+
+
+@app.after_request
+def keep_unread_messages(response):
+    '''Flashes the messages that weren't read again, so they are shown on the page they are meant for'''
+    for category, message in g.pop("flashed_messages", []):
+        flash(message, category)
+    return response
+
+
+# Idle database connections that are kept open between requests.
+# This is created on first use, so that the pool size can be changed in the config.
+connection_pool = None
+
+
+# The settings from the config that every connection to the database is opened with.
+# A setting that is None is left as SQLite's default.
+connection_profile = {"journal_mode": "DB_JOURNAL_MODE",
+                      "synchronous": "DB_SYNCHRONOUS",
+                      "mmap_size": "DB_MMAP_SIZE",
+                      "cache_size": "DB_CACHE_SIZE",
+                      "temp_store": "DB_TEMP_STORE"}
+
+
+def open_connection():
+    '''Opens a new connection to the database, with the connection profile applied'''
+    # Pooled connections are handed between worker threads,
+    # but only one request uses a connection at a time, so this is safe.
+    # A connection that finds the database locked waits up to the busy timeout for it.
+    db = sqlite3.connect(DATABASE, timeout=app.config["DB_BUSY_TIMEOUT"], check_same_thread=False)
+    for pragma, key in connection_profile.items():
+        if app.config[key] is not None:
+            db.execute(f"PRAGMA {pragma} = {app.config[key]};").fetchall()
+    return db
+
+
+def get_connection_pool():
+    '''Gets the pool of idle connections, creating it if needed'''
+    global connection_pool
+    if connection_pool is None:
+        connection_pool = queue.LifoQueue(maxsize=max(app.config["DB_POOL_SIZE"], 1))
+    return connection_pool
+
+
+def connection_is_healthy(db):
+    '''Check that a pooled connection is still able to run queries'''
+    try:
+        db.execute("SELECT 1;").fetchall()
+    except sqlite3.Error:
+        return False
+    else:
+        return True
+
+
+def checkout_connection():
+    '''Takes a working connection from the pool, or opens a new one'''
+    # Keep taking connections from the pool until a healthy one is found.
+    # Broken connections are closed and thrown away.
+    while app.config["DB_POOL_SIZE"] > 0:
+        try:
+            db = get_connection_pool().get_nowait()
+        except queue.Empty:
+            break
+        if connection_is_healthy(db):
+            return db
+        db.close()
+    return open_connection()
+
+
+def release_connection(db):
+    '''Returns a connection to the pool, or closes it if the pool is full'''
+    # Anything left uncommitted by a failed request is thrown away,
+    # so that the next request gets a clean connection.
+    if db.in_transaction:
+        db.rollback()
+    if app.config["DB_POOL_SIZE"] > 0:
+        try:
+            get_connection_pool().put_nowait(db)
+            return
+        except queue.Full:
+            pass
+    db.close()
+
+
+@atexit.register
+def close_connection_pool():
+    '''Closes every idle connection in the pool'''
+    if connection_pool is None:
+        return
+    while True:
+        try:
+            connection_pool.get_nowait().close()
+        except queue.Empty:
+            break
 
-# Boolean to hold if the user is signed in as an admin.
-admin = False
 
-# The message when the user attempts to log in.
-# This is a global variable so that multiple routes can access it easily.
-login_message = ""
+# The in-memory copy of the database that reads are served from when MEMORY_SNAPSHOT is on.
+# The copy is made with the backup API and kept as the bytes of a serialized database.
+# Each read connection loads those bytes into its own private in-memory database,
+# because a shared in-memory database locks out its readers while it is being updated.
+# Writes still go to the database on disk, and the copy is remade once they are committed.
+snapshot_image = None
+snapshot_version = 0
+snapshot_lock = threading.Lock()
+snapshot_pool = None
+
+
+def refresh_snapshot():
+    '''Copies the database on disk into memory, if reads are served from memory'''
+    global snapshot_image, snapshot_version
+    if not app.config["MEMORY_SNAPSHOT"]:
+        return
+    # The copy is made under the lock, so copies made after two writes
+    # can't be swapped in out of order.
+    with snapshot_lock:
+        disk = open_connection()
+        memory = sqlite3.connect(":memory:")
+        try:
+            disk.backup(memory)
+            # The copy keeps the WAL flag in its header, which an in-memory database can't open,
+            # so the file format versions at bytes 18 and 19 are set back to the rollback journal.
+            image = bytearray(memory.serialize())
+            image[18:20] = b"\x01\x01"
+            snapshot_image = bytes(image)
+        finally:
+            memory.close()
+            disk.close()
+        snapshot_version += 1
+    if app.config["MEMORY_SNAPSHOT_CHECK"]:
+        differences = check_snapshot()
+        if differences:
+            app.logger.warning("The in-memory copy differs from LC.db in %s", ", ".join(differences))
+
+
+def check_snapshot():
+    '''Gets the tables whose rows in the in-memory copy differ from the database on disk'''
+    with snapshot_lock:
+        memory = sqlite3.connect(":memory:")
+        memory.deserialize(snapshot_image)
+    disk = open_connection()
+    try:
+        differences = []
+        # The schema is compared as well, so a missed migration is noticed too.
+        schema = "SELECT type, name, sql FROM sqlite_master;"
+        if Counter(disk.execute(schema)) != Counter(memory.execute(schema)):
+            differences.append("sqlite_master")
+        for (table,) in disk.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall():
+            # The rows are compared without an order, as some tables have no rowid.
+            query = f'SELECT * FROM "{table}";'
+            try:
+                if Counter(disk.execute(query)) != Counter(memory.execute(query)):
+                    differences.append(table)
+            except sqlite3.OperationalError:
+                differences.append(table)
+        return differences
+    finally:
+        memory.close()
+        disk.close()
+
+
+def get_snapshot_db():
+    '''Gets the request's connection to the in-memory copy, bringing it up to date'''
+    global snapshot_pool
+    if snapshot_pool is None:
+        snapshot_pool = queue.LifoQueue(maxsize=max(app.config["DB_POOL_SIZE"], 1))
+    # Each connection is kept with the version of the copy it has loaded.
+    if "snapshot_db" not in g:
+        try:
+            g.snapshot_db = snapshot_pool.get_nowait()
+        except queue.Empty:
+            g.snapshot_db = [sqlite3.connect(":memory:", check_same_thread=False), 0]
+    entry = g.snapshot_db
+    if entry[1] != snapshot_version:
+        with snapshot_lock:
+            image, version = snapshot_image, snapshot_version
+        entry[0].deserialize(image)
+        # A write that reaches the copy by mistake fails, instead of being lost.
+        entry[0].execute("PRAGMA query_only = ON;")
+        entry[1] = version
+    return entry[0]
+
+
+def release_snapshot_db(entry):
+    '''Returns a connection to the in-memory copy to its pool, or closes it if the pool is full'''
+    try:
+        snapshot_pool.put_nowait(entry)
+    except queue.Full:
+        entry[0].close()
+
+
+def is_read_query(query):
+    '''Checks if a query only reads from the database'''
+    return query.lstrip().upper().startswith("SELECT")
 
-# The message when the user fails to use an admin tool properly.
-# This is a global variable so that multiple routes can access it easily.
-fail_message = ""
+
+def get_db():
+    '''Gets the database connection for the current request'''
+    # Each request borrows one connection, which is reused for all of its queries.
+    if "db" not in g:
+        g.db = checkout_connection()
+    return g.db
+
+
+@app.teardown_appcontext
+def teardown_db(exception):
+    '''Gives the request's connections back to their pools'''
+    db = g.pop("db", None)
+    if db is not None:
+        release_connection(db)
+    snapshot_db = g.pop("snapshot_db", None)
+    if snapshot_db is not None:
+        release_snapshot_db(snapshot_db)
 
 
 def execute_query(query, params=()):
     '''Executes a query in the database based on parameters'''
-    with sqlite3.connect(DATABASE) as db:
-        return db.cursor().execute(query, params).fetchall()
+    # Queries run outside of a request, such as from the command line,
+    # don't have a connection to borrow, so they use a temporary one.
+    if not has_app_context():
+        db = open_connection()
+        try:
+            with db:
+                return db.execute(query, params).fetchall()
+        finally:
+            db.close()
+
+    # Commit after each query, like a fresh connection would,
+    # and roll back if the query fails.
+    # Inside a unit of work, the queries are committed together at the end instead,
+    # and they all use the database on disk, so they see the unit's own writes.
+    start = time.perf_counter()
+    try:
+        if "unit_of_work" in g:
+            return get_db().execute(query, params).fetchall()
+        if app.config["MEMORY_SNAPSHOT"] and is_read_query(query):
+            return get_snapshot_db().execute(query, params).fetchall()
+        db = get_db()
+        with db:
+            rows = db.execute(query, params).fetchall()
+    finally:
+        record_query(query, time.perf_counter() - start)
+    if not is_read_query(query):
+        refresh_snapshot()
+    return rows
+
+
+@contextlib.contextmanager
+def unit_of_work():
+    '''Runs every query of an admin action in one transaction, along with its file changes'''
+    # Committing once means an action only waits for the disk once,
+    # and a failure part way through can't leave half of the action done.
+    # Files that are made are removed again if the action fails,
+    # and files are only deleted once the action has been committed.
+    db = get_db()
+    # The write lock is taken first, so new ids can't be taken by another request.
+    db.execute("BEGIN IMMEDIATE;")
+    g.unit_of_work = {"undo": [], "after_commit": []}
+    try:
+        yield
+        db.commit()
+    except BaseException:
+        db.rollback()
+        for path in reversed(g.unit_of_work["undo"]):
+            remove_path(path)
+        raise
+    finally:
+        staged = g.pop("unit_of_work")
+    refresh_snapshot()
+    for function, args in staged["after_commit"]:
+        function(*args)
+
+
+def remove_path(path):
+    '''Deletes a file, or a folder and everything in it'''
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def stage_folder(path):
+    '''Makes a folder that is removed again if the unit of work fails'''
+    os.mkdir(path)
+    g.unit_of_work["undo"].append(path)
+
+
+def stage_upload(file, path):
+    '''Saves an uploaded file that is removed again if the unit of work fails'''
+    file.save(path)
+    g.unit_of_work["undo"].append(path)
+
+
+def stage_delete(path):
+    '''Deletes a file or folder once the unit of work has been committed'''
+    after_commit(remove_path, path)
+
+
+def after_commit(function, *args):
+    '''Runs a function once the unit of work has been committed'''
+    # Slow work, like making the smaller copies of images,
+    # is done after the commit so that it doesn't hold the write lock.
+    g.unit_of_work["after_commit"].append((function, args))
+
+
+def record_query(query, duration):
+    '''Adds a query to the current request's query count and time'''
+    g.query_count = g.get("query_count", 0) + 1
+    g.query_time = g.get("query_time", 0.0) + duration
+    if duration > app.config["SLOW_QUERY_SECONDS"]:
+        g.setdefault("slow_queries", []).append((" ".join(query.split()), duration))
+
+
+# The upper bounds of the histogram buckets for each metric that is recorded per route,
+# and the description that Prometheus shows for it.
+histogram_buckets = {
+    "lc_request_duration_seconds": (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    "lc_template_render_seconds": (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+    "lc_db_queries_per_request": (0, 1, 2, 3, 5, 10, 20, 50),
+    "lc_db_seconds_per_request": (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+    "lc_response_size_bytes": (256, 1024, 4096, 16384, 65536, 262144, 1048576),
+}
+histogram_help = {
+    "lc_request_duration_seconds": "Time taken to handle a request.",
+    "lc_template_render_seconds": "Time spent rendering templates in a request.",
+    "lc_db_queries_per_request": "Number of database queries run by a request.",
+    "lc_db_seconds_per_request": "Time spent running database queries in a request.",
+    "lc_response_size_bytes": "Size of the response body.",
+}
+
+# For each histogram, the bucket counts, sum and count of every route.
+# The counts are stored per bucket, and are only added up when they are exported.
+histograms = {name: {} for name in histogram_buckets}
+request_counts = {}
+slow_query_counts = {}
+metrics_lock = threading.Lock()
+
+
+def observe(name, route, value):
+    '''Records a value in a route's histogram for the given metric'''
+    # The caller holds the metrics lock.
+    buckets = histogram_buckets[name]
+    series = histograms[name].get(route)
+    if series is None:
+        series = histograms[name][route] = {"counts": [0] * (len(buckets) + 1),
+                                            "sum": 0, "count": 0}
+    # The last count is for values bigger than every bucket.
+    series["counts"][bisect.bisect_left(buckets, value)] += 1
+    series["sum"] += value
+    series["count"] += 1
+
+
+@app.before_request
+def start_request_metrics():
+    '''Resets the query and render counters at the start of a request'''
+    g.request_start = time.perf_counter()
+    g.query_count = 0
+    g.query_time = 0.0
+    g.render_time = 0.0
+
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    '''Notes the time that a template started rendering'''
+    g.render_start = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    '''Adds the time a template took to render to the request's render time'''
+    if "render_start" in g:
+        g.render_time = g.get("render_time", 0.0) + time.perf_counter() - g.pop("render_start")
+
+
+@app.after_request
+def record_request_metrics(response):
+    '''Records the time, queries, render time and size of a finished request'''
+    if "request_start" not in g:
+        return response
+    duration = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    slow_queries = g.get("slow_queries", [])
+    with metrics_lock:
+        observe("lc_request_duration_seconds", route, duration)
+        observe("lc_db_queries_per_request", route, g.query_count)
+        observe("lc_db_seconds_per_request", route, g.query_time)
+        # Pages served from the page cache don't render a template.
+        if g.render_time:
+            observe("lc_template_render_seconds", route, g.render_time)
+        # Streamed responses don't know their size, so they aren't recorded.
+        if response.content_length is not None:
+            observe("lc_response_size_bytes", route, response.content_length)
+        key = (route, response.status_code)
+        request_counts[key] = request_counts.get(key, 0) + 1
+        if slow_queries:
+            slow_query_counts[route] = slow_query_counts.get(route, 0) + len(slow_queries)
+    for query, query_time in slow_queries:
+        app.logger.warning("Slow query on %s (%.1f ms): %s", request.path, query_time * 1000, query)
+
+    # The browser's developer tools show this as a breakdown of the request time.
+    response.headers["Server-Timing"] = (f"db;dur={g.query_time * 1000:.2f}, "
+                                         f"render;dur={g.render_time * 1000:.2f}, "
+                                         f"total;dur={duration * 1000:.2f}")
+    return response
+
+
+def format_labels(**labels):
+    '''Formats labels for the Prometheus text format'''
+    # Backslashes, quotes and new lines have to be escaped in label values.
+    escaped = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def get_metrics_text():
+    '''Gets every metric in the Prometheus text format'''
+    lines = []
+    with metrics_lock:
+        for name, buckets in histogram_buckets.items():
+            lines.append(f"# HELP {name} {histogram_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for route, series in sorted(histograms[name].items()):
+                # Prometheus buckets count every value up to their bound,
+                # so the stored counts are added up as they are written.
+                total = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], series["counts"]):
+                    total += count
+                    lines.append(f"{name}_bucket{format_labels(route=route, le=bound)} {total}")
+                lines.append(f"{name}_sum{format_labels(route=route)} {series['sum']}")
+                lines.append(f"{name}_count{format_labels(route=route)} {series['count']}")
+
+        lines.append("# HELP lc_requests_total Number of requests handled.")
+        lines.append("# TYPE lc_requests_total counter")
+        for (route, status), count in sorted(request_counts.items()):
+            lines.append(f"lc_requests_total{format_labels(route=route, status=status)} {count}")
+
+        lines.append("# HELP lc_db_slow_queries_total Number of queries slower than the slow query limit.")
+        lines.append("# TYPE lc_db_slow_queries_total counter")
+        for route, count in sorted(slow_query_counts.items()):
+            lines.append(f"lc_db_slow_queries_total{format_labels(route=route)} {count}")
+
+    # The page cache keeps its own statistics.
+    cache_stats = get_page_cache_stats()
+    for stat in ["hits", "misses", "evictions", "invalidations"]:
+        lines.append(f"# TYPE lc_page_cache_{stat}_total counter")
+        lines.append(f"lc_page_cache_{stat}_total {cache_stats[stat]}")
+    lines.append("# TYPE lc_page_cache_bytes gauge")
+    lines.append(f"lc_page_cache_bytes {cache_stats['bytes']}")
+    return "\n".join(lines) + "\n"
+
+
+# The page titles and home page links hardly ever change,
+# so they are loaded into memory once instead of being queried on every page.
+page_titles = {}
+home_page_links = []
+
+# The tables that the admin forms pick from are kept in memory too,
+# as {id: name} in id order, for the drop downs and for checking submitted ids.
+lookup_table_names = ["RiskLevels", "Setting", "Interiors", "Weathers", "Moons"]
+lookup_tables = {}
+
+# A connection that is only used to check whether the database has changed,
+# the data version it last saw, and when it last checked.
+reference_connection = None
+reference_data_version = None
+reference_checked_at = 0.0
+reference_lock = threading.RLock()
+
+
+def get_data_version():
+    '''Gets a number that changes whenever another connection writes to the database'''
+    global reference_connection
+    if reference_connection is None:
+        reference_connection = open_connection()
+    return reference_connection.execute("PRAGMA data_version;").fetchone()[0]
+
+
+def load_reference_data():
+    '''Loads the page titles, home page links and lookup tables into memory'''
+    with reference_lock:
+        load_page_titles()
+        load_lookup_tables()
+
+
+def load_page_titles():
+    '''Loads the page titles and home page links into memory'''
+    global page_titles, home_page_links
+    with reference_lock:
+        # The new values are built before being swapped in,
+        # so other threads never see a half loaded cache.
+        # Cached pages that contain the titles are removed when the version of PageTitles changes.
+        titles = dict(execute_query("SELECT route, title FROM PageTitles;"))
+        links = execute_query('''
+                              SELECT display_name, description, link
+                              FROM HomePageLinks;''')
+        page_titles, home_page_links = titles, links
+
+
+def load_lookup_tables():
+    '''Loads the id and name of every row in the lookup tables into memory'''
+    global lookup_tables
+    with reference_lock:
+        lookup_tables = {table: dict(execute_query(f"SELECT id, name FROM {table} ORDER BY id;"))
+                         for table in lookup_table_names}
+
+
+def get_lookup_entries(table):
+    '''Gets the (id, name) of every row in a lookup table, for a drop down'''
+    return list(lookup_tables[table].items())
+
+
+def is_lookup_id(table, value):
+    '''Checks if a submitted value is the id of a row in a lookup table'''
+    return is_number(value) and int(value) in lookup_tables[table]
+
+
+def invalidate_reference_data():
+    '''Reloads the page titles, home page links and lookup tables from the database'''
+    load_reference_data()
+
+
+@app.before_request
+def refresh_reference_data():
+    '''Reloads the cached reference data if the database has changed'''
+    global reference_checked_at
+    # The data version is only checked every few seconds,
+    # so most requests don't touch the database for it at all.
+    if time.monotonic() - reference_checked_at < app.config["REFERENCE_DATA_CHECK_INTERVAL"]:
+        return
+    with reference_lock:
+        reference_checked_at = time.monotonic()
+        # This worker records the data version after each of its own writes,
+        # so a different version means another worker has written to the database.
+        if get_data_version() != reference_data_version:
+            changed = bump_data_versions(copy=True)
+            # The home page links aren't versioned, so they are reloaded with the titles
+            # whenever another worker has written, if the titles weren't just reloaded.
+            if "PageTitles" not in changed:
+                load_page_titles()
+
+
+def get_encodings():
+    '''Gets the compressions that can be used, from most to least preferred'''
+    modules = {"br": brotli, "zstd": zstandard, "gzip": gzip}
+    return [encoding for encoding in app.config["COMPRESS_LEVELS"] if modules.get(encoding)]
+
+
+def choose_encoding(size):
+    '''Picks the best compression the browser accepts for a response of the given size'''
+    # Small responses barely shrink, so they aren't worth compressing.
+    if size < app.config["COMPRESS_MIN_BYTES"]:
+        return "identity"
+    for encoding in get_encodings():
+        if request.accept_encodings[encoding]:
+            return encoding
+    return "identity"
+
+
+def compress(data, encoding):
+    '''Compresses the given bytes with the given compression'''
+    level = app.config["COMPRESS_LEVELS"][encoding]
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    # The time is left out of the gzip header, so the same page always compresses the same.
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+@app.after_request
+def compress_response(response):
+    '''Compresses text responses that the page cache hasn't already compressed'''
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in code_params.compressed_types):
+        return response
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_BYTES"]:
+        return response
+
+    # Caches must keep the copies for each compression apart.
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(len(data))
+    if encoding != "identity":
+        response.set_data(compress(data, encoding))
+        response.content_encoding = encoding
+        # The compressed bytes are different, so a strong ETag has to become weak.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+    return response
+
+
+# Rendered public pages.
+# Each page is stored as encoded HTML under "identity",
+# along with a copy for each compression it has been requested with.
+# The keys are (view name, id, admin), and the least recently used pages
+# are at the start, so they are the first to be removed when the cache is full.
+page_cache = OrderedDict()
+page_cache_bytes = 0
+page_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+page_cache_lock = threading.Lock()
+# Goes up every time pages are removed from the cache because they changed.
+# A page is only stored if this hasn't changed since it started rendering,
+# so a page rendered from data that a write has since changed is never stored.
+page_cache_generation = 0
+
+
+def get_page_size(page):
+    '''Gets the number of bytes a cached page takes up, including its compressed copies'''
+    return sum(len(body) for body in page.values())
+
+
+def trim_page_cache():
+    '''Removes the least recently used pages until the cache fits its budget'''
+    global page_cache_bytes
+    while page_cache_bytes > app.config["PAGE_CACHE_MAX_BYTES"] and page_cache:
+        page_cache_bytes -= get_page_size(page_cache.popitem(last=False)[1])
+        page_cache_stats["evictions"] += 1
+
+
+def store_page(key, page, generation):
+    '''Stores a rendered page in the page cache, unless pages were removed while it was rendered'''
+    global page_cache_bytes
+    with page_cache_lock:
+        if generation == page_cache_generation and key not in page_cache:
+            page_cache[key] = page
+            page_cache_bytes += get_page_size(page)
+            trim_page_cache()
+
+
+# Marks the point in a streamed page where everything rendered so far is sent straight away.
+# A NUL character never appears in the HTML, so it can't be confused with page content.
+STREAM_FLUSH = "\0"
+
+
+def flush():
+    '''Sends the rendered part of a streamed page straight away'''
+    # layout.html calls this after the header,
+    # so the browser can start loading the stylesheet while the rest is rendered.
+    return STREAM_FLUSH if g.get("streaming_page") else ""
+
+
+app.jinja_env.globals["flush"] = flush
+
+
+def render_page(template, **context):
+    '''Renders a public page, streaming it if streaming is turned on'''
+    if app.config["STREAM_PAGES"]:
+        g.streaming_page = True
+        return stream_template(template, **context)
+    return render_template(template, **context)
+
+
+def stream_page(key, pieces, generation):
+    '''Sends a streamed page in chunks, and stores it in the page cache once it is finished'''
+    def generate():
+        chunks = []
+        buffer = []
+        buffer_size = 0
+        # Jinja yields many tiny pieces, so they are sent in chunks of a reasonable size.
+        for piece in pieces:
+            if piece == STREAM_FLUSH or buffer_size >= app.config["STREAM_CHUNK_BYTES"]:
+                if buffer:
+                    chunk = "".join(buffer).encode()
+                    chunks.append(chunk)
+                    yield chunk
+                    buffer = []
+                    buffer_size = 0
+                if piece == STREAM_FLUSH:
+                    continue
+            buffer.append(piece)
+            buffer_size += len(piece)
+        chunk = "".join(buffer).encode()
+        chunks.append(chunk)
+        yield chunk
+
+        # If the browser disconnects, this is never reached, so half pages are never stored.
+        store_page(key, {"identity": b"".join(chunks)}, generation)
+
+    # Streamed pages are sent uncompressed,
+    # but later requests are served compressed from the page cache.
+    response = app.response_class(generate(), mimetype="text/html")
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def cache_page(view):
+    '''Serves a page from the page cache, rendering and storing it if it isn't cached'''
+    @functools.wraps(view)
+    def cached_view(**kwargs):
+        global page_cache_bytes
+        key = (view.__name__, kwargs.get("id"), is_admin())
+        with page_cache_lock:
+            page = page_cache.get(key)
+            if page is not None:
+                page_cache.move_to_end(key)
+                page_cache_stats["hits"] += 1
+            else:
+                page_cache_stats["misses"] += 1
+            generation = page_cache_generation
+
+        if page is None:
+            # Missing pages raise a 404 error before this point,
+            # so only pages that actually exist are stored.
+            page = view(**kwargs)
+            if not isinstance(page, str):
+                return stream_page(key, page, generation)
+            page = {"identity": page.encode()}
+            store_page(key, page, generation)
+
+        # Each compressed copy is only made once, the first time it is asked for.
+        encoding = choose_encoding(len(page["identity"]))
+        body = page.get(encoding)
+        if body is None:
+            body = compress(page["identity"], encoding)
+            with page_cache_lock:
+                # The page may have been removed while it was being compressed.
+                if page_cache.get(key) is page and encoding not in page:
+                    page[encoding] = body
+                    page_cache_bytes += len(body)
+                    trim_page_cache()
+
+        response = app.response_class(body, mimetype="text/html")
+        if encoding != "identity":
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+    return cached_view
+
+
+def invalidate_pages(*pages):
+    '''Removes the given (view name, id) pages from the page cache'''
+    global page_cache_bytes, page_cache_generation
+    with page_cache_lock:
+        page_cache_generation += 1
+        for name, id in pages:
+            # Both the admin and the normal version of the page are removed.
+            for as_admin in (True, False):
+                page = page_cache.pop((name, id, as_admin), None)
+                if page is not None:
+                    page_cache_bytes -= get_page_size(page)
+                    page_cache_stats["invalidations"] += 1
+    # The static site has copies of the same pages, so they are exported again.
+    if app.config["STATIC_EXPORT_FOLDER"]:
+        export_changed_pages(pages)
+
+
+def invalidate_views(*names):
+    '''Removes every page of the given views from the page cache'''
+    global page_cache_bytes, page_cache_generation
+    with page_cache_lock:
+        page_cache_generation += 1
+        for key in [key for key in page_cache if key[0] in names]:
+            page_cache_bytes -= get_page_size(page_cache.pop(key))
+            page_cache_stats["invalidations"] += 1
+
+
+def clear_page_cache():
+    '''Removes every page from the page cache'''
+    global page_cache_bytes, page_cache_generation
+    with page_cache_lock:
+        page_cache_generation += 1
+        page_cache_stats["invalidations"] += len(page_cache)
+        page_cache.clear()
+        page_cache_bytes = 0
+
+
+def get_page_cache_stats():
+    '''Gets the hit, miss and size statistics of the page cache'''
+    with page_cache_lock:
+        return dict(page_cache_stats,
+                    pages=len(page_cache),
+                    bytes=page_cache_bytes,
+                    max_bytes=app.config["PAGE_CACHE_MAX_BYTES"])
+
+
+# The version number and last modified time of each table, copied from the TableVersions table.
+# Every write to a table bumps its version in the database, in the same transaction,
+# and a page's ETag is built from the versions of the tables it reads,
+# so every worker gives the same page the same ETag.
+data_versions = {}
+data_versions_lock = threading.Lock()
+
+# The names of the views whose pages read each table,
+# so that another worker's change to a table only removes those pages.
+table_views = {}
+
+
+def load_data_versions(copy=False):
+    '''Copies the version of every table from the database into memory, and gets the tables that changed'''
+    global data_versions, reference_data_version
+    with reference_lock:
+        # The data version is read first, so a write made while the versions are read
+        # is picked up by the next check instead of being missed.
+        # For the same reason, when another worker has written,
+        # the database is copied into memory again only after the data version is read.
+        reference_data_version = get_data_version()
+        if copy:
+            refresh_snapshot()
+        rows = execute_query("SELECT name, version, modified_at FROM TableVersions;")
+        # The times are stored in whole seconds, the same as HTTP dates.
+        versions = {name: (version, datetime.fromtimestamp(modified_at, timezone.utc))
+                    for name, version, modified_at in rows}
+        changed = {name for name, version in versions.items() if data_versions.get(name) != version}
+        with data_versions_lock:
+            data_versions = versions
+    return changed
+
+
+def bump_data_versions(*tables, copy=False):
+    '''Picks up the new versions of the given tables after they have been changed, and gets every table that changed'''
+    with reference_lock:
+        # The database bumped the versions when the write was committed.
+        changed = load_data_versions(copy)
+        # A write only removes its own worker's cached pages,
+        # so the pages here that read a table another worker changed are removed too.
+        others = changed - set(tables)
+        if others:
+            invalidate_views(*{name for table in others for name in table_views.get(table, ())})
+        changed |= set(tables)
+        # Every write path bumps the tables it changed once it has been committed,
+        # so this is where the cached reference data is kept up to date.
+        if "PageTitles" in changed:
+            load_page_titles()
+        if changed & set(lookup_table_names):
+            load_lookup_tables()
+        if changed & repository_tables:
+            load_repository()
+    return changed
+
+
+def conditional_page(*tables):
+    '''Answers conditional GET requests using the versions of the tables a page reads'''
+    # Every page shows a title, so every page depends on the page titles.
+    tables = tables + ("PageTitles",)
+
+    def decorator(view):
+        for table in tables:
+            table_views.setdefault(table, set()).add(view.__name__)
+
+        @functools.wraps(view)
+        def conditional_view(**kwargs):
+            with data_versions_lock:
+                versions = [data_versions[table] for table in tables]
+            last_modified = max(version[1] for version in versions)
+
+            # Admins see extra links, so their pages have different ETags.
+            # The ETags are weak, as the page can be sent with different compressions.
+            # The query string is included, as API responses depend on it.
+            etag = hashlib.sha1(repr((view.__name__, kwargs.get("id"), is_admin(),
+                                      request.query_string,
+                                      [version[0] for version in versions])).encode()).hexdigest()
+
+            # If-None-Match is checked first, because it is more precise.
+            # If-Modified-Since is only used when the client has no ETag.
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+
+            # A 304 response skips the database and the template entirely.
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(**kwargs))
+                # Error responses from the API aren't given an ETag.
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.vary.add("Accept-Encoding")
+            # Clients may keep the page, but have to check it is still current.
+            response.cache_control.no_cache = True
+            return response
+        return conditional_view
+    return decorator
 
 
 def set_picture_list(picture_string):
@@ -36,6 +1025,327 @@ def set_picture_list(picture_string):
         return []
 
 
+def create_pictures_table(db):
+    '''Moves the space separated picture strings into the Pictures table'''
+    # Gallery pictures used to be stored as a string of file names in a pictures column.
+    # This moves them into their own table, with one row per picture,
+    # and removes the old columns.
+    # Databases that were moved before migrations were tracked already have the table.
+    if db.execute('''
+                  SELECT name FROM sqlite_master
+                  WHERE type='table' AND name='Pictures';''').fetchall():
+        return
+    db.execute('''
+               CREATE TABLE Pictures (id INTEGER PRIMARY KEY,
+               owner_type TEXT NOT NULL, owner_id INTEGER NOT NULL,
+               filename TEXT NOT NULL, sort_order INTEGER NOT NULL,
+               byte_size INTEGER);''')
+    db.execute('''
+               CREATE INDEX PicturesByOwner
+               ON Pictures (owner_type, owner_id, sort_order);''')
+    for table in ["Moons", "Entities", "Tools", "Weathers", "Interiors"]:
+        rows = []
+        for owner_id, picture_string in db.execute(f"SELECT id, pictures FROM {table};").fetchall():
+            for sort_order, filename in enumerate(set_picture_list(picture_string)):
+                path = f"{app.config['UPLOAD_FOLDER']}/{table}/{owner_id}/{filename}"
+                byte_size = os.path.getsize(path) if os.path.isfile(path) else None
+                rows.append((table, owner_id, filename, sort_order, byte_size))
+        db.executemany('''
+                       INSERT INTO Pictures (owner_type, owner_id, filename, sort_order, byte_size)
+                       VALUES (?, ?, ?, ?, ?);''', rows)
+        db.execute(f"ALTER TABLE {table} DROP COLUMN pictures;")
+
+
+def add_moon_weathers_primary_key(db):
+    '''Rebuilds the MoonWeathers table with a primary key on both of its columns'''
+    # SQLite can't add a primary key to an existing table,
+    # so the table is copied into a new one, which also removes any duplicate rows.
+    # WITHOUT ROWID stores the rows in primary key order,
+    # so looking up a moon's weathers doesn't need a separate index.
+    db.execute('''
+               CREATE TABLE MoonWeathersNew (
+               moon_id INTEGER REFERENCES Moons (id),
+               weather_id INTEGER REFERENCES Weathers (id),
+               PRIMARY KEY (moon_id, weather_id)) WITHOUT ROWID;''')
+    db.execute('''
+               INSERT OR IGNORE INTO MoonWeathersNew (moon_id, weather_id)
+               SELECT moon_id, weather_id FROM MoonWeathers;''')
+    db.execute("DROP TABLE MoonWeathers;")
+    db.execute("ALTER TABLE MoonWeathersNew RENAME TO MoonWeathers;")
+
+
+def add_lookup_indexes(db):
+    '''Adds the indexes that the page queries look up rows by'''
+    # Each index also holds the columns the query selects,
+    # so the query can be answered from the index without reading the table.
+    # Finding the moons that have a weather, for the weather page.
+    db.execute("CREATE INDEX MoonWeathersByWeather ON MoonWeathers (weather_id, moon_id);")
+    # Finding the moons that have an interior, for the interior page.
+    db.execute("CREATE INDEX MoonsByInterior ON Moons (interior, id, name);")
+    # Finding a page's title.
+    db.execute("CREATE INDEX PageTitlesByRoute ON PageTitles (route, title);")
+    # Finding an admin's password hash when they log in.
+    db.execute("CREATE INDEX AdminLoginsByUsername ON AdminLogins (username, passwordhash);")
+
+
+# The text columns of each table that are searched,
+# in the order of the Search table's columns.
+# NULL fills the columns that a table doesn't have.
+search_columns = {
+    "Moons": "name, NULL, conditions, history, fauna, description",
+    "Entities": "name, bestiary, NULL, NULL, NULL, description",
+    "Tools": "name, NULL, NULL, NULL, NULL, description",
+    "Weathers": "name, NULL, NULL, NULL, NULL, description",
+    "Interiors": "name, NULL, NULL, NULL, NULL, description",
+}
+
+
+def create_search_table(db):
+    '''Adds a full text search index of every moon, entity, tool, weather and interior'''
+    # The porter tokenizer matches different endings of the same word,
+    # so searching for "spawn" also finds "spawns" and "spawning".
+    db.execute('''
+               CREATE VIRTUAL TABLE Search USING fts5(
+               owner_type UNINDEXED, owner_id UNINDEXED,
+               name, bestiary, conditions, history, fauna, description,
+               tokenize='porter unicode61 remove_diacritics 2');''')
+    fill_search_table(db)
+    db.execute("INSERT INTO PageTitles (route, title) VALUES ('/search', 'Search');")
+
+
+def fill_search_table(db):
+    '''Adds every item to the search index'''
+    for table, columns in search_columns.items():
+        db.execute(f'''
+                   INSERT INTO Search (owner_type, owner_id, name, bestiary,
+                   conditions, history, fauna, description)
+                   SELECT '{table}', id, {columns} FROM {table};''')
+
+
+def add_import_page_title(db):
+    '''Adds the title of the bulk import page'''
+    db.execute("INSERT INTO PageTitles (route, title) VALUES ('/admin/import', 'Bulk Import');")
+
+
+# The text columns of each table that are shown as paragraphs on the data pages.
+# Each one has a column beside it, named with _html on the end,
+# that holds the text already rendered as HTML, so the pages don't have to render it.
+text_columns = {
+    "Moons": ["conditions", "history", "fauna", "description"],
+    "Entities": ["bestiary", "description"],
+    "Tools": ["description"],
+    "Weathers": ["description"],
+    "Interiors": ["description"],
+}
+
+
+def normalize_text(text):
+    '''Makes the new lines of text from a form or an import the same as the stored ones'''
+    # Browsers send the new lines of a text area as "\r\n".
+    return text.replace("\r\n", "\n") if text else text
+
+
+def render_text(text):
+    '''Renders text as HTML for the data pages, with its new lines as line breaks'''
+    # The text is escaped first, so nothing in it can be taken as HTML.
+    return str(escape(text)).replace("\n", "<br>") if text else text
+
+
+def render_stored_text(db, table, first_id=0):
+    '''Stores the rendered HTML of the text columns of a table's rows, from the given id on'''
+    columns = text_columns[table]
+    rows = db.execute(f"SELECT id, {', '.join(columns)} FROM {table} WHERE id >= ?;",
+                      (first_id,)).fetchall()
+    db.executemany(f'''
+                   UPDATE {table}
+                   SET {', '.join(f"{column}_html = ?" for column in columns)}
+                   WHERE id = ?;''', [(*[render_text(text) for text in row[1:]], row[0])
+                                      for row in rows])
+
+
+def store_native_text(db):
+    '''Stores new lines in the text columns as they are, and adds the rendered HTML of the text'''
+    # New lines used to be stored as the string "\n", and turned back into new lines
+    # and then into line breaks every time a page was shown.
+    for table, columns in text_columns.items():
+        for column in columns:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column}_html TEXT;")
+            db.execute(f'''
+                       UPDATE {table}
+                       SET {column} = REPLACE(REPLACE({column}, '\\n', char(10)),
+                                              char(13) || char(10), char(10));''')
+        render_stored_text(db, table)
+    # The search index holds copies of the text, so it is filled again from the tables.
+    db.execute("DELETE FROM Search;")
+    fill_search_table(db)
+
+
+# The tables that the public pages read, which have their versions kept in TableVersions.
+versioned_tables = ["Moons", "Entities", "Tools", "Weathers", "Interiors",
+                    "RiskLevels", "Setting", "MoonWeathers", "Pictures", "PageTitles"]
+
+
+def create_table_versions(db):
+    '''Adds a version to each table the pages read, which every write to the table bumps'''
+    # The versions are bumped by triggers, so they change in the same transaction as the write,
+    # whichever worker or connection made it, and no write path can forget to bump them.
+    db.execute('''
+               CREATE TABLE TableVersions (
+               name TEXT PRIMARY KEY, version INTEGER NOT NULL, modified_at INTEGER NOT NULL);''')
+    db.executemany('''
+                   INSERT INTO TableVersions (name, version, modified_at)
+                   VALUES (?, 1, CAST(strftime('%s', 'now') AS INTEGER));''',
+                   [(table,) for table in versioned_tables])
+    for table in versioned_tables:
+        for event in ["INSERT", "UPDATE", "DELETE"]:
+            db.execute(f'''
+                       CREATE TRIGGER {table}{event.title()}Version AFTER {event} ON {table}
+                       BEGIN
+                           UPDATE TableVersions
+                           SET version = version + 1,
+                               modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+                           WHERE name = '{table}';
+                       END;''')
+
+
+# The schema changes that have been made to the database, in the order they are applied.
+# Each migration is only ever applied once, and its version is recorded in the database.
+# New migrations go at the end with the next version number.
+migrations = [
+    (1, "pictures table", create_pictures_table),
+    (2, "moon weathers primary key", add_moon_weathers_primary_key),
+    (3, "lookup indexes", add_lookup_indexes),
+    (4, "search table", create_search_table),
+    (5, "import page title", add_import_page_title),
+    (6, "native text and rendered html", store_native_text),
+    (7, "table versions", create_table_versions),
+]
+
+
+def run_migrations():
+    '''Applies every migration that hasn't been applied to the database yet'''
+    applied = []
+    db = open_connection()
+    try:
+        db.execute('''
+                   CREATE TABLE IF NOT EXISTS SchemaMigrations (
+                   version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT);''')
+        for version, name, migration in migrations:
+            # Each migration runs in its own transaction along with its record,
+            # so a migration that fails leaves the database as it was.
+            # The write lock is taken first, so that if several workers start at once,
+            # only one of them applies each migration.
+            db.execute("BEGIN IMMEDIATE;")
+            if db.execute("SELECT version FROM SchemaMigrations WHERE version=?;",
+                          (version,)).fetchall():
+                db.rollback()
+                continue
+            try:
+                migration(db)
+                db.execute('''
+                           INSERT INTO SchemaMigrations (version, name, applied_at)
+                           VALUES (?, ?, ?);''',
+                           (version, name, datetime.now(timezone.utc).isoformat()))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            applied.append((version, name))
+    finally:
+        db.close()
+    return applied
+
+
+@app.cli.command("migrate")  # Apply any schema migrations that haven't been applied.
+def migrate():
+    '''Applies the schema migrations that haven't been applied to the database yet'''
+    applied = run_migrations()
+    for version, name in applied:
+        click.echo(f"Applied migration {version}: {name}")
+    if not applied:
+        click.echo("The database is up to date.")
+
+
+def get_pictures(owner_type, owner_id):
+    '''Gets the ids and file names of an item's gallery pictures, in order'''
+    return execute_query('''
+                         SELECT id, filename
+                         FROM Pictures
+                         WHERE owner_type=? AND owner_id=?
+                         ORDER BY sort_order;''', (owner_type, owner_id))
+
+
+def add_picture(owner_type, owner_id, filename):
+    '''Adds a saved picture to the end of an item's gallery'''
+    # The position is worked out in the same statement as the insert,
+    # so two admins adding pictures at once can't get the same position.
+    byte_size = os.path.getsize(f"{app.config['UPLOAD_FOLDER']}/{owner_type}/{owner_id}/{filename}")
+    execute_query('''
+                  INSERT INTO Pictures (owner_type, owner_id, filename, sort_order, byte_size)
+                  SELECT ?, ?, ?, COALESCE(MAX(sort_order) + 1, 0), ?
+                  FROM Pictures
+                  WHERE owner_type=? AND owner_id=?;''',
+                  (owner_type, owner_id, filename, byte_size, owner_type, owner_id))
+
+
+def delete_picture(owner_type, owner_id, picture_id):
+    '''Removes a picture from an item's gallery, and returns its file name'''
+    # The picture has to belong to the given item,
+    # so a picture id can't be used to delete another item's picture.
+    # If nothing was deleted, an empty list is returned instead.
+    deleted = execute_query('''
+                            DELETE FROM Pictures
+                            WHERE id=? AND owner_type=? AND owner_id=?
+                            RETURNING filename;''', (picture_id, owner_type, owner_id))
+    return deleted[0][0] if deleted else deleted
+
+
+def index_search(owner_type, owner_id):
+    '''Adds an item to the search index'''
+    # The item's text is copied straight from its table,
+    # so only the one item is indexed rather than rebuilding the whole index.
+    execute_query(f'''
+                  INSERT INTO Search (owner_type, owner_id, name, bestiary,
+                  conditions, history, fauna, description)
+                  SELECT ?, id, {search_columns[owner_type]} FROM {owner_type}
+                  WHERE id=?;''', (owner_type, owner_id))
+
+
+def unindex_search(owner_type, owner_id):
+    '''Removes an item from the search index'''
+    execute_query("DELETE FROM Search WHERE owner_type=? AND owner_id=?;", (owner_type, owner_id))
+
+
+def search_items(text):
+    '''Finds the items that match every word of the given text, best matches first'''
+    # Only the words are kept, so punctuation can't be read as FTS5 query syntax.
+    # The last word is matched as a prefix, so results show up while a word is being typed.
+    words = re.findall(r"\w+", text)[:code_params.search_max_words]
+    if not words:
+        return []
+    match = " ".join(f'"{word}"' for word in words) + "*"
+
+    # A match in the name counts for more than a match in the rest of the text.
+    # The matched words in the snippet are marked with control characters,
+    # which are swapped for HTML tags once the rest of the snippet has been escaped.
+    rows = execute_query('''
+                         SELECT owner_type, owner_id, name,
+                         snippet(Search, -1, char(2), char(3), '...', ?)
+                         FROM Search
+                         WHERE Search MATCH ?
+                         ORDER BY bm25(Search, 0, 0, 10.0, 2.0, 1.0, 1.0, 1.0, 1.0)
+                         LIMIT ?;''', (code_params.search_snippet_words, match,
+                                        code_params.search_max_results))
+    return [{
+        "type": code_params.search_types[row[0]][0],
+        "link": f"{code_params.search_types[row[0]][1]}/{row[1]}",
+        "name": row[2],
+        # The snippet is shown on one line.
+        "snippet": Markup(str(escape(row[3].replace("\n", " ")))
+                          .replace("\x02", "<mark>").replace("\x03", "</mark>"))
+    } for row in rows]
+
+
 def admin_perms_denied():
     '''Redirects the user to a page that denies admin access'''
     return render_template("adminpermsdenied.html",
@@ -45,10 +1355,8 @@ def admin_perms_denied():
 def get_title(route):
     '''Gets the title of a page based on its route'''
     # Page titles are stored in the database with the page route as the identifier.
-    return execute_query('''
-                         SELECT title
-                         FROM PageTitles
-                         WHERE route=?''', (route,))[0][0]
+    # They are served from the in-memory copy, which is loaded at startup.
+    return page_titles[route]
 
 
 def push_error(number, code):
@@ -64,8 +1372,7 @@ def reject_input(route, message):
     '''Redirect the user to a page with a message'''
     # The user can mess up admin queries in different ways,
     # so this is here to tell the user what went wrong.
-    global fail_message
-    fail_message = message
+    flash(message, "fail")
     return app.redirect(route)
 
 
@@ -75,7 +1382,7 @@ def is_number(x):
     # so the brute force nature of it doesn't hinder the program.
     try:
         int(x)
-    except ValueError:
+    except (ValueError, TypeError):
         return False
     else:
         return True
@@ -139,21 +1446,575 @@ def get_image_name(name, directory):
         return False
 
 
+def get_variant_directory(folder, id):
+    '''Gets the directory that holds the smaller copies of an item's images'''
+    return f"{app.config['UPLOAD_FOLDER']}/{code_params.image_variant_folder}/{folder}/{id}"
+
+
+def get_variant_name(name, width, variant_extension):
+    '''Gets the file name of a smaller copy of an image'''
+    # The whole name of the original is kept, extension and all,
+    # because images like a.jpg and a.png can be in the same folder,
+    # and their copies can't share files, or deleting one will delete the other.
+    return f"{name}_{width}{variant_extension}"
+
+
+def is_variant_of(file, name):
+    '''Checks whether a file in the variant directory is a smaller copy of the named image'''
+    return any(file.startswith(get_variant_name(name, width, "."))
+               for width in code_params.image_variant_widths)
+
+
+@functools.lru_cache
+def get_variant_formats(extension):
+    '''Gets the file extensions, Pillow formats and types that copies of an image are saved as'''
+    # Copies are always saved in the original format, so every browser can show them.
+    # WebP and AVIF copies are much smaller, but are only made if Pillow supports them.
+    # An original that is already WebP or AVIF only has its copies saved once, in its own format.
+    formats = [(extension, Image.registered_extensions().get(extension.lower()), None)]
+    if features.check("avif") and extension.lower() != ".avif":
+        formats.insert(0, (".avif", "AVIF", "image/avif"))
+    if features.check("webp") and extension.lower() != ".webp":
+        formats.insert(-1, (".webp", "WEBP", "image/webp"))
+    return formats
+
+
+def create_image_variants(folder, id, name):
+    '''Saves smaller copies of an uploaded image in several widths and formats, and returns whether any were made'''
+    if Image is None:
+        return False
+
+    directory = get_variant_directory(folder, id)
+    os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(name)[1]
+    made = False
+    try:
+        with Image.open(f"{app.config['UPLOAD_FOLDER']}/{folder}/{id}/{name}") as image:
+            image.load()
+            # JPEG and some other formats can't store transparency,
+            # so the copies are converted to plain RGB.
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+            for width in code_params.image_variant_widths:
+                # Copies are only made if they would be smaller than the original.
+                if width >= image.width:
+                    continue
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.Resampling.LANCZOS)
+                for variant_extension, variant_format, mime_type in get_variant_formats(extension):
+                    if variant_format == "JPEG" and resized.mode != "RGB":
+                        resized = resized.convert("RGB")
+                    resized.save(f"{directory}/{get_variant_name(name, width, variant_extension)}",
+                                 variant_format,
+                                 quality=code_params.image_variant_quality)
+                    made = True
+    except (OSError, ValueError):
+        # If the file can't be read as an image, the original is served on its own.
+        return False
+    return made
+
+
+# Making the copies of an upload takes over a second, so admin writes leave it to background threads
+# once they have been committed, and the original is shown until the copies are ready.
+image_variant_executor = None
+
+
+def get_image_variant_executor():
+    '''Gets the threads that the smaller copies of uploaded images are made on, creating them if needed'''
+    global image_variant_executor
+    if image_variant_executor is None:
+        image_variant_executor = concurrent.futures.ThreadPoolExecutor(code_params.image_variant_threads,
+                                                                       thread_name_prefix="image-variants")
+    return image_variant_executor
+
+
+def queue_image_variants(folder, id, name):
+    '''Makes the smaller copies of an uploaded image on a background thread'''
+    get_image_variant_executor().submit(make_image_variants, folder, id, name)
+
+
+def make_image_variants(folder, id, name):
+    '''Makes the smaller copies of an image, and removes the pages that were rendered without them'''
+    try:
+        if not create_image_variants(folder, id, name):
+            return
+        # The image may have been deleted while its copies were being made.
+        if not os.path.exists(f"{app.config['UPLOAD_FOLDER']}/{folder}/{id}/{name}"):
+            delete_image_variants(folder, id, name)
+            return
+        with app.app_context():
+            # Pages rendered before the copies existed don't list them,
+            # so the version of Pictures is bumped, which changes their ETags
+            # and makes the other workers drop their copies of them too.
+            execute_query('''
+                          UPDATE TableVersions
+                          SET version = version + 1,
+                          modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+                          WHERE name = 'Pictures';''')
+            bump_data_versions("Pictures")
+            invalidate_pages(*[(view, id) for view, table in export_views.items() if table == folder])
+    except Exception:
+        # Nothing is waiting on the thread, so the error is logged instead of being lost.
+        app.logger.exception("The smaller copies of %s/%s/%s couldn't be made", folder, id, name)
+
+
+def delete_image_variants(folder, id, name):
+    '''Deletes the smaller copies of an image'''
+    directory = get_variant_directory(folder, id)
+    if not os.path.isdir(directory):
+        return
+    for file in os.listdir(directory):
+        # Only the copies named after this image are deleted.
+        if is_variant_of(file, name):
+            os.remove(f"{directory}/{file}")
+
+
+def get_image_variants(folder, id, name):
+    '''Gets the srcset values for the smaller copies of an image'''
+    # Templates use this to let the browser pick the smallest copy that fits.
+    directory = get_variant_directory(folder, id)
+    if Image is None or not os.path.isdir(directory):
+        return {"sources": [], "fallback": ""}
+    files = set(os.listdir(directory))
+    extension = os.path.splitext(name)[1]
+    sources = []
+    fallback = ""
+    for variant_extension, variant_format, mime_type in get_variant_formats(extension):
+        srcset = ", ".join(
+            url_for("static", filename=f"images/{code_params.image_variant_folder}/{folder}/{id}/"
+                                       f"{get_variant_name(name, width, variant_extension)}") + f" {width}w"
+            for width in code_params.image_variant_widths
+            if get_variant_name(name, width, variant_extension) in files)
+        if not srcset:
+            continue
+        if mime_type:
+            sources.append((mime_type, srcset))
+        else:
+            fallback = srcset
+    return {"sources": sources, "fallback": fallback}
+
+
+app.jinja_env.globals["image_variants"] = get_image_variants
+
+
+@app.cli.command("backfill-images")  # Make the smaller copies of images that don't have them.
+@click.option("--force", is_flag=True, help="Remake copies that already exist.")
+def backfill_images(force):
+    '''Creates the smaller copies of every image that has already been uploaded'''
+    if Image is None:
+        raise click.ClickException("Pillow is needed to make copies of images.")
+    for folder in ["Moons", "Entities", "Tools", "Weathers", "Interiors"]:
+        base = f"{app.config['UPLOAD_FOLDER']}/{folder}"
+        for id in sorted(os.listdir(base)):
+            variants = get_variant_directory(folder, id)
+            existing = set(os.listdir(variants)) if os.path.isdir(variants) else set()
+            names = sorted(os.listdir(f"{base}/{id}"))
+            # Copies that aren't named after any of the images are removed,
+            # like the ones made before copies kept the extension of their original.
+            for file in existing:
+                if not any(is_variant_of(file, name) for name in names):
+                    os.remove(f"{variants}/{file}")
+            for name in names:
+                # Skip images that already have copies, unless they are being remade.
+                if not force and any(is_variant_of(file, name) for file in existing):
+                    continue
+                create_image_variants(folder, id, name)
+                click.echo(f"{folder}/{id}/{name}")
+
+
+# The content hash of every static file that has been linked to, by file name.
+# Each hash is kept with the file's modification time and size,
+# so a file that is changed or replaced gets a new hash.
+static_hashes = {}
+
+# The gzip and brotli copies of the static files that can be compressed, by file name.
+static_compressed = {}
+
+
+def get_static_hash(filename):
+    '''Gets a short hash of a static file's contents, or None if it doesn't exist'''
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    cached = static_hashes.get(filename)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    with open(path, "rb") as file:
+        file_hash = hashlib.file_digest(file, "sha1").hexdigest()[:12]
+    static_hashes[filename] = (stat.st_mtime_ns, stat.st_size, file_hash)
+    return file_hash
+
+
+def get_compressed_static_file(filename):
+    '''Gets the compressed copies of a static file, or None if it isn't compressed'''
+    # Images are already compressed, so only text files like style.css are worth compressing.
+    if mimetypes.guess_type(filename)[0] not in code_params.compressed_types:
+        return None
+    file_hash = get_static_hash(filename)
+    if file_hash is None:
+        return None
+
+    # The copies are remade if the file has changed since they were made.
+    compressed = static_compressed.get(filename)
+    if compressed is None or compressed["hash"] != file_hash:
+        with open(safe_join(app.static_folder, filename), "rb") as file:
+            data = file.read()
+        compressed = {"hash": file_hash, "gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(data, quality=11)
+        static_compressed[filename] = compressed
+    return compressed
+
+
+def precompress_static_files():
+    '''Hashes and compresses every static file that can be compressed'''
+    # This is done when the app starts, so that no request has to wait for it.
+    for directory, folders, files in os.walk(app.static_folder):
+        for file in files:
+            filename = os.path.relpath(os.path.join(directory, file), app.static_folder)
+            get_compressed_static_file(filename.replace(os.sep, "/"))
+
+
+@app.url_defaults
+def add_static_hash(endpoint, values):
+    '''Adds the content hash of a static file to its URL'''
+    # The URL changes whenever the file does,
+    # so browsers can keep the file without ever checking it again.
+    if endpoint == "static" and "v" not in values:
+        file_hash = get_static_hash(values["filename"])
+        if file_hash:
+            values["v"] = file_hash
+
+
+def send_static_file(filename):
+    '''Sends a static file, compressed if the browser accepts it'''
+    # A file requested with its current hash will never change,
+    # so it is cached for a year. Other requests are checked with the ETag.
+    fingerprinted = request.args.get("v") and request.args.get("v") == get_static_hash(filename)
+    max_age = app.config["STATIC_MAX_AGE"] if fingerprinted else None
+
+    compressed = get_compressed_static_file(filename)
+    encoding = None
+    if compressed:
+        # Brotli copies are smaller than gzip copies, so they are preferred.
+        for name in ["br", "gzip"]:
+            if name in compressed and request.accept_encodings[name]:
+                encoding = name
+                break
+
+    if encoding:
+        response = send_file(io.BytesIO(compressed[encoding]),
+                             mimetype=mimetypes.guess_type(filename)[0],
+                             etag=f"{compressed['hash']}-{encoding}",
+                             last_modified=os.path.getmtime(safe_join(app.static_folder, filename)),
+                             max_age=max_age)
+        response.content_encoding = encoding
+    else:
+        response = send_from_directory(app.static_folder, filename, max_age=max_age)
+
+    if compressed:
+        # Caches must keep the compressed and uncompressed copies apart.
+        response.vary.add("Accept-Encoding")
+    if fingerprinted:
+        response.cache_control.immutable = True
+    return response
+
+
+# Replace Flask's static file view, keeping its /static/<filename> route.
+app.view_functions["static"] = send_static_file
+
+
+# The kinds of records that can be imported, and the table each kind is added to.
+import_tables = {"moon": "Moons", "entity": "Entities", "tool": "Tools",
+                 "weather": "Weathers", "interior": "Interiors"}
+
+
+def read_import_records(data, filename):
+    '''Reads the records to import from a JSON lines or CSV file, and returns them with any problems'''
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return [], ["The file isn't UTF-8 text"]
+    if filename.lower().endswith(".csv"):
+        # CSV records are numbered by their line, with the header on line 1.
+        reader = csv.DictReader(io.StringIO(text))
+        try:
+            return [(line, record) for line, record in enumerate(reader, 2)], []
+        except csv.Error as error:
+            return [], [f"The file isn't valid CSV ({error})"]
+    records = []
+    problems = []
+    for line, record in enumerate(text.splitlines(), 1):
+        if not record.strip():
+            continue
+        try:
+            records.append((line, json.loads(record)))
+        except ValueError:
+            problems.append(f"Line {line}: this isn't valid JSON")
+    return records, problems
+
+
+# The fields that can hold a list of values, given as a JSON list or a space separated CSV cell.
+import_list_fields = ("weathers", "moons", "pictures")
+
+
+def is_import_value(value):
+    '''Checks whether a value from a record is text, a whole number or left empty'''
+    # JSON true and false are rejected too, as Python treats them as the numbers 1 and 0.
+    return value is None or (isinstance(value, (str, int)) and not isinstance(value, bool))
+
+
+def get_import_list(value):
+    '''Gets a list from a JSON list, or from the space separated values of a CSV cell'''
+    if isinstance(value, list):
+        return value
+    return str(value or "").split()
+
+
+def is_true(value):
+    '''Checks whether a JSON or CSV value means yes, like a ticked checkbox'''
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def check_import_record(record, lookups, archive):
+    '''Checks a record, and returns its kind, column values, related ids, images and problems'''
+    problems = []
+
+    def text(field, max_length=None):
+        value = str(record.get(field) or "")
+        if max_length and len(value) > max_length:
+            problems.append(f"{field} is longer than {max_length} characters")
+        # New lines are stored the same as the admin forms store them.
+        return normalize_text(value)
+
+    def number(field):
+        value = record.get(field)
+        # Numbers that are left out are 0, the same as in the admin forms.
+        if value is None or value == "":
+            return 0
+        if not is_number(value):
+            problems.append(f"{field} must be a whole number")
+            return 0
+        return int(value)
+
+    def reference(field, table):
+        value = record.get(field)
+        if not is_number(value) or int(value) not in lookups[table]:
+            problems.append(f"{field} must be the id of one of the {table}")
+            return None
+        return int(value)
+
+    def references(field, table):
+        ids = get_import_list(record.get(field))
+        missing = [str(id) for id in ids if not is_number(id) or int(id) not in lookups[table]]
+        if missing:
+            problems.append(f"{field} has ids that aren't {table}: {' '.join(missing)}")
+        return [int(id) for id in ids if is_number(id)]
+
+    # Values of the wrong type are reported before any of them are used,
+    # as the checks below expect text or whole numbers.
+    for field, value in record.items():
+        if field is None:
+            # The CSV reader puts the values past the last column under None.
+            problems.append("there are more values than the header has columns")
+        elif field in import_list_fields and isinstance(value, list):
+            if not all(is_import_value(item) for item in value):
+                problems.append(f"{field} must only have text or whole numbers in it")
+        elif not is_import_value(value):
+            problems.append(f"{field} must be text or a whole number")
+    if problems:
+        return None, None, [], [], problems
+
+    kind = record.get("type")
+    if kind not in import_tables:
+        return None, None, [], [], [f"type must be one of {', '.join(import_tables)}"]
+    name = text("name", code_params.moon_name_max_length if kind == "moon" else None)
+    if not name:
+        problems.append("name is needed")
+
+    related = []
+    if kind == "moon":
+        tier = record.get("tier")
+        if not is_number(tier) or not 1 <= int(tier) <= code_params.moon_tier_range:
+            problems.append(f"tier must be from 1 to {code_params.moon_tier_range}")
+        values = [name, reference("risk_level", "RiskLevels"), number("price"),
+                  reference("interior", "Interiors"), number("max_indoor_power"),
+                  number("max_outdoor_power"),
+                  text("conditions", code_params.moon_conditions_max_length),
+                  text("history", code_params.moon_history_max_length),
+                  text("fauna", code_params.moon_fauna_max_length),
+                  text("description", code_params.moon_description_max_length),
+                  int(tier) if is_number(tier) else None]
+        related = references("weathers", "Weathers")
+    elif kind == "entity":
+        # Invincible entities have -1 health, the same as in the admin form.
+        health = [-1, -1] if is_true(record.get("invincible")) else [number("sp_hp"), number("mp_hp")]
+        values = [name, number("danger_rating"), text("bestiary"), reference("setting", "Setting"),
+                  reference("fav_moon", "Moons"), *health, number("power"),
+                  number("max_spawned"), text("description")]
+    elif kind == "tool":
+        values = [name, number("price"), text("description"),
+                  1 if is_true(record.get("upgrade")) else 0, number("weight")]
+    elif kind == "weather":
+        values = [name, text("description")]
+        related = references("moons", "Moons")
+    else:
+        values = [name, text("description")]
+
+    # The images are named by their path in the archive,
+    # and are saved under their file name, made unique within the item's folder.
+    images = []
+    for member in [record.get("header_picture"), *get_import_list(record.get("pictures"))]:
+        if not member:
+            problems.append("header_picture is needed")
+        elif archive is None or member not in archive.NameToInfo:
+            problems.append(f"{member} isn't in the image archive")
+        elif not (mimetypes.guess_type(member)[0] or "").startswith("image/"):
+            problems.append(f"{member} isn't an image")
+        else:
+            filename = secure_filename(os.path.basename(member))
+            images.append((member, get_image_name(filename, [image[1] for image in images])))
+    return kind, values, related, images, problems
+
+
+def import_records(records, archive, variants=False):
+    '''Adds the given records and their images, either all of them or none of them'''
+    # Everything is checked before anything is written,
+    # so a bad record can't leave the import half done.
+    # The ids are checked against one copy of the cached lookup tables,
+    # so a reload part way through can't mix two versions of them.
+    lookups = lookup_tables
+    checked = []
+    problems = []
+    for line, record in records:
+        if not isinstance(record, dict):
+            problems.append(f"Line {line}: each record must be an object")
+            continue
+        kind, values, related, images, record_problems = check_import_record(record, lookups, archive)
+        problems += [f"Line {line}: {problem}" for problem in record_problems]
+        checked.append((kind, values, related, images))
+    if problems:
+        return {}, problems
+
+    db = open_connection()
+    folders = []
+    try:
+        # The write lock is taken first, so the ids can't be taken by another request.
+        db.execute("BEGIN IMMEDIATE;")
+        next_ids = {table: db.execute(f"SELECT IFNULL(MAX(id), 0) + 1 FROM {table};").fetchone()[0]
+                    for table in import_tables.values()}
+        first_ids = dict(next_ids)
+        rows = {table: [] for table in import_tables.values()}
+        moon_weathers = []
+        pictures = []
+        search = []
+        for kind, values, related, images in checked:
+            table = import_tables[kind]
+            id = next_ids[table]
+            next_ids[table] += 1
+
+            # Every image is copied out of the archive straight into the item's folder.
+            folder = f"{app.config['UPLOAD_FOLDER']}/{table}/{id}"
+            os.mkdir(folder)
+            folders.append(folder)
+            for member, filename in images:
+                with archive.open(member) as source, open(f"{folder}/{filename}", "wb") as target:
+                    shutil.copyfileobj(source, target)
+
+            # The first image is the header picture, and the rest are the gallery.
+            rows[table].append((id, *values, images[0][1]))
+            pictures += [(table, id, filename, sort_order, archive.getinfo(member).file_size)
+                         for sort_order, (member, filename) in enumerate(images[1:])]
+            if kind == "moon":
+                moon_weathers += [(id, weather_id) for weather_id in related]
+            elif kind == "weather":
+                moon_weathers += [(moon_id, id) for moon_id in related]
+            search.append((table, id))
+
+        # Each table is written with one statement, and all of them are committed together.
+        columns = {
+            "Moons": "id, name, risk_level, price, interior, max_indoor_power, max_outdoor_power, "
+                     "conditions, history, fauna, description, tier, header_picture",
+            "Entities": "id, name, danger, bestiary, setting, fav_moon, sp_hp, mp_hp, "
+                        "power, max_spawned, description, header_picture",
+            "Tools": "id, name, price, description, upgrade, weight, header_picture",
+            "Weathers": "id, name, description, header_picture",
+            "Interiors": "id, name, description, header_picture",
+        }
+        for table, table_rows in rows.items():
+            placeholders = ", ".join("?" * len(columns[table].split(", ")))
+            db.executemany(f"INSERT INTO {table} ({columns[table]}) VALUES ({placeholders});",
+                           table_rows)
+            render_stored_text(db, table, first_ids[table])
+        db.executemany("INSERT OR IGNORE INTO MoonWeathers (moon_id, weather_id) VALUES (?, ?);",
+                       moon_weathers)
+        db.executemany('''
+                       INSERT INTO Pictures (owner_type, owner_id, filename, sort_order, byte_size)
+                       VALUES (?, ?, ?, ?, ?);''', pictures)
+        for table in import_tables.values():
+            db.executemany(f'''
+                           INSERT INTO Search (owner_type, owner_id, name, bestiary,
+                           conditions, history, fauna, description)
+                           SELECT ?, id, {search_columns[table]} FROM {table}
+                           WHERE id=?;''', [item for item in search if item[0] == table])
+        db.commit()
+    except Exception:
+        # Nothing is kept if any part of the import fails.
+        db.rollback()
+        for folder in folders:
+            shutil.rmtree(folder, ignore_errors=True)
+        raise
+    finally:
+        db.close()
+
+    # So many pages can change that the whole page cache is cleared, and the whole site exported again.
+    refresh_snapshot()
+    bump_data_versions(*[table for table, table_rows in rows.items() if table_rows],
+                       "MoonWeathers", "Pictures")
+    clear_page_cache()
+    if app.config["STATIC_EXPORT_FOLDER"]:
+        export_changed_pages(get_export_pages())
+
+    # The smaller copies are slow to make, so by default they are left for "flask backfill-images".
+    if variants:
+        for owner_type, owner_id in search:
+            for file in os.listdir(f"{app.config['UPLOAD_FOLDER']}/{owner_type}/{owner_id}"):
+                queue_image_variants(owner_type, owner_id, file)
+    return {kind: len(rows[table]) for kind, table in import_tables.items() if rows[table]}, []
+
+
+@app.cli.command("import-records")  # Add many records and their images at once.
+@click.argument("records", type=click.Path(exists=True, dir_okay=False))
+@click.option("--images", type=click.Path(exists=True, dir_okay=False),
+              help="A zip archive of the images that the records name.")
+@click.option("--variants", is_flag=True, help="Make the smaller copies of the images straight away.")
+def import_records_command(records, images, variants):
+    '''Imports records from a JSON lines or CSV file, with their images from a zip archive'''
+    with open(records, "rb") as file:
+        parsed, problems = read_import_records(file.read(), records)
+    if not problems:
+        archive = zipfile.ZipFile(images) if images else None
+        counts, problems = import_records(parsed, archive, variants)
+    if problems:
+        raise click.ClickException("Nothing was imported.\n" + "\n".join(problems))
+    for kind, count in counts.items():
+        click.echo(f"Imported {count} {kind} records")
+
+
 @app.route("/")  # Home page for selection.
 def home():
     # The home page sections are stored in the database,
-    # so it needs to be accessed.
-    params = execute_query('''
-                           SELECT display_name, description, link
-                           FROM HomePageLinks;''')
-
+    # and are served from the in-memory copy.
     return render_template("main.html",
-                           params=params,
+                           params=home_page_links,
                            title=get_title("/"),
-                           admin=admin)
+                           admin=is_admin())
 
 
 @app.route("/entity", methods=['GET', 'POST'])  # Entity list.
+@conditional_page("Entities")
+@cache_page
 def entities():
     # Gather entities.
     data = execute_query('''
@@ -171,71 +2032,199 @@ def entities():
             "setting": data[i][2]
         } for i in range(len(data)) if data[i][2] == a + 1])
 
-    return render_template("entities/entitylist.html",
-                           params=params,
-                           title=get_title("/entity"),
-                           admin=admin)
-
-
-@app.route("/entity/<int:id>")  # Entity data page.
-def entity(id):
-    # Gather entity data.
-    data = execute_query('''
+    return render_page("entities/entitylist.html",
+                       params=params,
+                       title=get_title("/entity"),
+                       admin=is_admin())
+
+
+class Reference(NamedTuple):
+    '''The id and name of a related item'''
+    id: int
+    name: str
+
+
+# The items shown on the data pages.
+# They are built once from the database with their text rendered and their related items resolved,
+# and they can't be changed, so the same objects can be shared by every request.
+@dataclass(frozen=True, slots=True)
+class Moon:
+    '''A moon, with its interior and weathers'''
+    id: int
+    name: str
+    risk_level: str
+    price: int
+    interior: Reference
+    max_indoor_power: int
+    max_outdoor_power: int
+    conditions: str
+    history: str
+    fauna: str
+    description: str
+    tier: int
+    header_picture: str
+    weathers: tuple
+    pictures: tuple
+    conditions_html: Markup
+    history_html: Markup
+    fauna_html: Markup
+    description_html: Markup
+
+
+@dataclass(frozen=True, slots=True)
+class Entity:
+    '''An entity, with its favourite moon'''
+    id: int
+    name: str
+    danger: int
+    bestiary: str
+    setting: str
+    fav_moon: Reference
+    sp_hp: int
+    mp_hp: int
+    power: int
+    max_spawned: int
+    description: str
+    header_picture: str
+    pictures: tuple
+    bestiary_html: Markup
+    description_html: Markup
+
+
+@dataclass(frozen=True, slots=True)
+class Tool:
+    '''A tool'''
+    id: int
+    name: str
+    price: int
+    description: str
+    upgrade: int
+    weight: int
+    header_picture: str
+    pictures: tuple
+    description_html: Markup
+
+
+@dataclass(frozen=True, slots=True)
+class Weather:
+    '''A weather, with the moons that can have it'''
+    id: int
+    name: str
+    description: str
+    header_picture: str
+    moons: tuple
+    pictures: tuple
+    description_html: Markup
+
+
+@dataclass(frozen=True, slots=True)
+class Interior:
+    '''An interior, with the moons that have it most commonly'''
+    id: int
+    name: str
+    description: str
+    header_picture: str
+    moons: tuple
+    pictures: tuple
+    description_html: Markup
+
+
+def get_html(html):
+    '''Marks the rendered HTML of a text column as safe to put in a page'''
+    # The HTML was escaped when it was rendered, so the templates show it as it is.
+    return Markup(html) if html else html
+
+
+def get_references(related):
+    '''Converts a JSON array of [id, name] pairs into a tuple of references'''
+    return tuple(Reference(*pair) for pair in json.loads(related))
+
+
+# Every item, by table and then by id, so a data page finds its item without a query.
+# The whole repository is rebuilt and swapped in at once when any of its tables change.
+repository = {}
+repository_tables = {"Moons", "Entities", "Tools", "Weathers", "Interiors",
+                     "RiskLevels", "Setting", "MoonWeathers", "Pictures"}
+
+
+def load_repository():
+    '''Loads every item into memory'''
+    global repository
+    # The lock keeps two writes from swapping in their repositories out of order.
+    with reference_lock:
+        items = {"Moons": query_moons("1"),
+                 "Entities": query_entities("1"),
+                 "Tools": query_tools("1"),
+                 "Weathers": query_weathers("1"),
+                 "Interiors": query_interiors("1")}
+        repository = {table: {item.id: item for item in table_items}
+                      for table, table_items in items.items()}
+
+
+def get_item(table, id):
+    '''Gets an item from the repository, or None if it doesn't exist'''
+    return repository[table].get(id)
+
+
+def query_entities(condition, args=(), limit=None):
+    '''Gets the data of the entities that meet the given SQL condition, in id order'''
+    # Both the entity data page and the API use this query.
+    data = execute_query(f'''
                         SELECT Entities.name, danger, bestiary, Setting.name,
                         Moons.name, sp_hp, mp_hp, power, max_spawned,
-                        Entities.description, Entities.pictures, Moons.id,
-                        Entities.header_picture, Entities.id
+                        Entities.description, Moons.id,
+                        Entities.header_picture, Entities.id,
+                        (SELECT json_group_array(filename) FROM (
+                            SELECT filename FROM Pictures
+                            WHERE owner_type = 'Entities' AND owner_id = Entities.id
+                            ORDER BY sort_order)),
+                        bestiary_html, Entities.description_html
                         FROM Entities
                         JOIN Moons ON Entities.fav_moon = Moons.id
                         JOIN Setting ON Entities.setting = Setting.id
-                        WHERE Entities.id = ?;''', (id,))
+                        WHERE {condition}
+                        ORDER BY Entities.id
+                        LIMIT ?;''', (*args, -1 if limit is None else limit))
+
+    # The gallery pictures come back as a JSON array,
+    # so that each entity only needs one query.
+    return [Entity(id=row[12],
+                   name=row[0],
+                   danger=row[1],
+                   bestiary=row[2],
+                   setting=row[3],
+                   fav_moon=Reference(row[10], row[4]),
+                   sp_hp=row[5],
+                   mp_hp=row[6],
+                   power=row[7],
+                   max_spawned=row[8],
+                   description=row[9],
+                   header_picture=row[11],
+                   pictures=tuple(json.loads(row[13])),
+                   bestiary_html=get_html(row[14]),
+                   description_html=get_html(row[15])) for row in data]
+
+
+@app.route("/entity/<int:id>")  # Entity data page.
+@conditional_page("Entities", "Moons", "Setting", "Pictures")
+@cache_page
+def entity(id):
+    # Gather entity data.
+    params = get_item("Entities", id)
 
     # Return a 404 error if the data doesn't exist.
-    if not data:
+    if not params:
         abort(404)
 
-    data = data[0]
-
-    # The pictures value will convert the given string to a list.
-    # The picture names are stored as a string in the database,
-    # containing each file name seperated by spaces.
-    # set_picture_list converts this to a list,
-    # to guarantee that the variable is usable and can't be null.
-    params = {
-        "name": data[0],
-        "danger": data[1],
-        "bestiary": data[2],
-        "setting": data[3],
-        "fav_moon": data[4],
-        "sp_hp": data[5],
-        "mp_hp": data[6],
-        "power": data[7],
-        "max_spawned": data[8],
-        "description": data[9],
-        "pictures": set_picture_list(data[10]),
-        "fav_moon_id": data[11],
-        "header_picture": data[12],
-        "id": data[13]
-    }
-
-    # Since new lines cannot be stored properly in a string in sql,
-    # new lines in these strings are replaced with the string "\n".
-    # The new line strings are converted back into actual new lines,
-    # after being fetched from the database.
-    # These variables are also checked to not be null,
-    # so that .replace doesn't break the program.
-    if params["bestiary"]:
-        params["bestiary"] = params["bestiary"].replace("\\n", "\n")
-    if params["description"]:
-        params["description"] = params["description"].replace("\\n", "\n")
-
-    return render_template("entities/entity.html",
-                           params=params,
-                           title=params["name"],
-                           admin=admin)
+    return render_page("entities/entity.html",
+                       params=params,
+                       title=params.name,
+                       admin=is_admin())
 
 
 @app.route("/moons")  # Moon list.
+@conditional_page("Moons")
+@cache_page
 def moons():
     # Gather moons.
     data = execute_query('''
@@ -255,80 +2244,78 @@ def moons():
     return render_template("moons/moonlist.html",
                            params=params,
                            title=get_title("/moons"),
-                           admin=admin,
+                           admin=is_admin(),
                            moon_tiers=code_params.moon_tiers)
 
 
-@app.route("/moons/<int:id>")  # Moon data page.
-def moon(id):
-    # Gather moon data.
-    data = execute_query('''
+def query_moons(condition, args=(), limit=None):
+    '''Gets the data of the moons that meet the given SQL condition, in id order'''
+    # Both the moon data page and the API use this query.
+    data = execute_query(f'''
                         SELECT Moons.name, RiskLevels.name, price, Interiors.id,
                         Interiors.name, max_indoor_power, max_outdoor_power,
                         conditions, history, fauna, Moons.description, tier,
-                        Moons.pictures, Moons.id, Moons.header_picture
+                        Moons.id, Moons.header_picture,
+                        (SELECT json_group_array(json_array(id, name)) FROM (
+                            SELECT Weathers.id, Weathers.name FROM MoonWeathers
+                            JOIN Weathers ON MoonWeathers.weather_id = Weathers.id
+                            WHERE MoonWeathers.moon_id = Moons.id
+                            ORDER BY Weathers.id)),
+                        (SELECT json_group_array(filename) FROM (
+                            SELECT filename FROM Pictures
+                            WHERE owner_type = 'Moons' AND owner_id = Moons.id
+                            ORDER BY sort_order)),
+                        conditions_html, history_html, fauna_html, Moons.description_html
                         FROM Moons
                         JOIN RiskLevels ON Moons.risk_level = RiskLevels.id
                         JOIN Interiors ON Moons.interior = Interiors.id
-                        WHERE Moons.id = ?;''', (id,))
+                        WHERE {condition}
+                        ORDER BY Moons.id
+                        LIMIT ?;''', (*args, -1 if limit is None else limit))
+
+    # The weathers and gallery pictures come back as JSON arrays,
+    # so that each moon only needs one query.
+    return [Moon(id=row[12],
+                 name=row[0],
+                 risk_level=row[1],
+                 price=row[2],
+                 interior=Reference(row[3], row[4]),
+                 max_indoor_power=row[5],
+                 max_outdoor_power=row[6],
+                 conditions=row[7],
+                 history=row[8],
+                 fauna=row[9],
+                 description=row[10],
+                 tier=row[11],
+                 header_picture=row[13],
+                 weathers=get_references(row[14]),
+                 pictures=tuple(json.loads(row[15])),
+                 conditions_html=get_html(row[16]),
+                 history_html=get_html(row[17]),
+                 fauna_html=get_html(row[18]),
+                 description_html=get_html(row[19])) for row in data]
+
+
+@app.route("/moons/<int:id>")  # Moon data page.
+@conditional_page("Moons", "RiskLevels", "Interiors", "Weathers", "MoonWeathers", "Pictures")
+@cache_page
+def moon(id):
+    # Gather moon data.
+    params = get_item("Moons", id)
+
     # Return a 404 error if the data doesn't exist.
-    if not data:
+    if not params:
         abort(404)
 
-    data = data[0]
-
-    # Moons will have weathers that they can have,
-    # so this needs to be queried seperately,
-    # since they can have multiple weathers
-    weatherdata = execute_query('''
-                                SELECT id, name FROM Weathers WHERE id IN (
-                                SELECT weather_id FROM MoonWeathers WHERE moon_id = ?);''', (id,))
-
-    # The pictures value will convert the given string to a list.
-    # The picture names are stored as a string in the database,
-    # containing each file name seperated by spaces.
-    # set_picture_list converts this to a list,
-    # to guarantee that the variable is usable and can't be null.
-    params = {
-        "name": data[0],
-        "risk_level": data[1],
-        "price": data[2],
-        "interior": {"id": data[3], "name": data[4]},
-        "max_indoor_power": data[5],
-        "max_outdoor_power": data[6],
-        "conditions": data[7],
-        "history": data[8],
-        "fauna": data[9],
-        "description": data[10],
-        "tier": data[11],
-        "pictures": set_picture_list(data[12]),
-        "weathers": weatherdata,
-        "id": data[13],
-        "header_picture": data[14]
-    }
-
-    # Since new lines cannot be stored properly in a string in sql,
-    # new lines in these strings are replaced with the string "\n".
-    # The new line strings are converted back into actual new lines,
-    # after being fetched from the database.
-    # These variables are also checked to not be null,
-    # so that .replace doesn't break the program.
-    if params["conditions"]:
-        params["conditions"] = params["conditions"].replace("\\n", "\n")
-    if params["history"]:
-        params["history"] = params["history"].replace("\\n", "\n")
-    if params["fauna"]:
-        params["fauna"] = params["fauna"].replace("\\n", "\n")
-    if params["description"]:
-        params["description"] = params["description"].replace("\\n", "\n")
-
-    return render_template("moons/moon.html",
-                           params=params,
-                           title=params["name"],
-                           admin=admin)
+    return render_page("moons/moon.html",
+                       params=params,
+                       title=params.name,
+                       admin=is_admin())
 
 
 @app.route("/tools", methods=['GET', 'POST'])  # Tool list.
+@conditional_page("Tools")
+@cache_page
 def tools():
     # Gather tools.
     data = execute_query('''
@@ -346,59 +2333,61 @@ def tools():
             "price": data[i][3]
         } for i in range(len(data)) if data[i][2] == a])
 
-    return render_template("tools/toollist.html",
-                           params=params,
-                           title=get_title("/tools"),
-                           admin=admin)
+    return render_page("tools/toollist.html",
+                       params=params,
+                       title=get_title("/tools"),
+                       admin=is_admin())
+
+
+def query_tools(condition, args=(), limit=None):
+    '''Gets the data of the tools that meet the given SQL condition, in id order'''
+    # Both the tool data page and the API use this query.
+    data = execute_query(f'''
+                        SELECT name, price, description, upgrade, weight,
+                        id, header_picture,
+                        (SELECT json_group_array(filename) FROM (
+                            SELECT filename FROM Pictures
+                            WHERE owner_type = 'Tools' AND owner_id = Tools.id
+                            ORDER BY sort_order)),
+                        description_html
+                        FROM Tools
+                        WHERE {condition}
+                        ORDER BY id
+                        LIMIT ?;''', (*args, -1 if limit is None else limit))
+
+    # The gallery pictures come back as a JSON array,
+    # so that each tool only needs one query.
+    return [Tool(id=row[5],
+                 name=row[0],
+                 price=row[1],
+                 description=row[2],
+                 upgrade=row[3],
+                 weight=row[4],
+                 header_picture=row[6],
+                 pictures=tuple(json.loads(row[7])),
+                 description_html=get_html(row[8])) for row in data]
 
 
 @app.route("/tools/<int:id>")  # Tool data page.
+@conditional_page("Tools", "Pictures")
+@cache_page
 def tool(id):
     # Gather tool data.
-    data = execute_query('''
-                        SELECT name, price, description, upgrade, weight,
-                        pictures, id, header_picture
-                        FROM Tools
-                        WHERE id = ?;''', (id,))
+    params = get_item("Tools", id)
 
     # Return a 404 error if the data doesn't exist.
-    if not data:
+    if not params:
         abort(404)
 
-    data = data[0]
-
-    # The pictures value will convert the given string to a list.
-    # The picture names are stored as a string in the database,
-    # containing each file name seperated by spaces.
-    # set_picture_list converts this to a list,
-    # to guarantee that the variable is usable and can't be null.
-    params = {
-        "name": data[0],
-        "price": data[1],
-        "description": data[2],
-        "upgrade": data[3],
-        "weight": data[4],
-        "pictures": set_picture_list(data[5]),
-        "id": data[6],
-        "header_picture": data[7]
-    }
-
-    # Since new lines cannot be stored properly in a string in sql,
-    # new lines in these strings are replaced with the string "\n".
-    # The new line strings are converted back into actual new lines,
-    # after being fetched from the database.
-    # This variable is also checked to not be null,
-    # so that .replace doesn't break the program.
-    if params["description"]:
-        params["description"] = params["description"].replace("\\n", "\n")
-
-    return render_template("tools/tool.html",
-                           params=params,
-                           title=params["name"],
-                           admin=admin)
+    return render_page("tools/tool.html",
+                       params=params,
+                       title=params.name,
+                       admin=is_admin())
 
 
 @app.route("/weathers")  # Weather list.
+@conditional_page("Weathers")
+@cache_page
 def weathers():
     # Gather weathers.
     data = execute_query('''
@@ -413,60 +2402,60 @@ def weathers():
     return render_template("weathers/weatherlist.html",
                            params=params,
                            title=get_title("/weathers"),
-                           admin=admin)
+                           admin=is_admin())
+
+
+def query_weathers(condition, args=(), limit=None):
+    '''Gets the data of the weathers that meet the given SQL condition, in id order'''
+    # Both the weather data page and the API use this query.
+    data = execute_query(f'''
+                        SELECT name, description, header_picture, id,
+                        (SELECT json_group_array(json_array(id, name)) FROM (
+                            SELECT Moons.id, Moons.name FROM MoonWeathers
+                            JOIN Moons ON MoonWeathers.moon_id = Moons.id
+                            WHERE MoonWeathers.weather_id = Weathers.id
+                            ORDER BY Moons.id)),
+                        (SELECT json_group_array(filename) FROM (
+                            SELECT filename FROM Pictures
+                            WHERE owner_type = 'Weathers' AND owner_id = Weathers.id
+                            ORDER BY sort_order)),
+                        description_html
+                        FROM Weathers
+                        WHERE {condition}
+                        ORDER BY id
+                        LIMIT ?;''', (*args, -1 if limit is None else limit))
+
+    # The moons and gallery pictures come back as JSON arrays,
+    # so that each weather only needs one query.
+    return [Weather(id=row[3],
+                    name=row[0],
+                    description=row[1],
+                    header_picture=row[2],
+                    moons=get_references(row[4]),
+                    pictures=tuple(json.loads(row[5])),
+                    description_html=get_html(row[6])) for row in data]
 
 
 @app.route("/weathers/<int:id>")  # Weather data page
+@conditional_page("Weathers", "Moons", "MoonWeathers", "Pictures")
+@cache_page
 def weather(id):
     # Gather weather data.
-    data = execute_query('''
-                        SELECT name, description, pictures, header_picture, id
-                        FROM Weathers
-                        WHERE id = ?;''', (id,))
+    params = get_item("Weathers", id)
 
     # Return a 404 error if the data doesn't exist.
-    if not data:
+    if not params:
         abort(404)
 
-    data = data[0]
-
-    # Weathers will have moons that can have them,
-    # so this needs to be queried seperately,
-    # since they can belong to multiple moons.
-    moondata = execute_query('''
-                            SELECT id, name FROM Moons WHERE id IN (
-                            SELECT moon_id FROM MoonWeathers WHERE weather_id=?);''', (id,))
-
-    # The pictures value will convert the given string to a list.
-    # The picture names are stored as a string in the database,
-    # containing each file name seperated by spaces.
-    # set_picture_list converts this to a list,
-    # to guarantee that the variable is usable and can't be null.
-    params = {
-        "name": data[0],
-        "moons": moondata,
-        "description": data[1],
-        "pictures": set_picture_list(data[2]),
-        "header_picture": data[3],
-        "id": data[4]
-    }
-
-    # Since new lines cannot be stored properly in a string in sql,
-    # new lines in these strings are replaced with the string "\n".
-    # The new line strings are converted back into actual new lines,
-    # after being fetched from the database.
-    # This variable is also checked to not be null,
-    # so that .replace doesn't break the program.
-    if params["description"]:
-        params["description"] = params["description"].replace("\\n", "\n")
-
-    return render_template("weathers/weather.html",
-                           params=params,
-                           title=params["name"],
-                           admin=admin)
+    return render_page("weathers/weather.html",
+                       params=params,
+                       title=params.name,
+                       admin=is_admin())
 
 
 @app.route("/interiors")  # Interior list
+@conditional_page("Interiors")
+@cache_page
 def interiors():
     # Gather interiors.
     data = execute_query('''
@@ -485,71 +2474,214 @@ def interiors():
     return render_template("interiors/interiorlist.html",
                            params=params,
                            title=get_title("/interiors"),
-                           admin=admin)
+                           admin=is_admin())
+
+
+def query_interiors(condition, args=(), limit=None):
+    '''Gets the data of the interiors that meet the given SQL condition, in id order'''
+    # Both the interior data page and the API use this query.
+    data = execute_query(f'''
+                        SELECT name, description, header_picture, id,
+                        (SELECT json_group_array(json_array(id, name)) FROM (
+                            SELECT id, name FROM Moons
+                            WHERE interior = Interiors.id
+                            ORDER BY id)),
+                        (SELECT json_group_array(filename) FROM (
+                            SELECT filename FROM Pictures
+                            WHERE owner_type = 'Interiors' AND owner_id = Interiors.id
+                            ORDER BY sort_order)),
+                        description_html
+                        FROM Interiors
+                        WHERE {condition}
+                        ORDER BY id
+                        LIMIT ?;''', (*args, -1 if limit is None else limit))
+
+    # The moons and gallery pictures come back as JSON arrays,
+    # so that each interior only needs one query.
+    # Interiors will have moons that have them most commonly.
+    return [Interior(id=row[3],
+                     name=row[0],
+                     description=row[1],
+                     header_picture=row[2],
+                     moons=get_references(row[4]),
+                     pictures=tuple(json.loads(row[5])),
+                     description_html=get_html(row[6])) for row in data]
 
 
 @app.route("/interiors/<int:id>")  # Interior data page.
+@conditional_page("Interiors", "Moons", "Pictures")
+@cache_page
 def interior(id):
     # Gather interior data.
-    data = execute_query('''
-                        SELECT name, description, pictures, header_picture, id
-                        FROM Interiors
-                        WHERE id = ?;''', (id,))
-
-    # Interiors will have moons that have them most commonly,
-    # so this needs to be queried seperately,
-    # since they can belong to multiple moons.
-    moon_data = execute_query('''
-                              SELECT id, name
-                              FROM Moons
-                              WHERE interior=?''', (id,))
+    params = get_item("Interiors", id)
 
     # Return a 404 error if the data doesn't exist.
-    if not data:
+    if not params:
         abort(404)
 
-    data = data[0]
-
-    # The pictures value will convert the given string to a list.
-    # The picture names are stored as a string in the database,
-    # containing each file name seperated by spaces.
-    # set_picture_list converts this to a list,
-    # to guarantee that the variable is usable and can't be null.
-    params = {
-        "name": data[0],
-        "description": data[1],
-        "pictures": set_picture_list(data[2]),
-        "header_picture": data[3],
-        "id": data[4]
-    }
+    return render_page("interiors/interior.html",
+                       params=params,
+                       title=params.name,
+                       admin=is_admin(),
+                       moon_data=params.moons)
+
+
+@app.route("/search")  # Search results.
+def search():
+    # The search text is sent in the URL, so results can be linked to.
+    query = request.args.get("q", "").strip()
+    return render_template("search.html",
+                           query=query,
+                           results=search_items(query),
+                           title=get_title("/search"),
+                           admin=is_admin())
+
+
+def api_error(status, message):
+    '''Returns an API error response with the given status code and message'''
+    return {"error": message}, status
+
+
+def to_api(folder, params):
+    '''Converts an item, as used by its data page, into its API form'''
+    # The rendered HTML is only for the data pages.
+    item = {key: value for key, value in asdict(params).items() if not key.endswith("_html")}
+    # Pictures are given as URLs, so clients don't need to know where the images are kept.
+    directory = f"images/{folder}/{params.id}"
+    if item["header_picture"]:
+        item["header_picture"] = url_for("static", filename=f"{directory}/{item['header_picture']}")
+    item["pictures"] = [url_for("static", filename=f"{directory}/{name}") for name in item["pictures"]]
+    # Related items are embedded as objects with their id and name.
+    for key in ["weathers", "moons"]:
+        if key in item:
+            item[key] = [related._asdict() for related in item[key]]
+    for key in ["interior", "fav_moon"]:
+        if key in item:
+            item[key] = item[key]._asdict()
+    return item
+
+
+def get_api_fields():
+    '''Gets the fields asked for with ?fields=, or None if every field is wanted'''
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    # The id is always included, as it is needed to ask for the next page.
+    return {"id"} | {field.strip() for field in fields.split(",") if field.strip()}
 
-    # Since new lines cannot be stored properly in a string in sql,
-    # new lines in these strings are replaced with the string "\n".
-    # The new line strings are converted back into actual new lines,
-    # after being fetched from the database.
-    # This variable is also checked to not be null,
-    # so that .replace doesn't break the program.
-    if params["description"]:
-        params["description"] = params["description"].replace("\\n", "\n")
 
-    return render_template("interiors/interior.html",
-                           params=params,
-                           title=params['name'],
-                           admin=admin,
-                           moon_data=moon_data)
+def project(item, fields):
+    '''Keeps only the given fields of an API item'''
+    if fields is None:
+        return item
+    return {key: value for key, value in item.items() if key in fields}
+
+
+def api_list(query, table):
+    '''Returns a page of items for the API, starting after the id given with ?after='''
+    after = request.args.get("after", "0")
+    limit = request.args.get("limit", str(code_params.api_default_limit))
+    if not is_number(after) or not is_number(limit) or int(limit) < 1:
+        return api_error(400, "after and limit must be whole numbers, and limit must be at least 1")
+    limit = min(int(limit), code_params.api_max_limit)
+    fields = get_api_fields()
+
+    # Pages are found by id rather than by offset,
+    # so the database jumps straight to the first item of any page using the primary key.
+    # One extra item is fetched to find out whether there is a next page.
+    items = query(f"{table}.id > ?", (int(after),), limit + 1)
+    next_page = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_page = url_for(request.endpoint, after=items[-1].id, limit=limit,
+                            fields=request.args.get("fields"))
+
+    items = [to_api(table, item) for item in items]
+    if items and fields is not None and not fields <= items[0].keys():
+        return api_error(400, f"Unknown fields: {', '.join(sorted(fields - items[0].keys()))}")
+    return {"data": [project(item, fields) for item in items], "next": next_page}
+
+
+def api_item(table, id):
+    '''Returns a single item for the API'''
+    params = get_item(table, id)
+    if not params:
+        return api_error(404, f"There is no item with the id {id}")
+    item = to_api(table, params)
+    fields = get_api_fields()
+    if fields is not None and not fields <= item.keys():
+        return api_error(400, f"Unknown fields: {', '.join(sorted(fields - item.keys()))}")
+    return project(item, fields)
+
+
+@app.route("/api/v1/moons")  # Moon list for the API.
+@conditional_page("Moons", "RiskLevels", "Interiors", "Weathers", "MoonWeathers", "Pictures")
+def api_moons():
+    return api_list(query_moons, "Moons")
+
+
+@app.route("/api/v1/moons/<int:id>")  # Moon data for the API.
+@conditional_page("Moons", "RiskLevels", "Interiors", "Weathers", "MoonWeathers", "Pictures")
+def api_moon(id):
+    return api_item("Moons", id)
+
+
+@app.route("/api/v1/entities")  # Entity list for the API.
+@conditional_page("Entities", "Moons", "Setting", "Pictures")
+def api_entities():
+    return api_list(query_entities, "Entities")
+
+
+@app.route("/api/v1/entities/<int:id>")  # Entity data for the API.
+@conditional_page("Entities", "Moons", "Setting", "Pictures")
+def api_entity(id):
+    return api_item("Entities", id)
+
+
+@app.route("/api/v1/tools")  # Tool list for the API.
+@conditional_page("Tools", "Pictures")
+def api_tools():
+    return api_list(query_tools, "Tools")
+
+
+@app.route("/api/v1/tools/<int:id>")  # Tool data for the API.
+@conditional_page("Tools", "Pictures")
+def api_tool(id):
+    return api_item("Tools", id)
+
+
+@app.route("/api/v1/weathers")  # Weather list for the API.
+@conditional_page("Weathers", "Moons", "MoonWeathers", "Pictures")
+def api_weathers():
+    return api_list(query_weathers, "Weathers")
+
+
+@app.route("/api/v1/weathers/<int:id>")  # Weather data for the API.
+@conditional_page("Weathers", "Moons", "MoonWeathers", "Pictures")
+def api_weather(id):
+    return api_item("Weathers", id)
+
+
+@app.route("/api/v1/interiors")  # Interior list for the API.
+@conditional_page("Interiors", "Moons", "Pictures")
+def api_interiors():
+    return api_list(query_interiors, "Interiors")
+
+
+@app.route("/api/v1/interiors/<int:id>")  # Interior data for the API.
+@conditional_page("Interiors", "Moons", "Pictures")
+def api_interior(id):
+    return api_item("Interiors", id)
 
 
 @app.route("/login")  # Page for the admin login.
 def login():
-    global login_message
-    # The login message should only be displayed once,
-    # so the current login message is stored, and then reset.
-    current_login_message = login_message
-    login_message = ""
+    # The login message is only displayed once.
+    current_login_message = get_message("login")
 
     return render_template("login.html",
                            login_message=current_login_message,
-                           admin=admin,
+                           admin=is_admin(),
                            # The usernames and passwords have maximum lengths,
                            # so this is passed through as a variable.
                            username_max_length=code_params.username_max_length,
@@ -559,87 +2691,73 @@ def login():
 
 @app.route("/loginregister", methods=['GET', 'POST'])  # Register the inputted username and password.
 def loginregister():
-    global login_message, admin
     # Boolean to store whether the login was a success.
     success = False
 
-    # The id of the user with the given username.
-    userid = 0
-
     # Fetch the HTML input data.
     username = request.form.get("username")
     password = request.form.get("password")
 
     # Check if username is null.
     if not username:
-        login_message = code_params.login_failure_message
+        flash(code_params.login_failure_message, "login")
         return app.redirect("/login")
 
     # Check if password is null.
     if not password:
-        login_message = code_params.login_failure_message
+        flash(code_params.login_failure_message, "login")
         return app.redirect("/login")
 
     # Check if the given username is too long.
     if len(username) > code_params.username_max_length:
-        login_message = code_params.username_too_large_message
+        flash(code_params.username_too_large_message, "login")
         return app.redirect("/login")
 
     # Check if the given password is too long.
     if len(password) > code_params.password_max_length:
-        login_message = code_params.password_too_large_message
+        flash(code_params.password_too_large_message, "login")
         return app.redirect("/login")
 
-    # Gather the admin login data.
-    userdata = execute_query("SELECT id, username FROM AdminLogins")
-
-    # Try to find the given username in the admin usernames.
-    # If the username is found, assign userid to that admin user id.
-    for user in userdata:
-        if username == user[1]:
+    # Find the password hash of the admin with the given username.
+    # The usernames are indexed, so this doesn't need to read every admin.
+    userdata = execute_query('''
+                             SELECT passwordhash
+                             FROM AdminLogins
+                             WHERE username=?;''', (username,))
 
-            success = True
-            userid = user[0]
-            break
     # Check if the given username was found in the admin usernames.
-    if success:
-        success = False
+    if userdata:
         # Hash the given password and compare it with the stored password hash.
         # Storing a hash in the database is much more secure than storing a password,
         # and it is still very easy to check if a given password is correct.
-        if check_password_hash(execute_query("SELECT passwordhash FROM AdminLogins WHERE id=?",
-                                             (userid,))[0][0], password):
+        if check_password_hash(userdata[0][0], password):
             # If the password is correct the user will be logged in as admin.
-            admin = True
-            login_message = code_params.login_success_message
+            session["admin"] = True
+            flash(code_params.login_success_message, "login")
             success = True
     # If username or password was wrong, return a failure message.
     if not success:
-        login_message = code_params.login_failure_message
+        flash(code_params.login_failure_message, "login")
     return app.redirect("/login")
 
 
 @app.route("/logout")  # Log the user out.
 def logout():
-    global admin
-    admin = False
+    session.pop("admin", None)
     return app.redirect("/")
 
 
 @app.route("/admin/moons/add")  # Page to add details for a new moon.
 def add_moon_page():
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+    if is_admin():
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         # The page needs to know the risk levels, interiors, and weathers
         # for the drop down options.
-        risk_level_entries = execute_query("SELECT id, name FROM RiskLevels;")
-        interior_entries = execute_query("SELECT id, name FROM Interiors;")
-        weather_entries = execute_query("SELECT id, name FROM Weathers;")
+        risk_level_entries = get_lookup_entries("RiskLevels")
+        interior_entries = get_lookup_entries("Interiors")
+        weather_entries = get_lookup_entries("Weathers")
         return render_template("moons/moonadminadd.html",
                                risk_levels=risk_level_entries,
                                interiors=interior_entries,
@@ -661,8 +2779,7 @@ def add_moon_page():
 @app.route("/admin/addmoon", methods=['GET', 'POST'])  # Add moon to database.
 def add_moon():
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
+    if is_admin():
         # Get all of the data from the HTML form.
         name = request.form.get("name")
         risk_level = request.form.get("risk_level")
@@ -676,12 +2793,11 @@ def add_moon():
         description = request.form.get("description")
         tier = request.form.get("tier")
 
-        # The strings need the new lines to be replaced with "\n",
-        # so that the new lines can be stored properly in the database.
-        conditions = conditions.replace("\n", "\\n")
-        history = history.replace("\n", "\\n")
-        fauna = fauna.replace("\n", "\\n")
-        description = description.replace("\n", "\\n")
+        # The new lines are stored the same whichever browser sent them.
+        conditions = normalize_text(conditions)
+        history = normalize_text(history)
+        fauna = normalize_text(fauna)
+        description = normalize_text(description)
 
         # The function needs to test that all of the inputs are usable.
 
@@ -706,7 +2822,7 @@ def add_moon():
             return reject_input("/admin/moons/add", code_params.invalid_input)
 
         # If the risk level doesn't exist in the database, reject the submission.
-        if not (risk_level in [str(i[0]) for i in execute_query("SELECT id FROM RiskLevels;")]):
+        if not is_lookup_id("RiskLevels", risk_level):
             return reject_input("/admin/moons/add", code_params.invalid_input)
 
         # If the price isn't a number, reject the submission.
@@ -714,7 +2830,7 @@ def add_moon():
             return reject_input("/admin/moons/add", code_params.invalid_input)
 
         # If the interior doesn't exist, reject the submission.
-        if not (moon_interior in [str(i[0]) for i in execute_query("SELECT id FROM Interiors;")]):
+        if not is_lookup_id("Interiors", moon_interior):
             return reject_input("/admin/moons/add", code_params.invalid_input)
 
         # If the max indoor power isn't a number, reject the submission.
@@ -757,16 +2873,11 @@ def add_moon():
         else:
             return reject_input("/admin/moons/add", code_params.invalid_input)
 
-        # Gather all of the weathers in the database.
-        weather_entries = execute_query("SELECT id FROM Weathers;")
-        weather_list = []
-
         # This checks which weathers in the database are selected in the HTML form.
         # This is done by storing the weather ids that match ticked checkboxes
         # in a list.
-        for i in range(len(weather_entries)):
-            if request.form.get("weather" + str(weather_entries[i][0])):
-                weather_list.append(weather_entries[i][0])
+        weather_list = [weather_id for weather_id in lookup_tables["Weathers"]
+                        if request.form.get("weather" + str(weather_id))]
 
         # Fetch the header picture data,
         # and reject the submission if it is invalid.
@@ -777,39 +2888,56 @@ def add_moon():
         else:
             return reject_input("/admin/moons/add", code_params.invalid_image)
 
-        # Get the next usable id in the Moons table.
-        # The base order is by id, so the last id + 1
-        # will always be unique.
-        moon_id = execute_query("SELECT id FROM Moons;")[-1][0] + 1
-
-        # Create a folder with the moon id as the name in the Moons folder.
-        # UPLOAD_FOLDER is the base directory of the images, being static/images.
-        os.mkdir(f"{app.config["UPLOAD_FOLDER"]}/Moons/{moon_id}")
-
-        # Save the picture in the created folder.
-        header_picture.save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Moons/{moon_id}/",
-                                         header_picture_name))
-
-        # This query inserts the Moon data collected from the HTML form,
-        # into a new moon.
-        # pictures is kept blank, because they need to be added through
-        # the website.
-        execute_query(
-            '''
-            INSERT INTO Moons (name, risk_level, price, interior, max_indoor_power,
-            max_outdoor_power, conditions, history, fauna, description, tier, header_picture, pictures)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-            (name, risk_level, price, moon_interior, max_indoor_power, max_outdoor_power,
-             conditions, history, fauna, description, tier, header_picture_name, "")
-        )
-
-        # Insert the bridging entries between the new moon and the weathers,
-        # into the bridging table.
-        for i in weather_list:
-            execute_query('''
-                          INSERT INTO MoonWeathers (moon_id, weather_id)
-                          VALUES (?, ?)''',
-                          (moon_id, i))
+        # Everything the new item needs is committed together, or not at all.
+        with unit_of_work():
+            # Get the next usable id in the Moons table.
+            # The ids are sorted, so the last id + 1
+            # will always be unique.
+            moon_id = execute_query("SELECT id FROM Moons ORDER BY id;")[-1][0] + 1
+
+            # Create a folder with the moon id as the name in the Moons folder.
+            # UPLOAD_FOLDER is the base directory of the images, being static/images.
+            stage_folder(f"{app.config["UPLOAD_FOLDER"]}/Moons/{moon_id}")
+
+            # Save the picture in the created folder.
+            stage_upload(header_picture,
+                         os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Moons/{moon_id}/", header_picture_name))
+            # The smaller copies are made once the new moon has been committed.
+            after_commit(queue_image_variants, "Moons", moon_id, header_picture_name)
+
+            # This query inserts the Moon data collected from the HTML form,
+            # into a new moon.
+            # The gallery starts empty, because pictures need to be added through
+            # the website.
+            # The text is rendered as HTML once here, rather than every time the page is shown.
+            execute_query(
+                '''
+                INSERT INTO Moons (name, risk_level, price, interior, max_indoor_power,
+                max_outdoor_power, conditions, history, fauna, description, tier, header_picture,
+                conditions_html, history_html, fauna_html, description_html)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (name, risk_level, price, moon_interior, max_indoor_power, max_outdoor_power,
+                 conditions, history, fauna, description, tier, header_picture_name,
+                 render_text(conditions), render_text(history), render_text(fauna),
+                 render_text(description))
+            )
+
+            # Insert the bridging entries between the new moon and the weathers,
+            # into the bridging table.
+            for i in weather_list:
+                execute_query('''
+                              INSERT INTO MoonWeathers (moon_id, weather_id)
+                              VALUES (?, ?)''',
+                              (moon_id, i))
+
+            # Add the new moon to the search index.
+            index_search("Moons", moon_id)
+
+        # Mark the changed tables, and remove the pages that list the new moon from the page cache.
+        bump_data_versions("Moons", "MoonWeathers")
+        invalidate_pages(("moons", None), ("interior", int(moon_interior)),
+                         *[("weather", i) for i in weather_list])
+
         # Redirect the user to the moon list.
         return app.redirect("/moons")
     else:
@@ -820,9 +2948,9 @@ def add_moon():
 @app.route("/admin/moons/delete")  # Page to select a moon to delete.
 def delete_moon_page():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # Gather the moon names and ids.
-        moon_list = execute_query("SELECT id, name FROM Moons")
+        moon_list = get_lookup_entries("Moons")
         return render_template("moons/moonadmindelete.html",
                                moons=moon_list,
                                title=get_title("/admin/moons/delete"))
@@ -834,22 +2962,35 @@ def delete_moon_page():
 @app.route("/admin/deletemoon/<int:id>")  # Delete the selected moon.
 def delete_moon(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # If the id does not belong in the Moons table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Moons WHERE id=?", (id,)):
             abort(404)
 
-        # Delete the moon and the moon-weather bridging entries,
-        # that have the moon id.
-        execute_query("DELETE FROM Moons WHERE id=?;", (id,))
-        execute_query("DELETE FROM MoonWeathers WHERE moon_id=?", (id,))
-
-        # Delete every file in the moon's folder, and delete the folder.
-        directory = f"{app.config["UPLOAD_FOLDER"]}/Moons/{id}"
-        for file in os.listdir(directory):
-            os.remove(f"{directory}/{file}")
-        os.rmdir(directory)
+        # Find the pages that link to the moon before it is deleted,
+        # so that they can be removed from the page cache.
+        moon_interior = execute_query("SELECT interior FROM Moons WHERE id=?", (id,))[0][0]
+        weather_ids = execute_query("SELECT weather_id FROM MoonWeathers WHERE moon_id=?", (id,))
+        entity_ids = execute_query("SELECT id FROM Entities WHERE fav_moon=?", (id,))
+
+        # The rows are deleted in one transaction,
+        # and the files are only deleted once it has been committed.
+        with unit_of_work():
+            # Delete the moon and the moon-weather bridging entries,
+            # that have the moon id.
+            execute_query("DELETE FROM Moons WHERE id=?;", (id,))
+            execute_query("DELETE FROM MoonWeathers WHERE moon_id=?", (id,))
+            execute_query("DELETE FROM Pictures WHERE owner_type='Moons' AND owner_id=?", (id,))
+            unindex_search("Moons", id)
+            # Delete the folder of images, and the smaller copies of the images.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Moons/{id}")
+            stage_delete(get_variant_directory("Moons", id))
+
+        bump_data_versions("Moons", "MoonWeathers", "Pictures")
+        invalidate_pages(("moons", None), ("moon", id), ("interior", moon_interior),
+                         *[("weather", i[0]) for i in weather_ids],
+                         *[("entity", i[0]) for i in entity_ids])
 
         # Redirect the user to the moon list.
         return app.redirect("/moons")
@@ -861,9 +3002,7 @@ def delete_moon(id):
 @app.route("/admin/moons/addimage/<int:id>")  # Page to add an image to a moon.
 def add_moon_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
+    if is_admin():
         # If the id does not belong to the moons table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Moons WHERE id=?", (id,)):
@@ -872,10 +3011,8 @@ def add_moon_image_page(id):
         # Get the name of the moon.
         moon_name = execute_query("SELECT name FROM Moons WHERE id=?;", (id,))
 
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("moons/moonadminaddimage.html",
                                name=moon_name[0][0],
                                title=get_title("/admin/moons/addimage"),
@@ -889,7 +3026,7 @@ def add_moon_image_page(id):
 @app.route("/admin/moons/addmoonimage/<int:id>", methods=["GET", "POST"])  # Add an image to the moon.
 def add_moon_image(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # If the id doesn't belong to the Moons table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Moons WHERE id=?", (id,)):
@@ -905,21 +3042,17 @@ def add_moon_image(id):
         image_name = get_image_name(image_data[1],
                                     os.listdir(f"{app.config["UPLOAD_FOLDER"]}/Moons/{id}"))
 
-        # Save the picture in the created folder.
-        image_data[0].save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Moons/{id}/",
-                                        image_name))
-
-        # Update the pictures column in the Moons table.
-        # The string is converted to a list, the new picture name is appended,
-        # it is converted back to a string and put back in the database.
-        pictures = execute_query("SELECT pictures FROM Moons WHERE id=?", (id,))[0][0]
-        pictures = set_picture_list(pictures)
-        pictures.append(image_name)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Moons
-                      SET pictures = ?
-                      WHERE id = ?;''', (pictures, id))
+        # The picture is only kept if it is added to the gallery.
+        with unit_of_work():
+            # Save the picture in the created folder.
+            stage_upload(image_data[0], os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Moons/{id}/",
+                                                     image_name))
+            after_commit(queue_image_variants, "Moons", id, image_name)
+
+            # Add the picture to the end of the moon's gallery.
+            add_picture("Moons", id, image_name)
+        bump_data_versions("Pictures")
+        invalidate_pages(("moon", id))
 
         # Redirect the user to the moon data page.
         return app.redirect(f"/moons/{id}")
@@ -931,21 +3064,18 @@ def add_moon_image(id):
 @app.route("/admin/moons/deleteimage/<int:id>")  # Page to select an image to delete.
 def delete_moon_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # If the id doesn't belong to the Moons table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Moons WHERE id=?;", (id,)):
             abort(404)
 
-        # Fetch the picture string for the moon, and convert it to a list.
-        picture_data = execute_query("SELECT pictures FROM Moons WHERE id=?;", (id,))
-        picture_data = set_picture_list(picture_data[0][0])
-        picture_id = []
+        # Fetch the moon's pictures, and split them into
+        # a list of picture ids and a list of file names.
+        picture_data = get_pictures("Moons", id)
+        picture_id = [picture[0] for picture in picture_data]
         picture_count = len(picture_data)
-
-        # Add all of the picture indexes to a list.
-        for i in range(picture_count):
-            picture_id.append(i)
+        picture_data = [picture[1] for picture in picture_data]
         return render_template("moons/moonadmindeleteimage.html",
                                title=get_title("/admin/moons/deleteimage"),
                                pictures=picture_data,
@@ -962,29 +3092,25 @@ def delete_moon_image_page(id):
 @app.route("/admin/moons/deletemoonimage/<int:moon_id>/<int:picture_id>")  # Delete a picture.
 def delete_moon_image(moon_id, picture_id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # If the id doesn't belong to the Moons table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Moons WHERE id=?", (moon_id,)):
             abort(404)
 
-        # Fetch the picture string, convert it to a list.
-        # Return a 404 error if the picture index doesn't exist.
-        pictures = execute_query("SELECT pictures FROM Moons WHERE id=?", (moon_id,))
-        pictures = set_picture_list(pictures[0][0])
-        if picture_id < 0 or picture_id >= len(pictures):
-            abort(404)
+        with unit_of_work():
+            # Remove the picture from the moon's gallery.
+            # Return a 404 error if the picture doesn't belong to the moon.
+            picture_name = delete_picture("Moons", moon_id, picture_id)
+            if not picture_name:
+                abort(404)
 
-        # Delete the picture from the moon folder, remove it from the list,
-        # and re-add the string to the database.
-        os.remove(f"{app.config["UPLOAD_FOLDER"]}/Moons/{moon_id}/{pictures[picture_id]}")
-        pictures.pop(picture_id)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Moons
-                      SET pictures = ?
-                      WHERE id=?''',
-                      (pictures, moon_id))
+            # Delete the picture and its smaller copies from the moon folder.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Moons/{moon_id}/{picture_name}")
+            after_commit(delete_image_variants, "Moons", moon_id, picture_name)
+
+        bump_data_versions("Pictures")
+        invalidate_pages(("moon", moon_id))
 
         # Redirect the user to the moon data page
         return app.redirect(f"/moons/{moon_id}")
@@ -996,18 +3122,14 @@ def delete_moon_image(moon_id, picture_id):
 @app.route("/admin/entity/add")  # Page to add details for a new entity.
 def add_entity_page():
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
+    if is_admin():
         # The page needs to know the settings and moons
         # for the drop down options.
-        setting_entries = execute_query("SELECT id, name FROM Setting;")
-        moon_entries = execute_query("SELECT id, name FROM Moons;")
+        setting_entries = get_lookup_entries("Setting")
+        moon_entries = get_lookup_entries("Moons")
 
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("entities/entityadminadd.html",
                                settings=setting_entries,
                                moons=moon_entries,
@@ -1021,7 +3143,7 @@ def add_entity_page():
 @app.route("/admin/addentity", methods=["GET", "POST"])  # Add entity to database.
 def add_entity():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Get all of the data from the HTML form.
         name = request.form.get("name")
@@ -1080,16 +3202,23 @@ def add_entity():
         if not is_number(max_spawned):
             return reject_input("/admin/entity/add", code_params.invalid_input)
 
+        # If the setting doesn't exist, reject the submission.
+        if not is_lookup_id("Setting", setting):
+            return reject_input("/admin/entity/add", code_params.invalid_input)
+
+        # If the favourite moon doesn't exist, reject the submission.
+        if not is_lookup_id("Moons", fav_moon):
+            return reject_input("/admin/entity/add", code_params.invalid_input)
+
         # if the entity is invincible, make the health values -1,
         # because entity page will display invincible if its health is -1.
         if invincible:
             sp_hp = -1
             mp_hp = -1
 
-        # The strings need the new lines to be replaced with "\n",
-        # so that the new lines can be stored properly in the database.
-        bestiary = bestiary.replace("\n", "\\n")
-        description = description.replace("\n", "\\n")
+        # The new lines are stored the same whichever browser sent them.
+        bestiary = normalize_text(bestiary)
+        description = normalize_text(description)
 
         # Fetch the header picture data,
         # and reject the submission if it is invalid.
@@ -1100,29 +3229,40 @@ def add_entity():
         else:
             return reject_input("/admin/entity/add", code_params.invalid_image)
 
-        # Get the next usable id in the Entities table.
-        # The base order is by id, so the last id + 1
-        # will always be unique.
-        entity_id = execute_query("SELECT id FROM Entities;")[-1][0] + 1
-
-        # Create a folder with the entity id as the name in the Entities folder.
-        # UPLOAD_FOLDER is the base directory of the images, being static/images.
-        os.mkdir(f"{app.config["UPLOAD_FOLDER"]}/Entities/{entity_id}")
-
-        # Save the picture in the created folder.
-        header_picture.save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Entities/{entity_id}/",
-                                         header_picture_name))
-
-        # This query inserts the entity data collected from the HTML form,
-        # into a new entity.
-        # pictures is kept blank, because they need to be added through
-        # the website.
-        execute_query('''
-                      INSERT INTO Entities (name, danger, bestiary, setting,
-                      fav_moon, sp_hp, mp_hp, power, max_spawned, description, header_picture, pictures)
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                      (name, danger_rating, bestiary, setting, fav_moon, sp_hp,
-                       mp_hp, power, max_spawned, description, header_picture_name, ""))
+        # Everything the new item needs is committed together, or not at all.
+        with unit_of_work():
+            # Get the next usable id in the Entities table.
+            # The ids are sorted, so the last id + 1
+            # will always be unique.
+            entity_id = execute_query("SELECT id FROM Entities ORDER BY id;")[-1][0] + 1
+
+            # Create a folder with the entity id as the name in the Entities folder.
+            # UPLOAD_FOLDER is the base directory of the images, being static/images.
+            stage_folder(f"{app.config["UPLOAD_FOLDER"]}/Entities/{entity_id}")
+
+            # Save the picture in the created folder.
+            stage_upload(header_picture,
+                         os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Entities/{entity_id}/", header_picture_name))
+            # The smaller copies are made once the new entity has been committed.
+            after_commit(queue_image_variants, "Entities", entity_id, header_picture_name)
+
+            # This query inserts the entity data collected from the HTML form,
+            # into a new entity.
+            # The gallery starts empty, because pictures need to be added through
+            # the website.
+            # The text is rendered as HTML once here, rather than every time the page is shown.
+            execute_query('''
+                          INSERT INTO Entities (name, danger, bestiary, setting,
+                          fav_moon, sp_hp, mp_hp, power, max_spawned, description, header_picture,
+                          bestiary_html, description_html)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                          (name, danger_rating, bestiary, setting, fav_moon, sp_hp,
+                           mp_hp, power, max_spawned, description, header_picture_name,
+                           render_text(bestiary), render_text(description)))
+            index_search("Entities", entity_id)
+
+        bump_data_versions("Entities")
+        invalidate_pages(("entities", None))
 
         # Redirect the user to the entity list
         return app.redirect("/entity")
@@ -1134,7 +3274,7 @@ def add_entity():
 @app.route("/admin/entity/delete")  # Page to select an entity to delete.
 def delete_entity_page():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Gather the entity names and ids.
         entity_list = execute_query("SELECT id, name FROM Entities;")
@@ -1149,21 +3289,26 @@ def delete_entity_page():
 @app.route("/admin/deleteentity/<int:id>")  # Delete selected entity.
 def delete_entity(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Entities table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Entities WHERE id=?", (id,)):
             abort(404)
 
-        # Delete the entity.
-        execute_query("DELETE FROM Entities WHERE id=?;", (id,))
+        # The rows are deleted in one transaction,
+        # and the files are only deleted once it has been committed.
+        with unit_of_work():
+            # Delete the entity.
+            execute_query("DELETE FROM Entities WHERE id=?;", (id,))
+            execute_query("DELETE FROM Pictures WHERE owner_type='Entities' AND owner_id=?", (id,))
+            unindex_search("Entities", id)
+            # Delete the folder of images, and the smaller copies of the images.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Entities/{id}")
+            stage_delete(get_variant_directory("Entities", id))
 
-        # Delete every file in the entity's folder, and delete the folder.
-        directory = f"{app.config["UPLOAD_FOLDER"]}/Entities/{id}"
-        for file in os.listdir(directory):
-            os.remove(f"{directory}/{file}")
-        os.rmdir(directory)
+        bump_data_versions("Entities", "Pictures")
+        invalidate_pages(("entities", None), ("entity", id))
 
         # Redirect the user to the entity list.
         return app.redirect("/entity")
@@ -1175,9 +3320,7 @@ def delete_entity(id):
 @app.route("/admin/entity/addimage/<int:id>")  # Page to add entity image.
 def add_entity_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
+    if is_admin():
         # If the id doesn't belong to the Entities table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Entities WHERE id=?", (id,)):
@@ -1186,10 +3329,8 @@ def add_entity_image_page(id):
         # Fetch the entity name.
         entity_name = execute_query("SELECT name FROM Entities WHERE id=?;", (id,))
 
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("entities/entityadminaddimage.html",
                                name=entity_name[0][0],
                                title=get_title("/admin/entity/addimage"),
@@ -1203,7 +3344,7 @@ def add_entity_image_page(id):
 @app.route("/admin/entity/addentityimage/<int:id>", methods=["GET", "POST"])  # Add entity image.
 def add_entity_image(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Entities table,
         # return a 404 error.
@@ -1218,21 +3359,17 @@ def add_entity_image(id):
         if not image_data:
             return reject_input(f"/admin/entity/addimage/{id}", code_params.invalid_image)
 
-        # Save the picture to entity's folder.
-        image_data[0].save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Entities/{id}/",
-                                        image_name))
-
-        # Update the pictures column in the Entities table.
-        # The string is converted to a list, the new picture name is appended,
-        # it is converted back to a string and put back in the database.
-        pictures = execute_query("SELECT pictures FROM Entities WHERE id=?", (id,))[0][0]
-        pictures = set_picture_list(pictures)
-        pictures.append(image_name)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Entities
-                      SET pictures = ?
-                      WHERE id = ?;''', (pictures, id))
+        # The picture is only kept if it is added to the gallery.
+        with unit_of_work():
+            # Save the picture to entity's folder.
+            stage_upload(image_data[0], os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Entities/{id}/",
+                                                     image_name))
+            after_commit(queue_image_variants, "Entities", id, image_name)
+
+            # Add the picture to the end of the entity's gallery.
+            add_picture("Entities", id, image_name)
+        bump_data_versions("Pictures")
+        invalidate_pages(("entity", id))
 
         # Redirect the user to the entity data page.
         return app.redirect(f"/entity/{id}")
@@ -1244,22 +3381,19 @@ def add_entity_image(id):
 @app.route("/admin/entity/deleteimage/<int:id>")  # Page for entity image deleting.
 def delete_entity_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Entities table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Entities WHERE id=?;", (id,)):
             abort(404)
 
-        # Fetch the picture string for the entity, and convert it to a list.
-        picture_data = execute_query("SELECT pictures FROM Entities WHERE id=?;", (id,))
-        picture_data = set_picture_list(picture_data[0][0])
-        picture_id = []
+        # Fetch the entity's pictures, and split them into
+        # a list of picture ids and a list of file names.
+        picture_data = get_pictures("Entities", id)
+        picture_id = [picture[0] for picture in picture_data]
         picture_count = len(picture_data)
-
-        # Add all of the picture indexes to a list.
-        for i in range(picture_count):
-            picture_id.append(i)
+        picture_data = [picture[1] for picture in picture_data]
         return render_template("entities/entityadmindeleteimage.html",
                                title=get_title("/admin/entity/deleteimage"),
                                pictures=picture_data,
@@ -1276,30 +3410,26 @@ def delete_entity_image_page(id):
 @app.route("/admin/entity/deleteentityimage/<int:entity_id>/<int:picture_id>")  # Delete entity image.
 def delete_entity_image(entity_id, picture_id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Entities table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Entities WHERE id=?", (entity_id,)):
             abort(404)
 
-        # Fetch the picture string, convert it to a list.
-        # Return a 404 error if the picture index doesn't exist.
-        pictures = execute_query("SELECT pictures FROM Entities WHERE id=?", (entity_id,))
-        pictures = set_picture_list(pictures[0][0])
-        if picture_id < 0 or picture_id >= len(pictures):
-            abort(404)
+        with unit_of_work():
+            # Remove the picture from the entity's gallery.
+            # Return a 404 error if the picture doesn't belong to the entity.
+            picture_name = delete_picture("Entities", entity_id, picture_id)
+            if not picture_name:
+                abort(404)
 
-        # Delete the picture from the entity folder, remove it from the list,
-        # and re-add the string to the database.
-        os.remove(f"{app.config["UPLOAD_FOLDER"]}/Entities/{entity_id}/{pictures[picture_id]}")
-        pictures.pop(picture_id)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Entities
-                      SET pictures = ?
-                      WHERE id=?''',
-                      (pictures, entity_id))
+            # Delete the picture and its smaller copies from the entity folder.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Entities/{entity_id}/{picture_name}")
+            after_commit(delete_image_variants, "Entities", entity_id, picture_name)
+
+        bump_data_versions("Pictures")
+        invalidate_pages(("entity", entity_id))
 
         # Redirect the user to the entity data page.
         return app.redirect(f"/entity/{entity_id}")
@@ -1311,13 +3441,9 @@ def delete_entity_image(entity_id, picture_id):
 @app.route("/admin/tools/add")  # Page to add details for a new tool.
 def add_tool_page():
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+    if is_admin():
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("tools/tooladminadd.html",
                                title=get_title("/admin/tools/add"),
                                message=submit_message)
@@ -1329,15 +3455,14 @@ def add_tool_page():
 @app.route("/admin/addtool", methods=["GET", "POST"])  # Add tool to database
 def add_tool():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         name = request.form.get("name")
         price = request.form.get("price")
         upgrade = request.form.get("upgrade")
         weight = request.form.get("weight")
 
-        # The string needs the new lines to be replaced with "\n",
-        # so that the new lines can be stored properly in the database.
-        description = request.form.get("description").replace("\n", "\\n")
+        # The new lines are stored the same whichever browser sent them.
+        description = normalize_text(request.form.get("description"))
 
         # If the name is null, reject the submission.
         if not name:
@@ -1375,28 +3500,39 @@ def add_tool():
         else:
             return reject_input("/admin/tools/add", code_params.invalid_image)
 
-        # Get the next usable id in the Tools table.
-        # The base order is by id, so the last id + 1
-        # will always be unique.
-        tool_id = execute_query("SELECT id FROM Tools;")[-1][0] + 1
-
-        # Create a folder with the tool id as the name in the Tools folder.
-        # UPLOAD_FOLDER is the base directory of the images, being static/images.
-        os.mkdir(f"{app.config["UPLOAD_FOLDER"]}/Tools/{tool_id}")
-
-        # Save the picture in the created folder.
-        header_picture.save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Tools/{tool_id}/",
-                                         header_picture_name))
-
-        # This query inserts the tool data collected from the HTML form,
-        # into a new tool.
-        # pictures is kept blank, because they need to be added through
-        # the website.
-        execute_query('''
-                      INSERT INTO Tools
-                      (name, price, description, upgrade, weight, header_picture, pictures)
-                      VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                      (name, price, description, upgrade, weight, header_picture_name, ""))
+        # Everything the new item needs is committed together, or not at all.
+        with unit_of_work():
+            # Get the next usable id in the Tools table.
+            # The ids are sorted, so the last id + 1
+            # will always be unique.
+            tool_id = execute_query("SELECT id FROM Tools ORDER BY id;")[-1][0] + 1
+
+            # Create a folder with the tool id as the name in the Tools folder.
+            # UPLOAD_FOLDER is the base directory of the images, being static/images.
+            stage_folder(f"{app.config["UPLOAD_FOLDER"]}/Tools/{tool_id}")
+
+            # Save the picture in the created folder.
+            stage_upload(header_picture,
+                         os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Tools/{tool_id}/", header_picture_name))
+            # The smaller copies are made once the new tool has been committed.
+            after_commit(queue_image_variants, "Tools", tool_id, header_picture_name)
+
+            # This query inserts the tool data collected from the HTML form,
+            # into a new tool.
+            # The gallery starts empty, because pictures need to be added through
+            # the website.
+            # The text is rendered as HTML once here, rather than every time the page is shown.
+            execute_query('''
+                          INSERT INTO Tools
+                          (name, price, description, upgrade, weight, header_picture,
+                           description_html)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                          (name, price, description, upgrade, weight, header_picture_name,
+                           render_text(description)))
+            index_search("Tools", tool_id)
+
+        bump_data_versions("Tools")
+        invalidate_pages(("tools", None))
 
         # Redirect the user to the tool list
         return app.redirect("/tools")
@@ -1408,7 +3544,7 @@ def add_tool():
 @app.route("/admin/tools/delete")  # Page to select a tool to delete.
 def delete_tool_page():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Gather the tool names and ids.
         tool_list = execute_query("SELECT id, name FROM Tools;")
@@ -1423,21 +3559,26 @@ def delete_tool_page():
 @app.route("/admin/deletetool/<int:id>")  # Delete selected tool.
 def delete_tool(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Tools table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Tools WHERE id=?", (id,)):
             abort(404)
 
-        # Delete the entity.
-        execute_query("DELETE FROM Tools WHERE id=?", (id,))
+        # The rows are deleted in one transaction,
+        # and the files are only deleted once it has been committed.
+        with unit_of_work():
+            # Delete the entity.
+            execute_query("DELETE FROM Tools WHERE id=?", (id,))
+            execute_query("DELETE FROM Pictures WHERE owner_type='Tools' AND owner_id=?", (id,))
+            unindex_search("Tools", id)
+            # Delete the folder of images, and the smaller copies of the images.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Tools/{id}")
+            stage_delete(get_variant_directory("Tools", id))
 
-        # Delete every file in the tools's folder, and delete the folder.
-        directory = f"{app.config["UPLOAD_FOLDER"]}/Tools/{id}"
-        for file in os.listdir(directory):
-            os.remove(f"{directory}/{file}")
-        os.rmdir(directory)
+        bump_data_versions("Tools", "Pictures")
+        invalidate_pages(("tools", None), ("tool", id))
 
         # Redirect the user to the tool list.
         return app.redirect("/tools")
@@ -1449,9 +3590,7 @@ def delete_tool(id):
 @app.route("/admin/tools/addimage/<int:id>")  # Page to add tool images.
 def add_tool_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
+    if is_admin():
         # If the id doesn't belong to the Entities table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Tools WHERE id=?", (id,)):
@@ -1460,10 +3599,8 @@ def add_tool_image_page(id):
         # Fetch the tool name.
         tool_name = execute_query("SELECT name FROM Tools WHERE id=?;", (id,))
 
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("tools/tooladminaddimage.html",
                                name=tool_name[0][0],
                                title=get_title("/admin/tools/addimage"),
@@ -1477,7 +3614,7 @@ def add_tool_image_page(id):
 @app.route("/admin/tools/addtoolimage/<int:id>", methods=["GET", "POST"])  # Add tool image.
 def add_tool_image(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Tools table,
         # return a 404 error.
@@ -1492,21 +3629,17 @@ def add_tool_image(id):
         if not image_data:
             return reject_input(f"/admin/tools/addimage/{id}", code_params.invalid_image)
 
-        # Save the picture to tool's folder.
-        image_data[0].save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Tools/{id}/",
-                                        image_name))
-
-        # Update the pictures column in the Tools table.
-        # The string is converted to a list, the new picture name is appended,
-        # it is converted back to a string and put back in the database.
-        pictures = execute_query("SELECT pictures FROM Tools WHERE id=?", (id,))[0][0]
-        pictures = set_picture_list(pictures)
-        pictures.append(image_name)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Tools
-                      SET pictures = ?
-                      WHERE id = ?;''', (pictures, id))
+        # The picture is only kept if it is added to the gallery.
+        with unit_of_work():
+            # Save the picture to tool's folder.
+            stage_upload(image_data[0], os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Tools/{id}/",
+                                                     image_name))
+            after_commit(queue_image_variants, "Tools", id, image_name)
+
+            # Add the picture to the end of the tool's gallery.
+            add_picture("Tools", id, image_name)
+        bump_data_versions("Pictures")
+        invalidate_pages(("tool", id))
         # Redirect the user to the tool data page.
         return app.redirect(f"/tools/{id}")
     else:
@@ -1517,22 +3650,19 @@ def add_tool_image(id):
 @app.route("/admin/tools/deleteimage/<int:id>")  # Page for tool image deleting.
 def delete_tool_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Tools table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Tools WHERE id=?;", (id,)):
             abort(404)
 
-        # Fetch the picture string for the tool, and convert it to a list.
-        picture_data = execute_query("SELECT pictures FROM Tools WHERE id=?;", (id,))
-        picture_data = set_picture_list(picture_data[0][0])
-        picture_id = []
+        # Fetch the tool's pictures, and split them into
+        # a list of picture ids and a list of file names.
+        picture_data = get_pictures("Tools", id)
+        picture_id = [picture[0] for picture in picture_data]
         picture_count = len(picture_data)
-
-        # Add all of the picture indexes to a list.
-        for i in range(picture_count):
-            picture_id.append(i)
+        picture_data = [picture[1] for picture in picture_data]
         return render_template("tools/tooladmindeleteimage.html",
                                title=get_title("/admin/tools/deleteimage"),
                                pictures=picture_data,
@@ -1549,30 +3679,26 @@ def delete_tool_image_page(id):
 @app.route("/admin/tools/deletetoolimage/<int:tool_id>/<int:picture_id>")  # Delete tool image.
 def delete_tool_image(tool_id, picture_id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Tools table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Tools WHERE id=?", (tool_id,)):
             abort(404)
 
-        # Fetch the picture string, convert it to a list.
-        # Return a 404 error if the picture index doesn't exist.
-        pictures = execute_query("SELECT pictures FROM Tools WHERE id=?", (tool_id,))
-        pictures = set_picture_list(pictures[0][0])
-        if picture_id < 0 or picture_id >= len(pictures):
-            abort(404)
+        with unit_of_work():
+            # Remove the picture from the tool's gallery.
+            # Return a 404 error if the picture doesn't belong to the tool.
+            picture_name = delete_picture("Tools", tool_id, picture_id)
+            if not picture_name:
+                abort(404)
 
-        # Delete the picture from the tool folder, remove it from the list,
-        # and re-add the string to the database.
-        os.remove(f"{app.config["UPLOAD_FOLDER"]}/Tools/{tool_id}/{pictures[picture_id]}")
-        pictures.pop(picture_id)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Tools
-                      SET pictures = ?
-                      WHERE id=?''',
-                      (pictures, tool_id))
+            # Delete the picture and its smaller copies from the tool folder.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Tools/{tool_id}/{picture_name}")
+            after_commit(delete_image_variants, "Tools", tool_id, picture_name)
+
+        bump_data_versions("Pictures")
+        invalidate_pages(("tool", tool_id))
 
         # Redirect the user to the tool data page.
         return app.redirect(f"/tools/{tool_id}")
@@ -1584,14 +3710,10 @@ def delete_tool_image(tool_id, picture_id):
 @app.route("/admin/weathers/add")  # Page to add details for a new weather.
 def add_weather_page():
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        moon_entries = execute_query("SELECT id, name FROM Moons")
-        submit_message = fail_message
-        fail_message = ""
+    if is_admin():
+        moon_entries = get_lookup_entries("Moons")
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("weathers/weatheradminadd.html",
                                moons=moon_entries,
                                title=get_title("/admin/weathers/add"),
@@ -1604,27 +3726,21 @@ def add_weather_page():
 @app.route("/admin/addweather", methods=["GET", "POST"])  # Add weather to database.
 def add_weather():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # Get all of the data from the HTML form.
         name = request.form.get("name")
 
         if not name:
             return reject_input("/admin/weathers/add", code_params.invalid_input)
 
-        # The string needs the new lines to be replaced with "\n",
-        # so that the new lines can be stored properly in the database.
-        description = request.form.get("description").replace("\n", "\\n")
-
-        # Gather all of the moons in the database.
-        moon_entries = execute_query("SELECT id FROM Moons;")
-        moon_list = []
+        # The new lines are stored the same whichever browser sent them.
+        description = normalize_text(request.form.get("description"))
 
         # This checks which moons in the database are selected in the HTML form.
         # This is done by storing the moon ids that match ticked checkboxes
         # in a list.
-        for i in range(len(moon_entries)):
-            if request.form.get("moon" + str(moon_entries[i][0])):
-                moon_list.append(moon_entries[i][0])
+        moon_list = [moon_id for moon_id in lookup_tables["Moons"]
+                     if request.form.get("moon" + str(moon_id))]
 
         # Fetch the header picture data,
         # and reject the submission if it is invalid.
@@ -1635,35 +3751,47 @@ def add_weather():
         else:
             return reject_input("/admin/weathers/add", code_params.invalid_image)
 
-        # Get the next usable id in the Weathers table.
-        # The base order is by id, so the last id + 1
-        # will always be unique.
-        weather_id = execute_query("SELECT id FROM Weathers;")[-1][0] + 1
-
-        # Create a folder with the weather id as the name in the Weathers folder.
-        # UPLOAD_FOLDER is the base directory of the images, being static/images.
-        os.mkdir(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{weather_id}")
-
-        # Save the picture in the created folder.
-        header_picture.save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{weather_id}/",
-                                         header_picture_name))
-
-        # This query inserts the Weather data collected from the HTML form,
-        # into a new weather.
-        # pictures is kept blank, because they need to be added through
-        # the website.
-        execute_query('''
-                      INSERT INTO Weathers (name, description, header_picture, pictures)
-                      VALUES (?, ?, ?, ?)''',
-                      (name, description, header_picture_name, ""))
-
-        # Insert the bridging entries between the new weathers and the moons,
-        # into the bridging table.
-        for i in range(len(moon_list)):
+        # Everything the new item needs is committed together, or not at all.
+        with unit_of_work():
+            # Get the next usable id in the Weathers table.
+            # The ids are sorted, so the last id + 1
+            # will always be unique.
+            weather_id = execute_query("SELECT id FROM Weathers ORDER BY id;")[-1][0] + 1
+
+            # Create a folder with the weather id as the name in the Weathers folder.
+            # UPLOAD_FOLDER is the base directory of the images, being static/images.
+            stage_folder(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{weather_id}")
+
+            # Save the picture in the created folder.
+            stage_upload(header_picture,
+                         os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{weather_id}/", header_picture_name))
+            # The smaller copies are made once the new weather has been committed.
+            after_commit(queue_image_variants, "Weathers", weather_id, header_picture_name)
+
+            # This query inserts the Weather data collected from the HTML form,
+            # into a new weather.
+            # The gallery starts empty, because pictures need to be added through
+            # the website.
+            # The text is rendered as HTML once here, rather than every time the page is shown.
             execute_query('''
-                          INSERT INTO MoonWeathers (moon_id, weather_id)
-                          VALUES (?, ?)''',
-                          (moon_list[i], weather_id))
+                          INSERT INTO Weathers (name, description, header_picture, description_html)
+                          VALUES (?, ?, ?, ?)''',
+                          (name, description, header_picture_name, render_text(description)))
+
+            # Insert the bridging entries between the new weathers and the moons,
+            # into the bridging table.
+            for i in range(len(moon_list)):
+                execute_query('''
+                              INSERT INTO MoonWeathers (moon_id, weather_id)
+                              VALUES (?, ?)''',
+                              (moon_list[i], weather_id))
+
+            # Add the new weather to the search index.
+            index_search("Weathers", weather_id)
+
+        # Mark the changed tables, and remove the pages that list the new weather from the page cache.
+        bump_data_versions("Weathers", "MoonWeathers")
+        invalidate_pages(("weathers", None), *[("moon", i) for i in moon_list])
 
         # Redirect the user to the weather list.
         return app.redirect("/weathers")
@@ -1675,10 +3803,10 @@ def add_weather():
 @app.route("/admin/weathers/delete")  # Page to select a weather to delete.
 def delete_weather_page():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Gather the weather names and ids.
-        weather_list = execute_query("SELECT id, name FROM Weathers;")
+        weather_list = get_lookup_entries("Weathers")
         return render_template("weathers/weatheradmindelete.html",
                                title=get_title("/admin/weathers/delete"),
                                weathers=weather_list)
@@ -1690,22 +3818,32 @@ def delete_weather_page():
 @app.route("/admin/deleteweather/<int:id>")  # Delete selected weather.
 def delete_weather(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # If the id does not belong in the Moons table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Weathers WHERE id=?", (id,)):
             abort(404)
 
-        # Delete the weather and the moon-weather bridging entries,
-        # that have the weather id.
-        execute_query("DELETE FROM Weathers WHERE id=?", (id,))
-        execute_query("DELETE FROM MoonWeathers WHERE weather_id=?", (id,))
-
-        # Delete every file in the weather's folder, and delete the folder.
-        directory = f"{app.config["UPLOAD_FOLDER"]}/Weathers/{id}"
-        for file in os.listdir(directory):
-            os.remove(f"{directory}/{file}")
-        os.rmdir(directory)
+        # Find the moons that list the weather before it is deleted,
+        # so that they can be removed from the page cache.
+        moon_ids = execute_query("SELECT moon_id FROM MoonWeathers WHERE weather_id=?", (id,))
+
+        # The rows are deleted in one transaction,
+        # and the files are only deleted once it has been committed.
+        with unit_of_work():
+            # Delete the weather and the moon-weather bridging entries,
+            # that have the weather id.
+            execute_query("DELETE FROM Weathers WHERE id=?", (id,))
+            execute_query("DELETE FROM MoonWeathers WHERE weather_id=?", (id,))
+            execute_query("DELETE FROM Pictures WHERE owner_type='Weathers' AND owner_id=?", (id,))
+            unindex_search("Weathers", id)
+            # Delete the folder of images, and the smaller copies of the images.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{id}")
+            stage_delete(get_variant_directory("Weathers", id))
+
+        bump_data_versions("Weathers", "MoonWeathers", "Pictures")
+        invalidate_pages(("weathers", None), ("weather", id),
+                         *[("moon", i[0]) for i in moon_ids])
 
         # Redirect the user to the weather list.
         return app.redirect("/weathers")
@@ -1717,9 +3855,7 @@ def delete_weather(id):
 @app.route("/admin/weathers/addimage/<int:id>")  # Page to add an image to a weather.
 def add_weather_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
+    if is_admin():
         # If the id does not belong to the weathers table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Weathers WHERE id=?", (id,)):
@@ -1728,10 +3864,8 @@ def add_weather_image_page(id):
         # Get the name of the moon.
         weather_name = execute_query("SELECT name FROM Weathers WHERE id=?;", (id,))
 
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("weathers/weatheradminaddimage.html",
                                name=weather_name[0][0],
                                title=get_title("/admin/weathers/addimage"),
@@ -1745,7 +3879,7 @@ def add_weather_image_page(id):
 @app.route("/admin/weathers/addweatherimage/<int:id>", methods=["GET", "POST"])  # Add an image to the weather.
 def add_weather_image(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Weathers table,
         # return a 404 error.
@@ -1762,21 +3896,17 @@ def add_weather_image(id):
         image_name = get_image_name(image_data[1],
                                     os.listdir(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{id}"))
 
-        # Save the picture in the created folder.
-        image_data[0].save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{id}/",
-                                        image_name))
-
-        # Update the pictures column in the Weathers table.
-        # The string is converted to a list, the new picture name is appended,
-        # it is converted back to a string and put back in the database.
-        pictures = execute_query("SELECT pictures FROM Weathers WHERE id=?", (id,))[0][0]
-        pictures = set_picture_list(pictures)
-        pictures.append(image_name)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Weathers
-                      SET pictures = ?
-                      WHERE id = ?;''', (pictures, id))
+        # The picture is only kept if it is added to the gallery.
+        with unit_of_work():
+            # Save the picture in the created folder.
+            stage_upload(image_data[0], os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{id}/",
+                                                     image_name))
+            after_commit(queue_image_variants, "Weathers", id, image_name)
+
+            # Add the picture to the end of the weather's gallery.
+            add_picture("Weathers", id, image_name)
+        bump_data_versions("Pictures")
+        invalidate_pages(("weather", id))
 
         # Redirect the user to the weather data page.
         return app.redirect(f"/weathers/{id}")
@@ -1788,21 +3918,18 @@ def add_weather_image(id):
 @app.route("/admin/weathers/deleteimage/<int:id>")  # Page to select an image to delete.
 def delete_weather_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
         # If the id doesn't belong to the Weathers table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Weathers WHERE id=?;", (id,)):
             abort(404)
 
-        # Fetch the picture string for the weather, and convert it to a list.
-        picture_data = execute_query("SELECT pictures FROM Weathers WHERE id=?;", (id,))
-        picture_data = set_picture_list(picture_data[0][0])
-        picture_id = []
+        # Fetch the weather's pictures, and split them into
+        # a list of picture ids and a list of file names.
+        picture_data = get_pictures("Weathers", id)
+        picture_id = [picture[0] for picture in picture_data]
         picture_count = len(picture_data)
-
-        # Add all of the picture indexes to a list.
-        for i in range(picture_count):
-            picture_id.append(i)
+        picture_data = [picture[1] for picture in picture_data]
         return render_template("weathers/weatheradmindeleteimage.html",
                                title=get_title("/admin/weathers/deleteimage"),
                                pictures=picture_data,
@@ -1819,30 +3946,26 @@ def delete_weather_image_page(id):
 @app.route("/admin/weathers/deleteweatherimage/<int:weather_id>/<int:picture_id>")  # Delete a picture
 def delete_weather_image(weather_id, picture_id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Weathers table,
         # return a 404 error.
         if not execute_query("SELECT id FROM Weathers WHERE id=?", (weather_id,)):
             abort(404)
 
-        # Fetch the picture string, convert it to a list.
-        # Return a 404 error if the picture index doesn't exist.
-        pictures = execute_query("SELECT pictures FROM Weathers WHERE id=?", (weather_id,))
-        pictures = set_picture_list(pictures[0][0])
-        if picture_id < 0 or picture_id >= len(pictures):
-            abort(404)
+        with unit_of_work():
+            # Remove the picture from the weather's gallery.
+            # Return a 404 error if the picture doesn't belong to the weather.
+            picture_name = delete_picture("Weathers", weather_id, picture_id)
+            if not picture_name:
+                abort(404)
 
-        # Delete the picture from the weathers folder, remove it from the list,
-        # and re-add the string to the database.
-        os.remove(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{weather_id}/{pictures[picture_id]}")
-        pictures.pop(picture_id)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Weathers
-                      SET pictures = ?
-                      WHERE id=?''',
-                      (pictures, weather_id))
+            # Delete the picture and its smaller copies from the weather folder.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Weathers/{weather_id}/{picture_name}")
+            after_commit(delete_image_variants, "Weathers", weather_id, picture_name)
+
+        bump_data_versions("Pictures")
+        invalidate_pages(("weather", weather_id))
 
         # Redirect the user to the weather data page
         return app.redirect(f"/weathers/{weather_id}")
@@ -1854,13 +3977,9 @@ def delete_weather_image(weather_id, picture_id):
 @app.route("/admin/interiors/add")  # Page to add details for a new interior.
 def add_interior_page():
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+    if is_admin():
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("interiors/interioradminadd.html",
                                title=get_title("/admin/interiors/add"),
                                message=submit_message)
@@ -1872,16 +3991,15 @@ def add_interior_page():
 @app.route("/admin/addinterior", methods=["GET", "POST"])  # Add interior to database.
 def add_interior():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Get all of the data from the HTML form.
         name = request.form.get("name")
 
         if not name:
             return reject_input("/admin/interiors/add", code_params.invalid_input)
-        # This string needs the new lines to be replaced with "\n",
-        # so that the new lines can be stored properly in the database.
-        description = request.form.get("description").replace("\n", "\\n")
+        # The new lines are stored the same whichever browser sent them.
+        description = normalize_text(request.form.get("description"))
 
         # Fetch the header picture data,
         # and reject the submission if it is invalid.
@@ -1892,27 +4010,36 @@ def add_interior():
         else:
             return reject_input("/admin/interiors/add", code_params.invalid_image)
 
-        # Get the next usable id in the Interiors table.
-        # The base order is by id, so the last id + 1
-        # will always be unique.
-        interior_id = execute_query("SELECT id FROM Interiors;")[-1][0] + 1
-
-        # Create a folder with the interior id as the name in the Interiors folder.
-        # UPLOAD_FOLDER is the base directory of the images, being static/images.
-        os.mkdir(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{interior_id}")
-
-        # Save the picture in the created folder.
-        header_picture.save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{interior_id}/",
-                                         header_picture_name))
-
-        # This query inserts the interior data collected from the HTML form,
-        # into a new interior.
-        # pictures is kept blank, because they need to be added through
-        # the website.
-        execute_query('''
-                      INSERT INTO Interiors (name, description, header_picture, pictures)
-                      VALUES (?, ?, ?, ?)''',
-                      (name, description, header_picture_name, ""))
+        # Everything the new item needs is committed together, or not at all.
+        with unit_of_work():
+            # Get the next usable id in the Interiors table.
+            # The ids are sorted, so the last id + 1
+            # will always be unique.
+            interior_id = execute_query("SELECT id FROM Interiors ORDER BY id;")[-1][0] + 1
+
+            # Create a folder with the interior id as the name in the Interiors folder.
+            # UPLOAD_FOLDER is the base directory of the images, being static/images.
+            stage_folder(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{interior_id}")
+
+            # Save the picture in the created folder.
+            stage_upload(header_picture,
+                         os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{interior_id}/", header_picture_name))
+            # The smaller copies are made once the new interior has been committed.
+            after_commit(queue_image_variants, "Interiors", interior_id, header_picture_name)
+
+            # This query inserts the interior data collected from the HTML form,
+            # into a new interior.
+            # The gallery starts empty, because pictures need to be added through
+            # the website.
+            # The text is rendered as HTML once here, rather than every time the page is shown.
+            execute_query('''
+                          INSERT INTO Interiors (name, description, header_picture, description_html)
+                          VALUES (?, ?, ?, ?)''',
+                          (name, description, header_picture_name, render_text(description)))
+            index_search("Interiors", interior_id)
+
+        bump_data_versions("Interiors")
+        invalidate_pages(("interiors", None))
         return app.redirect("/interiors")
     else:
         # Redirect the user to a page denying admin access.
@@ -1922,10 +4049,10 @@ def add_interior():
 @app.route("/admin/interiors/delete")  # Page to select an interior to delete.
 def delete_interior_page():
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Gather the entity names and ids.
-        interior_list = execute_query("SELECT id, name FROM Interiors WHERE NOT id=1;")
+        interior_list = [entry for entry in get_lookup_entries("Interiors") if entry[0] != 1]
         return render_template("interiors/interioradmindelete.html",
                                title=get_title("/admin/interiors/delete"),
                                interiors=interior_list)
@@ -1937,7 +4064,7 @@ def delete_interior_page():
 @app.route("/admin/deleteinterior/<int:id>")  # Delete selected interior.
 def delete_interior(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # If the id doesn't belong to the Interiors table,
         # return a 404 error.
@@ -1948,13 +4075,24 @@ def delete_interior(id):
         # and it isn't supposed to be deleted,
         # so if the id is 1, a 404 error will be returned.
         if not id == 1:
-            # Delete the interior.
-            execute_query("DELETE FROM Interiors WHERE id=?", (id,))
-            # Delete every file in the interior's folder, and delete the folder.
-            directory = f"{app.config["UPLOAD_FOLDER"]}/Interiors/{id}"
-            for file in os.listdir(directory):
-                os.remove(f"{directory}/{file}")
-            os.rmdir(directory)
+            # Find the moons that have the interior before it is deleted,
+            # so that they can be removed from the page cache.
+            moon_ids = execute_query("SELECT id FROM Moons WHERE interior=?", (id,))
+
+            # The rows are deleted in one transaction,
+            # and the files are only deleted once it has been committed.
+            with unit_of_work():
+                # Delete the interior.
+                execute_query("DELETE FROM Interiors WHERE id=?", (id,))
+                execute_query("DELETE FROM Pictures WHERE owner_type='Interiors' AND owner_id=?", (id,))
+                unindex_search("Interiors", id)
+                # Delete the folder of images, and the smaller copies of the images.
+                stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{id}")
+                stage_delete(get_variant_directory("Interiors", id))
+
+            bump_data_versions("Interiors", "Pictures")
+            invalidate_pages(("interiors", None), ("interior", id),
+                             *[("moon", i[0]) for i in moon_ids])
             # Redirect the user to the interior list.
             return app.redirect("/interiors")
         else:
@@ -1967,9 +4105,7 @@ def delete_interior(id):
 @app.route("/admin/interiors/addimage/<int:id>")  # Page to add interior image.
 def add_interior_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
-        global fail_message
-
+    if is_admin():
         # Return a 404 error if the id is 1,
         # because the interior shouldn't be edited.
         if id == 1:
@@ -1983,10 +4119,8 @@ def add_interior_image_page(id):
         # Fetch the interior name.
         interior_name = execute_query("SELECT name FROM Interiors WHERE id=?;", (id,))
 
-        # The fail message should only be displayed once,
-        # so the current fail message is stored, and then reset.
-        submit_message = fail_message
-        fail_message = ""
+        # The fail message is only displayed once.
+        submit_message = get_message("fail")
         return render_template("interiors/interioradminaddimage.html",
                                name=interior_name[0][0],
                                title=get_title("/admin/interiors/addimage"),
@@ -2000,7 +4134,7 @@ def add_interior_image_page(id):
 @app.route("/admin/interiors/addinteriorimage/<int:id>", methods=["GET", "POST"])  # Add entity image.
 def add_interior_image(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Return a 404 error if the id is 1,
         # because the interior shouldn't be edited.
@@ -2020,21 +4154,17 @@ def add_interior_image(id):
         if not image_data:
             return reject_input(f"/admin/interiors/addimage/{id}", code_params.invalid_image)
 
-        # Save the picture to interiors's folder.
-        image_data[0].save(os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{id}/",
-                                        image_name))
-
-        # Update the pictures column in the Interiors table.
-        # The string is converted to a list, the new picture name is appended,
-        # it is converted back to a string and put back in the database.
-        pictures = execute_query("SELECT pictures FROM Interiors WHERE id=?", (id,))[0][0]
-        pictures = set_picture_list(pictures)
-        pictures.append(image_name)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Interiors
-                      SET pictures = ?
-                      WHERE id = ?;''', (pictures, id))
+        # The picture is only kept if it is added to the gallery.
+        with unit_of_work():
+            # Save the picture to interiors's folder.
+            stage_upload(image_data[0], os.path.join(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{id}/",
+                                                     image_name))
+            after_commit(queue_image_variants, "Interiors", id, image_name)
+
+            # Add the picture to the end of the interior's gallery.
+            add_picture("Interiors", id, image_name)
+        bump_data_versions("Pictures")
+        invalidate_pages(("interior", id))
 
         # Redirect the user to the entity data page.
         return app.redirect(f"/interiors/{id}")
@@ -2046,7 +4176,7 @@ def add_interior_image(id):
 @app.route("/admin/interiors/deleteimage/<int:id>")
 def delete_interior_image_page(id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Return a 404 error if the id is 1,
         # because the interior shouldn't be edited.
@@ -2058,15 +4188,12 @@ def delete_interior_image_page(id):
         if not execute_query("SELECT id FROM Interiors WHERE id=?;", (id,)):
             abort(404)
 
-        # Fetch the picture string for the interior, and convert it to a list.
-        picture_data = execute_query("SELECT pictures FROM Interiors WHERE id=?;", (id,))
-        picture_data = set_picture_list(picture_data[0][0])
-        picture_id = []
+        # Fetch the interior's pictures, and split them into
+        # a list of picture ids and a list of file names.
+        picture_data = get_pictures("Interiors", id)
+        picture_id = [picture[0] for picture in picture_data]
         picture_count = len(picture_data)
-
-        # Add all of the picture indexes to a list.
-        for i in range(picture_count):
-            picture_id.append(i)
+        picture_data = [picture[1] for picture in picture_data]
         return render_template("interiors/interioradmindeleteimage.html",
                                title=get_title("/admin/interiors/deleteimage"),
                                pictures=picture_data,
@@ -2083,32 +4210,31 @@ def delete_interior_image_page(id):
 @app.route("/admin/interiors/deleteinteriorimage/<int:interior_id>/<int:picture_id>")
 def delete_interior_image(interior_id, picture_id):
     # Check if the user is logged in as admin.
-    if admin:
+    if is_admin():
 
         # Return a 404 error if the id is 1,
         # because the interior shouldn't be edited.
         if interior_id == 1:
             abort(404)
 
-        # Fetch the picture string, convert it to a list.
-        # Return a 404 error if the picture index doesn't exist.
+        # If the id doesn't belong to the Interiors table,
+        # return a 404 error.
         if not execute_query("SELECT id FROM Interiors WHERE id=?", (interior_id,)):
             abort(404)
-        pictures = execute_query("SELECT pictures FROM Interiors WHERE id=?", (interior_id,))
-        pictures = set_picture_list(pictures[0][0])
-        if picture_id < 0 or picture_id >= len(pictures):
-            abort(404)
 
-        # Delete the picture from the interior folder, remove it from the list,
-        # and re-add the string to the database.
-        os.remove(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{interior_id}/{pictures[picture_id]}")
-        pictures.pop(picture_id)
-        pictures = " ".join(pictures)
-        execute_query('''
-                      UPDATE Interiors
-                      SET pictures = ?
-                      WHERE id=?''',
-                      (pictures, interior_id))
+        with unit_of_work():
+            # Remove the picture from the interior's gallery.
+            # Return a 404 error if the picture doesn't belong to the interior.
+            picture_name = delete_picture("Interiors", interior_id, picture_id)
+            if not picture_name:
+                abort(404)
+
+            # Delete the picture and its smaller copies from the interior folder.
+            stage_delete(f"{app.config["UPLOAD_FOLDER"]}/Interiors/{interior_id}/{picture_name}")
+            after_commit(delete_image_variants, "Interiors", interior_id, picture_name)
+
+        bump_data_versions("Pictures")
+        invalidate_pages(("interior", interior_id))
 
         # Redirect the user to the interior data page.
         return app.redirect(f"/interiors/{interior_id}")
@@ -2117,6 +4243,68 @@ def delete_interior_image(interior_id, picture_id):
         return admin_perms_denied()
 
 
+@app.route("/admin/import")  # Page to import many records at once.
+def import_page():
+    # Check if the user is logged in as admin.
+    if is_admin():
+        return render_template("adminimport.html",
+                               title=get_title("/admin/import"))
+    else:
+        # Redirect the user to a page denying admin access.
+        return admin_perms_denied()
+
+
+@app.route("/admin/importrecords", methods=["GET", "POST"])  # Import the uploaded records.
+def import_uploaded_records():
+    # Check if the user is logged in as admin.
+    if is_admin():
+        # The records file is needed, but the image archive is optional.
+        records = request.files.get("records")
+        if not records or not records.filename:
+            return render_template("adminimport.html",
+                                   title=get_title("/admin/import"),
+                                   problems=["No records file was uploaded"])
+        parsed, problems = read_import_records(records.read(), records.filename)
+        counts = {}
+        if not problems:
+            images = request.files.get("images")
+            try:
+                archive = zipfile.ZipFile(images.stream) if images and images.filename else None
+            except zipfile.BadZipFile:
+                archive = None
+                problems = ["The image archive isn't a zip file"]
+            if not problems:
+                counts, problems = import_records(parsed, archive, bool(request.form.get("variants")))
+
+        # The page lists every problem that was found, or how many records were imported.
+        return render_template("adminimport.html",
+                               title=get_title("/admin/import"),
+                               problems=problems,
+                               counts=counts)
+    else:
+        # Redirect the user to a page denying admin access.
+        return admin_perms_denied()
+
+
+@app.route("/admin/cachestats")  # Page cache statistics.
+def page_cache_stats_page():
+    # Check if the user is logged in as admin.
+    if is_admin():
+        # Flask sends dictionaries as JSON.
+        return get_page_cache_stats()
+    else:
+        # Redirect the user to a page denying admin access.
+        return admin_perms_denied()
+
+
+@app.route("/metrics")  # Metrics for Prometheus to collect.
+def metrics():
+    # Return a 404 error if metrics have been turned off.
+    if not app.config["METRICS_ENABLED"]:
+        abort(404)
+    return get_metrics_text(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
 @app.errorhandler(404)  # Page for 404 errors.
 def error404(e):
     # Redirect the user to the error page with a 404 error code.
@@ -2129,6 +4317,376 @@ def error500(e):
     return push_error(500, e)
 
 
+# The app can also be served by an ASGI server such as uvicorn, with "flask serve-asgi"
+# or "uvicorn app:asgi_app". The request body is read on the event loop,
+# so a slow upload only holds a connection, and not one of the worker threads.
+# Once the whole body has arrived, the request is run by the app on a worker thread.
+asgi_executor = None
+
+
+def get_asgi_executor():
+    '''Gets the worker threads that ASGI requests are run on, creating them if needed'''
+    global asgi_executor
+    if asgi_executor is None:
+        asgi_executor = concurrent.futures.ThreadPoolExecutor(app.config["ASGI_THREADS"],
+                                                              thread_name_prefix="asgi")
+    return asgi_executor
+
+
+def get_asgi_environ(scope, body):
+    '''Builds the WSGI environ of an ASGI HTTP request'''
+    # WSGI strings hold bytes decoded as latin-1, while ASGI paths are already decoded.
+    root_path = scope.get("root_path", "")
+    path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode().decode("latin-1"),
+        "PATH_INFO": path.encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        # The whole body has already been read, so the app can read it to the end
+        # even when there is no Content-Length, as with a chunked request.
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin-1")
+        # Repeated headers are joined into one, the same as a WSGI server does,
+        # except that cookies are separated by semicolons rather than commas.
+        separator = "; " if name == "HTTP_COOKIE" else ","
+        environ[name] = f"{environ[name]}{separator}{value}" if name in environ else value
+    return environ
+
+
+def run_asgi_request(environ, send, loop):
+    '''Runs a request through the app on a worker thread, sending the response back to the event loop'''
+    response = {}
+
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response.get("started"):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                               for name, value in headers]
+
+    def send_start():
+        # The status and headers can change until the first part of the body is ready.
+        if not response.get("started"):
+            response["started"] = True
+            send_message({"type": "http.response.start",
+                          "status": response["status"],
+                          "headers": response["headers"]})
+
+    body = app.wsgi_app(environ, start_response)
+    try:
+        # Streamed pages are sent a part at a time as they are made.
+        for chunk in body:
+            if chunk:
+                send_start()
+                send_message({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    send_start()
+    send_message({"type": "http.response.body", "body": b""})
+
+
+async def asgi_app(scope, receive, send):
+    '''Serves the app to an ASGI server'''
+    if scope["type"] == "lifespan":
+        # The pooled connections and worker threads are closed when the server stops.
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                close_connection_pool()
+                if asgi_executor is not None:
+                    asgi_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    # The body is collected in memory, and moved to a temporary file if it gets large.
+    # Bodies over the app's size limit are turned away before they are read.
+    max_length = app.config["MAX_CONTENT_LENGTH"]
+    with tempfile.SpooledTemporaryFile(max_size=app.config["ASGI_SPOOL_BYTES"]) as body:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.write(message.get("body", b""))
+            if max_length is not None and body.tell() > max_length:
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"text/plain")]})
+                await send({"type": "http.response.body", "body": b"Request Entity Too Large"})
+                return
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_asgi_executor(), run_asgi_request,
+                                   get_asgi_environ(scope, body), send, loop)
+
+
+# The views that are exported to the static site, with the table of the items that have a data page.
+# Everything else, like the search, the login and the admin pages, is left to the app.
+export_views = {"home": None, "moons": None, "entities": None, "tools": None,
+                "weathers": None, "interiors": None,
+                "moon": "Moons", "entity": "Entities", "tool": "Tools",
+                "weather": "Weathers", "interior": "Interiors"}
+export_lock = threading.Lock()
+export_link_pattern = re.compile(r'(href|src|action|srcset)="([^"]*)"')
+
+
+def get_export_pages():
+    '''Gets the (view name, id) of every page of the static site'''
+    pages = []
+    for view, table in export_views.items():
+        if table is None:
+            pages.append((view, None))
+        else:
+            pages += [(view, id) for id in sorted(repository[table])]
+    return pages
+
+
+def get_export_url(view, id):
+    '''Gets the URL of a page of the static site'''
+    return app.url_map.bind("").build(view, {} if id is None else {"id": id})
+
+
+def is_export_url(url):
+    '''Checks whether a URL is one of the pages of the static site'''
+    try:
+        endpoint = app.url_map.bind("").match(url, method="GET")[0]
+    except HTTPException:
+        return False
+    return endpoint in export_views
+
+
+def get_export_folder(url):
+    '''Gets the folder that a page is exported to, relative to the static site'''
+    # Each page is the index.html of its own folder, so the pages keep the same URLs as in the app.
+    return url.strip("/") or "."
+
+
+def get_export_path(folder, view, id):
+    '''Gets the file that a page is exported to'''
+    return os.path.normpath(os.path.join(folder, get_export_folder(get_export_url(view, id)), "index.html"))
+
+
+def get_relative_link(link, page_url):
+    '''Makes a link on an exported page relative to the page, if it points into the static site'''
+    parts = urllib.parse.urlsplit(link)
+    if parts.scheme or parts.netloc or not parts.path:
+        return link
+    url = urllib.parse.urljoin(page_url, parts.path)
+    if url.startswith(f"{app.static_url_path}/"):
+        target = url.lstrip("/")
+    elif is_export_url(url):
+        target = get_export_folder(url)
+    else:
+        # Links to pages that aren't exported stay as they are,
+        # so the web server can pass them on to the app.
+        return link
+    relative = posixpath.relpath(target, get_export_folder(page_url))
+    if not url.startswith(f"{app.static_url_path}/"):
+        relative += "/"
+    return urllib.parse.urlunsplit(("", "", relative, parts.query, parts.fragment))
+
+
+def make_links_relative(html, page_url):
+    '''Makes the links on an exported page relative, so the site works from any folder'''
+    def replace(match):
+        if match[1] == "srcset":
+            # Each image in a srcset is followed by its width.
+            links = ", ".join(" ".join([get_relative_link(image.split()[0], page_url), *image.split()[1:]])
+                              for image in match[2].split(","))
+        else:
+            links = get_relative_link(match[2], page_url)
+        return f'{match[1]}="{links}"'
+    return export_link_pattern.sub(replace, html)
+
+
+def write_export_file(path, data):
+    '''Writes a file of the static site if it has changed, and returns whether it was written'''
+    try:
+        with open(path, "rb") as file:
+            if file.read() == data:
+                return False
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # The file is written next to where it goes and then moved into place,
+    # so the web server never sends half of a file.
+    temporary = f"{path}.{os.getpid()}"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+    return True
+
+
+def remove_export_file(path):
+    '''Removes a file of the static site, and its folder if that is left empty'''
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+    with contextlib.suppress(OSError):
+        os.removedirs(os.path.dirname(path))
+
+
+def export_pages(folder, pages):
+    '''Renders the given (view name, id) pages into the static site, and gets how many were written'''
+    # The pages are requested without a session, so they are the versions that visitors see.
+    # Web servers like nginx can send the compressed copies straight from the disk.
+    client = app.test_client()
+    written = 0
+    for view, id in pages:
+        url = get_export_url(view, id)
+        path = get_export_path(folder, view, id)
+        response = client.get(url)
+        if response.status_code == 404:
+            # The item has been deleted, so its page is removed.
+            for suffix in ["", ".gz", ".br"]:
+                remove_export_file(path + suffix)
+            continue
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} couldn't be exported, it returned {response.status_code}")
+        html = make_links_relative(response.get_data(as_text=True), url).encode()
+        written += write_export_file(path, html)
+        write_export_file(path + ".gz", compress(html, "gzip"))
+        if brotli is not None:
+            write_export_file(path + ".br", compress(html, "br"))
+    return written
+
+
+def export_static_files(folder):
+    '''Copies the static files that have changed into the static site, and removes the ones that are gone'''
+    target_folder = os.path.join(folder, os.path.basename(app.static_url_path))
+    kept = set()
+    copied = 0
+    for directory, folders, files in os.walk(app.static_folder):
+        for file in files:
+            source = os.path.join(directory, file)
+            filename = os.path.relpath(source, app.static_folder)
+            target = os.path.join(target_folder, filename)
+            kept.add(target)
+            # The copies keep the time the file was changed,
+            # so files that haven't changed since the last export are skipped without being read.
+            source_stat = os.stat(source)
+            try:
+                target_stat = os.stat(target)
+                changed = (target_stat.st_size, target_stat.st_mtime_ns) != (source_stat.st_size,
+                                                                             source_stat.st_mtime_ns)
+            except FileNotFoundError:
+                changed = True
+            if changed:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, f"{target}.{os.getpid()}")
+                os.replace(f"{target}.{os.getpid()}", target)
+                copied += 1
+            # The compressed copies that the app sends are kept beside the files.
+            compressed = get_compressed_static_file(filename.replace(os.sep, "/")) or {}
+            for encoding, suffix in [("gzip", ".gz"), ("br", ".br")]:
+                if encoding in compressed:
+                    write_export_file(target + suffix, compressed[encoding])
+                    kept.add(target + suffix)
+    for directory, folders, files in os.walk(target_folder, topdown=False):
+        for file in files:
+            if os.path.join(directory, file) not in kept:
+                remove_export_file(os.path.join(directory, file))
+    return copied
+
+
+def export_site(folder):
+    '''Exports every public page and the static files, only writing the files that have changed'''
+    folder = os.path.normpath(folder)
+    with export_lock:
+        copied = export_static_files(folder)
+        pages = get_export_pages()
+        written = export_pages(folder, pages)
+        # Pages of items that were deleted while nothing was exporting are removed.
+        exported = {get_export_path(folder, view, id) for view, id in pages}
+        static_folder = os.path.join(folder, os.path.basename(app.static_url_path))
+        for directory, folders, files in os.walk(folder, topdown=False):
+            if directory == static_folder or directory.startswith(static_folder + os.sep):
+                continue
+            if "index.html" in files and os.path.join(directory, "index.html") not in exported:
+                for suffix in ["", ".gz", ".br"]:
+                    remove_export_file(os.path.join(directory, "index.html" + suffix))
+    return {"pages": len(pages), "written": written, "copied": copied}
+
+
+def export_changed_pages(pages):
+    '''Exports again the given (view name, id) pages that an admin write changed'''
+    # Only the pages that the write removed from the page cache are remade,
+    # along with any images it added or removed.
+    # A new item's page was never cached, so the pages that haven't been exported yet are added.
+    folder = app.config["STATIC_EXPORT_FOLDER"]
+    pages = [(view, id) for view, id in pages if view in export_views]
+    pages += [page for page in get_export_pages()
+              if page not in pages and not os.path.exists(get_export_path(folder, *page))]
+    try:
+        with export_lock:
+            export_static_files(folder)
+            export_pages(folder, pages)
+    except (OSError, RuntimeError):
+        # The write has already been made, so it isn't undone because the export failed.
+        # Running "flask export-site" again brings the static site up to date.
+        app.logger.exception("The static site couldn't be updated")
+
+
+@app.cli.command("export-site")  # Export the public pages as a static site.
+@click.option("--folder", type=click.Path(file_okay=False),
+              help="The folder to export to, if it isn't the one set in code_params.")
+def export_site_command(folder):
+    '''Exports the public pages and static files as a static site, writing only what has changed'''
+    folder = folder or app.config["STATIC_EXPORT_FOLDER"]
+    if not folder:
+        raise click.UsageError("Give a folder with --folder, or set static_export_folder in code_params.")
+    result = export_site(folder)
+    click.echo(f"Exported {result['pages']} pages to {folder}: {result['written']} changed, "
+               f"{result['copied']} static files copied")
+
+
+@app.cli.command("serve-asgi")  # Serve the app with uvicorn, as an ASGI app.
+@click.option("--host", default="127.0.0.1", help="The address to listen on.")
+@click.option("--port", default=5000, help="The port to listen on.")
+def serve_asgi(host, port):
+    '''Serves the app with uvicorn, so that slow uploads don't hold a worker thread'''
+    if uvicorn is None:
+        raise click.ClickException("uvicorn is needed to serve the app as an ASGI app.")
+    uvicorn.run(asgi_app, host=host, port=port, log_level="info")
+
+
+# Bring the database schema up to date,
+# copy it into memory if reads are served from memory,
+# and load the reference data and compress the static files once when the app starts.
+if app.config["MIGRATE_ON_STARTUP"]:
+    run_migrations()
+refresh_snapshot()
+load_data_versions()
+load_reference_data()
+load_repository()
+precompress_static_files()
+
+
 # Run the code if it is the file being run.
 if __name__ == "__main__":
     app.run()
@@ -0,0 +1,202 @@
+'''Compares how the WSGI and ASGI serving modes cope with many slow uploads at once.
+
+Each mode is started as its own server against a copy of LC.db and the uploaded images.
+While a number of clients upload an image slowly, a few other clients keep requesting
+a page, and the page's latency, the uploads that succeeded and the server's threads are recorded.
+
+The WSGI mode is the threaded server that "python app.py" starts,
+and the ASGI mode is uvicorn serving app.asgi_app, so uvicorn needs to be installed.
+Run from the repository root with: python -m benchmarks.concurrency
+'''
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.routes import ROOT, ADMIN_USERNAME, ADMIN_PASSWORD, UPLOAD_IMAGE, copy_data
+
+HOST = "127.0.0.1"
+
+# The code that starts each serving mode, run from inside the copied data.
+SERVERS = {
+    "wsgi": "from werkzeug.serving import make_server\n"
+            "make_server({host!r}, {port}, app.app, threaded=True).serve_forever()",
+    "asgi": "import uvicorn\n"
+            "uvicorn.run(app.asgi_app, host={host!r}, port={port}, log_level='warning')",
+}
+
+# The page that is requested while the uploads are being sent, and where the uploads go.
+PAGE = "/moons/1"
+UPLOAD = "/admin/tools/addtoolimage/1"
+BOUNDARY = "benchmarkboundary"
+
+
+def get_free_port():
+    '''Gets a port that nothing is listening on'''
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, directory, port, variants):
+    '''Starts a server for the given mode, and waits until it accepts connections'''
+    code = f"import sys\nsys.path.insert(0, {ROOT!r})\nimport app\n"
+    # Making the smaller copies of every upload takes far longer than receiving it,
+    # so by default they aren't made, and only the serving of the connections is compared.
+    if not variants:
+        code += "app.code_params.image_variant_widths = []\n"
+    code += SERVERS[mode].format(host=HOST, port=port)
+    server = subprocess.Popen([sys.executable, "-c", code], cwd=directory,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for i in range(200):
+        try:
+            socket.create_connection((HOST, port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError(f"The {mode} server didn't start")
+
+
+def count_threads(pid):
+    '''Gets the number of threads a process is running'''
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def send_request(port, method, path, headers=None, body=b"", pieces=1, seconds=0.0):
+    '''Sends a request, optionally spreading its body over a number of seconds, and reads the response'''
+    reader, writer = await asyncio.open_connection(HOST, port)
+    head = [f"{method} {path} HTTP/1.1", f"Host: {HOST}:{port}", "Connection: close",
+            f"Content-Length: {len(body)}"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+    size = -(-len(body) // pieces) if body else 0
+    for start in range(0, len(body), size or 1):
+        writer.write(body[start:start + size])
+        await writer.drain()
+        if seconds:
+            await asyncio.sleep(seconds / pieces)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    header_lines = rest.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+    return int(status_line.split()[1]), header_lines
+
+
+async def log_in(port):
+    '''Logs in as the benchmark admin, and gets the cookies the server set'''
+    body = f"username={ADMIN_USERNAME}&password={ADMIN_PASSWORD}".encode()
+    status, headers = await send_request(port, "POST", "/loginregister",
+                                         {"Content-Type": "application/x-www-form-urlencoded"}, body)
+    cookies = [line.split(":", 1)[1].split(";", 1)[0].strip()
+               for line in headers if line.lower().startswith("set-cookie:")]
+    return "; ".join(cookies)
+
+
+def get_upload_body():
+    '''Gets a multipart form holding the upload image'''
+    with open(UPLOAD_IMAGE, "rb") as file:
+        image = file.read()
+    return (f"--{BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="image"; filename="benchmark.jpg"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + image + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def run_load(port, pid, uploads, readers, seconds):
+    '''Sends slow uploads while other clients request a page, and measures how the server copes'''
+    cookie = await log_in(port)
+    body = get_upload_body()
+    headers = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}", "Cookie": cookie}
+    latencies = []
+    errors = 0
+    peak_threads = count_threads(pid)
+    finished = asyncio.Event()
+
+    async def read_page():
+        nonlocal errors
+        while not finished.is_set():
+            start = time.perf_counter()
+            try:
+                status, _ = await send_request(port, "GET", PAGE)
+            except OSError:
+                status = None
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    async def upload():
+        try:
+            status, _ = await send_request(port, "POST", UPLOAD, headers, body, pieces=20, seconds=seconds)
+        except OSError:
+            return False
+        return status == 302
+
+    async def watch_threads():
+        nonlocal peak_threads
+        while not finished.is_set():
+            peak_threads = max(peak_threads, count_threads(pid))
+            await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(read_page()) for i in range(readers)]
+    tasks.append(asyncio.create_task(watch_threads()))
+    results = await asyncio.gather(*[upload() for i in range(uploads)])
+    finished.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else [0] * 99
+    return {"uploads": uploads,
+            "uploaded": sum(results),
+            "page_requests_per_second": len(latencies) / elapsed,
+            "page_p50_ms": cuts[49] * 1000,
+            "page_p99_ms": cuts[98] * 1000,
+            "page_errors": errors,
+            "peak_threads": peak_threads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the WSGI and ASGI modes under many slow uploads.")
+    parser.add_argument("--uploads", type=int, nargs="+", default=[10, 50, 200],
+                        help="the numbers of slow uploads sent at once (default 10 50 200)")
+    parser.add_argument("--readers", type=int, default=8,
+                        help="clients requesting a page during the uploads (default 8)")
+    parser.add_argument("--seconds", type=float, default=2.0,
+                        help="how long each upload takes to send (default 2)")
+    parser.add_argument("--modes", nargs="+", choices=list(SERVERS), default=list(SERVERS),
+                        help="the serving modes to compare (default both)")
+    parser.add_argument("--variants", action="store_true",
+                        help="make the smaller copies of the uploaded images, as the app normally does")
+    args = parser.parse_args()
+
+    print(f"{'mode':<6}{'uploads':>9}{'uploaded':>10}{'page req/s':>12}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'errors':>8}{'threads':>9}")
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as directory:
+            copy_data(directory)
+            port = get_free_port()
+            server = start_server(mode, directory, port, args.variants)
+            try:
+                for uploads in args.uploads:
+                    result = asyncio.run(run_load(port, server.pid, uploads, args.readers, args.seconds))
+                    print(f"{mode:<6}{result['uploads']:>9}{result['uploaded']:>10}"
+                          f"{result['page_requests_per_second']:>12.1f}{result['page_p50_ms']:>10.2f}"
+                          f"{result['page_p99_ms']:>10.2f}{result['page_errors']:>8}"
+                          f"{result['peak_threads']:>9}")
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+'''Compares request times with and without the database connection pool.
+
+Run from the repository root with: python -m benchmarks.connection_pool
+'''
+import time
+import app as lc
+
+# The routes to time, and how many times each one is requested.
+ROUTES = ["/", "/moons", "/moons/1", "/entity/1", "/weathers/1", "/interiors/2"]
+REQUESTS = 500
+
+
+def time_routes(pool_size):
+    '''Returns the average time per request in milliseconds for each route'''
+    lc.app.config["DB_POOL_SIZE"] = pool_size
+    lc.close_connection_pool()
+    client = lc.app.test_client()
+    results = {}
+    for route in ROUTES:
+        # Warm up the route once so that template compiling isn't timed.
+        client.get(route)
+        start = time.perf_counter()
+        for i in range(REQUESTS):
+            client.get(route)
+        results[route] = (time.perf_counter() - start) / REQUESTS * 1000
+    return results
+
+
+if __name__ == "__main__":
+    unpooled = time_routes(0)
+    pooled = time_routes(lc.code_params.db_pool_size)
+    print(f"{'route':<16}{'unpooled ms':>14}{'pooled ms':>12}{'saved':>8}")
+    for route in ROUTES:
+        saved = (1 - pooled[route] / unpooled[route]) * 100
+        print(f"{route:<16}{unpooled[route]:>14.3f}{pooled[route]:>12.3f}{saved:>7.1f}%")
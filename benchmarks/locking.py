@@ -0,0 +1,146 @@
+'''Compares how connection profiles cope with readers and writers using the database at once.
+
+Reader threads keep running the queries of the data pages while writer threads keep adding
+and removing gallery pictures, each in its own unit of work, like the admin pages do.
+Each profile gets its own copy of the database, and the read and write latencies
+and the number of "database is locked" errors are recorded.
+
+The "before" profile is how connections were opened before the connection profile existed:
+the rollback journal, SQLite's other defaults, and Python's busy timeout of 5 seconds.
+The "tuned" profile is the one in code_params.
+Run from the repository root with: python -m benchmarks.locking
+'''
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import code_params
+from benchmarks import routes
+
+PROFILES = {
+    "before": {"DB_JOURNAL_MODE": "DELETE", "DB_SYNCHRONOUS": None, "DB_MMAP_SIZE": None,
+               "DB_CACHE_SIZE": None, "DB_TEMP_STORE": None, "DB_BUSY_TIMEOUT": 5.0},
+    "tuned": {"DB_JOURNAL_MODE": code_params.db_journal_mode,
+              "DB_SYNCHRONOUS": code_params.db_synchronous,
+              "DB_MMAP_SIZE": code_params.db_mmap_size,
+              "DB_CACHE_SIZE": code_params.db_cache_size,
+              "DB_TEMP_STORE": code_params.db_temp_store,
+              "DB_BUSY_TIMEOUT": code_params.db_busy_timeout},
+}
+
+# The queries that the readers run, with the table their ids come from.
+READS = [("query_moons", "Moons.id = ?", "Moons"),
+         ("query_entities", "Entities.id = ?", "Entities"),
+         ("query_tools", "id = ?", "Tools"),
+         ("query_interiors", "id = ?", "Interiors")]
+
+
+def copy_database(directory, name):
+    '''Copies the app's database into a new file in the given directory'''
+    path = os.path.join(directory, name)
+    source = sqlite3.connect(routes.lc.DATABASE)
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    target.close()
+    return path
+
+
+def run_profile(readers, writers, seconds):
+    '''Runs the readers and writers together, and gets their latencies and errors'''
+    lc = routes.lc
+    reads = []
+    writes = []
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    ids = {table: routes.get_ids(table) for function, condition, table in READS}
+    stop = time.perf_counter() + seconds
+
+    def read(number):
+        with lc.app.app_context():
+            i = number
+            while time.perf_counter() < stop:
+                function, condition, table = READS[i % len(READS)]
+                start = time.perf_counter()
+                try:
+                    getattr(lc, function)(condition, (ids[table][i % len(ids[table])],))
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors["read"] += 1
+                else:
+                    with lock:
+                        reads.append(time.perf_counter() - start)
+                i += 1
+
+    def write(number):
+        with lc.app.app_context():
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                try:
+                    with lc.unit_of_work():
+                        lc.execute_query('''
+                                         INSERT INTO Pictures (owner_type, owner_id, filename,
+                                                               sort_order, byte_size)
+                                         VALUES ('Moons', 1, ?, 1000, 0);''', (f"locking{number}.jpg",))
+                    with lc.unit_of_work():
+                        lc.execute_query("DELETE FROM Pictures WHERE filename=?;", (f"locking{number}.jpg",))
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors["write"] += 1
+                else:
+                    with lock:
+                        writes.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    def percentiles(times):
+        if len(times) < 2:
+            return [0.0] * 99
+        return [cut * 1000 for cut in statistics.quantiles(times, n=100, method="inclusive")]
+
+    read_cuts = percentiles(reads)
+    write_cuts = percentiles(writes)
+    return {"reads": len(reads), "read_p50_ms": read_cuts[49], "read_p99_ms": read_cuts[98],
+            "writes": len(writes), "write_p50_ms": write_cuts[49], "write_p99_ms": write_cuts[98],
+            "read_errors": errors["read"], "write_errors": errors["write"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares connection profiles under concurrent reads and writes.")
+    parser.add_argument("--readers", type=int, default=8, help="reader threads (default 8)")
+    parser.add_argument("--writers", type=int, default=2, help="writer threads (default 2)")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long each profile runs (default 5)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        routes.set_up(directory)
+        lc = routes.lc
+        # Reads go to the database, not to the in-memory copy of it.
+        lc.app.config["MEMORY_SNAPSHOT"] = False
+        for name, profile in PROFILES.items():
+            lc.close_connection_pool()
+            lc.DATABASE = copy_database(directory, f"{name}.db")
+            lc.app.config.update(profile)
+            results[name] = run_profile(args.readers, args.writers, args.seconds)
+        lc.close_connection_pool()
+        os.chdir(routes.ROOT)
+
+    print(f"{'profile':<8}{'reads':>8}{'read p50':>10}{'read p99':>10}{'writes':>8}"
+          f"{'write p50':>11}{'write p99':>11}{'read errors':>13}{'write errors':>14}")
+    for name, result in results.items():
+        print(f"{name:<8}{result['reads']:>8}{result['read_p50_ms']:>10.3f}{result['read_p99_ms']:>10.3f}"
+              f"{result['writes']:>8}{result['write_p50_ms']:>11.3f}{result['write_p99_ms']:>11.3f}"
+              f"{result['read_errors']:>13}{result['write_errors']:>14}")
+
+
+if __name__ == "__main__":
+    main()
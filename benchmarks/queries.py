@@ -0,0 +1,105 @@
+'''Checks that the data pages don't run a query for every related row.
+
+Every data page, and a missing id for each of them, is requested through Flask's test client
+on a copy of LC.db, and the queries each request runs are counted through record_query.
+The data pages are served from the repository, so a request may run at most one query.
+Each function the repository is loaded with is also called for one item, for a missing item
+and for the whole table, and has to run exactly one query each time, however many rows it gets.
+
+If any count is wrong, the script exits with a non-zero status.
+Run from the repository root with: python -m benchmarks.queries
+'''
+import argparse
+import sys
+import tempfile
+from benchmarks import routes
+from benchmarks.routes import DATA_ROUTES, set_up, get_ids
+
+# An id that none of the tables use, for the pages that give a 404.
+MISSING_ID = 999999
+
+# The function that gets each table's items, with the column their id is in.
+QUERIES = {"Moons": ("query_moons", "Moons.id"),
+           "Entities": ("query_entities", "Entities.id"),
+           "Tools": ("query_tools", "Tools.id"),
+           "Weathers": ("query_weathers", "Weathers.id"),
+           "Interiors": ("query_interiors", "Interiors.id")}
+
+
+def count_queries(queries, function, *args):
+    '''Runs a function, and gets its result and the queries it ran'''
+    queries.clear()
+    result = function(*args)
+    return result, list(queries)
+
+
+def check_routes(client, queries):
+    '''Requests every data page and a missing one, and gets a list of (name, passed, detail)'''
+    results = []
+    for route, table in DATA_ROUTES.items():
+        for id in get_ids(table) + [MISSING_ID]:
+            path = route.replace("<id>", str(id))
+            response, ran = count_queries(queries, client.get, path)
+            expected = 404 if id == MISSING_ID else 200
+            results.append((path, response.status_code == expected and len(ran) <= 1,
+                            f"status {response.status_code}, {len(ran)} queries"))
+    return results
+
+
+def check_loaders(queries):
+    '''Calls each repository loader for one item, a missing item and every item, and gets a list of (name, passed, detail)'''
+    results = []
+    lc = routes.lc
+    for table, (name, column) in QUERIES.items():
+        function = getattr(lc, name)
+        first = get_ids(table)[0]
+        for label, args, rows in ((f"{name} one", (f"{column} = ?", (first,)), 1),
+                                  (f"{name} missing", (f"{column} = ?", (MISSING_ID,)), 0),
+                                  (f"{name} all", ("1",), len(get_ids(table)))):
+            items, ran = count_queries(queries, function, *args)
+            results.append((label, len(items) == rows and len(ran) == 1, f"{len(items)} rows, {len(ran)} queries"))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the number of queries each data page runs.")
+    parser.add_argument("--all", action="store_true",
+                        help="list every page that was requested, not only the missing ids and failures")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        set_up(directory)
+        lc = routes.lc
+        # Every query a request runs goes through record_query, so it is wrapped to note them.
+        queries = []
+        record_query = lc.record_query
+
+        def note_query(query, duration):
+            queries.append(" ".join(query.split()))
+            record_query(query, duration)
+
+        lc.record_query = note_query
+        try:
+            client = lc.app.test_client()
+            results = check_routes(client, queries)
+            # The loaders are called inside an app context, so their queries are recorded too.
+            with lc.app.app_context():
+                results += check_loaders(queries)
+        finally:
+            lc.record_query = record_query
+
+    print(f"{'check':<40}{'result':>8}  detail")
+    for name, passed, detail in results:
+        # The pages that passed are only listed when asked for, apart from the missing ids.
+        if passed and not args.all and name.startswith("/") and not name.endswith(f"/{MISSING_ID}"):
+            continue
+        print(f"{name:<40}{'ok' if passed else 'FAILED':>8}  {detail}")
+    failed = [name for name, passed, _ in results if not passed]
+    if failed:
+        print(f"{len(failed)} of {len(results)} checks failed")
+        sys.exit(1)
+    print(f"All {len(results)} checks passed")
+
+
+if __name__ == "__main__":
+    main()
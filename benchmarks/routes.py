@@ -0,0 +1,277 @@
+'''Measures the latency and throughput of the public pages and the admin write endpoints.
+
+The routes are requested through the Flask test client against a copy of LC.db
+and the uploaded images, so the real database is never changed.
+
+Run from the repository root with: python -m benchmarks.routes
+Save the results as the baseline with: python -m benchmarks.routes --save
+Every run is compared with the saved baseline, and exits with an error
+if a route has become slower by more than the threshold, or if there is no baseline to compare with.
+'''
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from werkzeug.security import generate_password_hash
+
+# The repository root, which has to stay importable after moving into the copy.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "baselines", "routes.json")
+
+# The list pages, and the data pages with the table their ids come from.
+LIST_ROUTES = ["/", "/moons", "/entity", "/tools", "/weathers", "/interiors"]
+DATA_ROUTES = {"/moons/<id>": "Moons",
+               "/entity/<id>": "Entities",
+               "/tools/<id>": "Tools",
+               "/weathers/<id>": "Weathers",
+               "/interiors/<id>": "Interiors"}
+
+# The admin account that is added to the copied database to log in with.
+ADMIN_USERNAME = "benchmark"
+ADMIN_PASSWORD = "benchmark"
+
+# The image that is uploaded by the write benchmarks.
+UPLOAD_IMAGE = os.path.join(ROOT, "static", "images", "placeholder_image.jpg")
+
+# The form sent to add each kind of item, with the route that takes it,
+# the table it is added to, and the routes to add and delete its images.
+WRITES = {
+    "moon": {"table": "Moons", "add": "/admin/addmoon",
+             "form": {"name": "Benchmark", "risk_level": "1", "price": "0", "interior": "1",
+                      "max_indoor_power": "1", "max_outdoor_power": "1", "conditions": "Conditions",
+                      "history": "History", "fauna": "Fauna", "description": "Description",
+                      "tier": "1", "weather1": "on"},
+             "delete": "/admin/deletemoon/{id}",
+             "add_image": "/admin/moons/addmoonimage/{id}",
+             "delete_image": "/admin/moons/deletemoonimage/{id}/{picture}"},
+    "entity": {"table": "Entities", "add": "/admin/addentity",
+               "form": {"name": "Benchmark", "danger_rating": "1", "bestiary": "Bestiary",
+                        "setting": "1", "fav_moon": "1", "sp_hp": "1", "mp_hp": "1", "power": "1",
+                        "max_spawned": "1", "description": "Description"},
+               "delete": "/admin/deleteentity/{id}",
+               "add_image": "/admin/entity/addentityimage/{id}",
+               "delete_image": "/admin/entity/deleteentityimage/{id}/{picture}"},
+    "tool": {"table": "Tools", "add": "/admin/addtool",
+             "form": {"name": "Benchmark", "price": "1", "weight": "1", "description": "Description"},
+             "delete": "/admin/deletetool/{id}",
+             "add_image": "/admin/tools/addtoolimage/{id}",
+             "delete_image": "/admin/tools/deletetoolimage/{id}/{picture}"},
+    "weather": {"table": "Weathers", "add": "/admin/addweather",
+                "form": {"name": "Benchmark", "description": "Description", "moon1": "on"},
+                "delete": "/admin/deleteweather/{id}",
+                "add_image": "/admin/weathers/addweatherimage/{id}",
+                "delete_image": "/admin/weathers/deleteweatherimage/{id}/{picture}"},
+    "interior": {"table": "Interiors", "add": "/admin/addinterior",
+                 "form": {"name": "Benchmark", "description": "Description"},
+                 "delete": "/admin/deleteinterior/{id}",
+                 "add_image": "/admin/interiors/addinteriorimage/{id}",
+                 "delete_image": "/admin/interiors/deleteinteriorimage/{id}/{picture}"},
+}
+
+# The app module, which is imported once the copy has been made.
+lc = None
+
+
+def copy_data(directory):
+    '''Copies the database and images into the given directory, and adds the benchmark admin'''
+    # The database is copied with the backup API, so changes that are still in its WAL are included.
+    source = sqlite3.connect(os.path.join(ROOT, "LC.db"))
+    db = sqlite3.connect(os.path.join(directory, "LC.db"))
+    source.backup(db)
+    source.close()
+    with db:
+        db.execute("INSERT INTO AdminLogins (username, passwordhash) VALUES (?, ?);",
+                   (ADMIN_USERNAME, generate_password_hash(ADMIN_PASSWORD)))
+    db.close()
+    # The image variants are left out, as they can be remade from the originals.
+    shutil.copytree(os.path.join(ROOT, "static", "images"), os.path.join(directory, "static", "images"),
+                    ignore=shutil.ignore_patterns("variants"))
+
+
+def set_up(directory):
+    '''Copies the database and images into the given directory, and imports the app there'''
+    global lc
+    copy_data(directory)
+    # The app opens LC.db and the upload folder relative to the working directory.
+    sys.path.insert(0, ROOT)
+    os.chdir(directory)
+    import app
+    lc = app
+
+
+def log_in(client):
+    '''Logs the test client in as the benchmark admin'''
+    client.post("/loginregister", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+
+
+def get_ids(table):
+    '''Gets every id in the given table'''
+    return [row[0] for row in lc.execute_query(f"SELECT id FROM {table} ORDER BY id;")]
+
+
+def get_last_id(table):
+    '''Gets the largest id in the given table'''
+    return lc.execute_query(f"SELECT MAX(id) FROM {table};")[0][0]
+
+
+def get_last_picture(table, id):
+    '''Gets the id of the last picture added to the given item'''
+    return lc.execute_query('''SELECT MAX(id) FROM Pictures
+                               WHERE owner_type=? AND owner_id=?;''', (table, id))[0][0]
+
+
+def upload(form, field):
+    '''Gets a copy of the given form with the upload image added as the given field'''
+    data = dict(form)
+    with open(UPLOAD_IMAGE, "rb") as file:
+        data[field] = (io.BytesIO(file.read()), "benchmark.jpg")
+    return data
+
+
+def timed(results, name, function):
+    '''Runs the given request, and adds its time in seconds to the results'''
+    start = time.perf_counter()
+    response = function()
+    results.setdefault(name, []).append(time.perf_counter() - start)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{name} returned {response.status_code}")
+    return response
+
+
+def time_reads(client, requests):
+    '''Requests every public page the given number of times'''
+    results = {}
+    routes = [(route, [route]) for route in LIST_ROUTES]
+    # Every id is visited in turn, so that a data page isn't only timed for one item.
+    for route, table in DATA_ROUTES.items():
+        routes.append((route, [route.replace("<id>", str(id)) for id in get_ids(table)]))
+    for name, urls in routes:
+        # Warm up each page once so that template compiling isn't timed.
+        for url in urls:
+            client.get(url)
+        for i in range(requests):
+            timed(results, name, lambda: client.get(urls[i % len(urls)]))
+    return results
+
+
+def time_writes(client, requests):
+    '''Adds and deletes every kind of item and image the given number of times'''
+    results = {}
+    log_in(client)
+    for kind, write in WRITES.items():
+        table = write["table"]
+        for i in range(requests):
+            last_id = get_last_id(table)
+            timed(results, f"add {kind}",
+                  lambda: client.post(write["add"], data=upload(write["form"], "header_picture"),
+                                      content_type="multipart/form-data"))
+            id = get_last_id(table)
+            if id == last_id:
+                raise RuntimeError(f"add {kind} didn't add a row to {table}")
+
+            timed(results, f"add {kind} image",
+                  lambda: client.post(write["add_image"].format(id=id), data=upload({}, "image"),
+                                      content_type="multipart/form-data"))
+            picture = get_last_picture(table, id)
+            timed(results, f"delete {kind} image",
+                  lambda: client.get(write["delete_image"].format(id=id, picture=picture)))
+            timed(results, f"delete {kind}", lambda: client.get(write["delete"].format(id=id)))
+    return results
+
+
+def summarise(times):
+    '''Gets the latency percentiles in milliseconds and the throughput of a list of request times'''
+    cuts = statistics.quantiles(times, n=100, method="inclusive")
+    return {"requests": len(times),
+            "p50_ms": round(cuts[49] * 1000, 4),
+            "p95_ms": round(cuts[94] * 1000, 4),
+            "p99_ms": round(cuts[98] * 1000, 4),
+            "requests_per_second": round(len(times) / sum(times), 1)}
+
+
+def compare(results, baseline, percentile, threshold):
+    '''Gets the routes that have become slower than the baseline by more than the threshold'''
+    regressions = []
+    for route, result in results.items():
+        if route not in baseline["routes"]:
+            continue
+        before = baseline["routes"][route][percentile]
+        change = result[percentile] / before - 1
+        if change > threshold:
+            regressions.append((route, before, result[percentile], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the app's routes against a copy of LC.db.")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests made to each public page (default 200)")
+    parser.add_argument("--writes", type=int, default=10,
+                        help="times each admin write is made (default 10, 0 skips them)")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="the JSON file the baseline is stored in")
+    parser.add_argument("--save", action="store_true",
+                        help="save the results as the new baseline")
+    parser.add_argument("--percentile", choices=["p50_ms", "p95_ms", "p99_ms"], default="p50_ms",
+                        help="the latency compared with the baseline (default p50_ms)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="the fraction a route can slow down by before failing (default 0.25)")
+    args = parser.parse_args()
+
+    # Without a baseline nothing can be checked, so that is an error rather than a pass,
+    # and it is reported before the routes are timed.
+    if not args.save and not os.path.isfile(args.baseline):
+        print(f"There is no baseline at {args.baseline} to compare with, run with --save to make one.")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        set_up(directory)
+        client = lc.app.test_client()
+        times = time_reads(client, args.requests)
+        if args.writes:
+            times.update(time_writes(client, args.writes))
+        # The copies of the uploaded images are made on background threads,
+        # so they are waited for, and the pooled connections closed, before the copied database is removed.
+        if lc.image_variant_executor is not None:
+            lc.image_variant_executor.shutdown(wait=True)
+        lc.close_connection_pool()
+        os.chdir(ROOT)
+
+    results = {route: summarise(route_times) for route, route_times in times.items()}
+    print(f"{'route':<24}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for route, result in results.items():
+        print(f"{route:<24}{result['requests']:>10}{result['p50_ms']:>10.3f}"
+              f"{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['requests_per_second']:>10.1f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump({"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "routes": results}, file, indent=2)
+        print(f"\nSaved the baseline to {args.baseline}")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.percentile, args.threshold)
+    if not regressions:
+        print(f"\nNo route's {args.percentile} is more than {args.threshold:.0%} slower than the baseline.")
+        return
+    print(f"\nRoutes whose {args.percentile} is more than {args.threshold:.0%} slower than the baseline:")
+    for route, before, after, change in regressions:
+        print(f"{route:<24}{before:>10.3f} -> {after:.3f} ms (+{change:.0%})")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+'''Compares serving pages from the database on disk and from the in-memory copy of it.
+
+The queries of each data page are timed on their own, and then the whole pages are timed
+with the page cache cleared before every request, so every page runs its queries.
+After the comparison, every kind of admin write is made with the in-memory copy in use,
+and the copy is checked against LC.db, exiting with an error if they differ.
+
+The routes are requested against a copy of LC.db and the uploaded images,
+so the real database is never changed.
+Run from the repository root with: python -m benchmarks.snapshot
+'''
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks import routes
+
+
+# The query each data page is built from, with the condition it is given.
+QUERIES = {"moon": ("query_moons", "Moons.id = ?", "Moons"),
+           "entity": ("query_entities", "Entities.id = ?", "Entities"),
+           "tool": ("query_tools", "id = ?", "Tools"),
+           "weather": ("query_weathers", "id = ?", "Weathers"),
+           "interior": ("query_interiors", "id = ?", "Interiors")}
+
+
+def get_urls():
+    '''Gets the list pages, and the data page of every item'''
+    urls = list(routes.LIST_ROUTES)
+    for route, table in routes.DATA_ROUTES.items():
+        urls += [route.replace("<id>", str(id)) for id in routes.get_ids(table)]
+    return urls
+
+
+def time_queries(requests):
+    '''Gets the median time in microseconds of each data page's query'''
+    results = {}
+    with routes.lc.app.test_request_context("/"):
+        for name, (function, condition, table) in QUERIES.items():
+            query = getattr(routes.lc, function)
+            ids = routes.get_ids(table)
+            times = []
+            for i in range(requests):
+                start = time.perf_counter()
+                query(condition, (ids[i % len(ids)],))
+                times.append(time.perf_counter() - start)
+            results[name] = statistics.median(times) * 1000000
+    return results
+
+
+def time_pages(client, urls, requests):
+    '''Gets the median time in milliseconds to render each page, with the page cache cleared'''
+    results = {}
+    for url in urls:
+        # Warm up each page once so that template compiling isn't timed.
+        client.get(url)
+        times = []
+        for i in range(requests):
+            routes.lc.clear_page_cache()
+            start = time.perf_counter()
+            client.get(url)
+            times.append(time.perf_counter() - start)
+        results[url] = statistics.median(times) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares reads from LC.db and from the in-memory copy.")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="requests made to each page in each mode (default 50)")
+    parser.add_argument("--queries", type=int, default=5000,
+                        help="times each data page's query is run in each mode (default 5000)")
+    parser.add_argument("--writes", type=int, default=3,
+                        help="times each admin write is made before the check (default 3)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        routes.set_up(directory)
+        lc = routes.lc
+        client = lc.app.test_client()
+        urls = get_urls()
+
+        lc.app.config["MEMORY_SNAPSHOT"] = False
+        disk_queries = time_queries(args.queries)
+        disk = time_pages(client, urls, args.requests)
+        lc.app.config["MEMORY_SNAPSHOT"] = True
+        lc.refresh_snapshot()
+        memory_queries = time_queries(args.queries)
+        memory = time_pages(client, urls, args.requests)
+
+        routes.time_writes(client, args.writes)
+        differences = lc.check_snapshot()
+        lc.close_connection_pool()
+        os.chdir(routes.ROOT)
+
+    print(f"{'query':<16}{'disk us':>10}{'memory us':>11}{'saved':>8}")
+    for name in QUERIES:
+        saved = (1 - memory_queries[name] / disk_queries[name]) * 100
+        print(f"{name:<16}{disk_queries[name]:>10.2f}{memory_queries[name]:>11.2f}{saved:>7.1f}%")
+
+    print(f"\n{'page':<16}{'disk ms':>10}{'memory ms':>11}{'saved':>8}")
+    for url in urls:
+        print(f"{url:<16}{disk[url]:>10.3f}{memory[url]:>11.3f}{(1 - memory[url] / disk[url]) * 100:>7.1f}%")
+    total_disk = sum(disk.values())
+    total_memory = sum(memory.values())
+    print(f"{'all pages':<16}{total_disk:>10.3f}{total_memory:>11.3f}{(1 - total_memory / total_disk) * 100:>7.1f}%")
+
+    if differences:
+        print(f"\nAfter the writes, the in-memory copy differs from LC.db in: {', '.join(differences)}")
+        sys.exit(1)
+    print(f"\nAfter {args.writes} of each admin write, the in-memory copy matches LC.db.")
+
+
+if __name__ == "__main__":
+    main()
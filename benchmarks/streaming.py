@@ -0,0 +1,49 @@
+'''Compares the time to first byte of pages with and without streaming.
+
+The page cache is cleared before every request, so every page is rendered.
+Run from the repository root with: python -m benchmarks.streaming
+'''
+import statistics
+import time
+import app as lc
+
+# The routes to time, and how many times each one is requested.
+ROUTES = ["/entity", "/tools", "/moons/1", "/entity/1", "/tools/1", "/weathers/1", "/interiors/2"]
+REQUESTS = 300
+
+
+def time_routes(stream):
+    '''Returns the median time to first byte and to the last byte in milliseconds for each route'''
+    lc.app.config["STREAM_PAGES"] = stream
+    client = lc.app.test_client()
+    results = {}
+    for route in ROUTES:
+        # Warm up the route once so that template compiling isn't timed.
+        client.get(route)
+        first_byte = []
+        last_byte = []
+        for i in range(REQUESTS):
+            lc.clear_page_cache()
+            start = time.perf_counter()
+            # The response isn't buffered, so the body is only made as it is read.
+            response = client.get(route, buffered=False)
+            body = iter(response.response)
+            next(body)
+            first_byte.append(time.perf_counter() - start)
+            for chunk in body:
+                pass
+            response.close()
+            last_byte.append(time.perf_counter() - start)
+        results[route] = (statistics.median(first_byte) * 1000, statistics.median(last_byte) * 1000)
+    return results
+
+
+if __name__ == "__main__":
+    buffered = time_routes(False)
+    streamed = time_routes(True)
+    print(f"{'route':<14}{'buffered ttfb':>15}{'streamed ttfb':>15}{'saved':>8}"
+          f"{'buffered total':>16}{'streamed total':>16}")
+    for route in ROUTES:
+        saved = (1 - streamed[route][0] / buffered[route][0]) * 100
+        print(f"{route:<14}{buffered[route][0]:>15.3f}{streamed[route][0]:>15.3f}{saved:>7.1f}%"
+              f"{buffered[route][1]:>16.3f}{streamed[route][1]:>16.3f}")
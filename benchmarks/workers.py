@@ -0,0 +1,148 @@
+'''Checks that two workers sharing one copy of the data agree on logins and on changes.
+
+Two servers are started as separate processes in the same copy of LC.db and the uploaded images,
+the way several workers of a deployment share them. The check logs in through one worker and
+uses the cookie on the other, makes sure a client without the cookie is refused, and deletes a tool
+through one worker and waits for it to disappear from the other within REFERENCE_DATA_CHECK_INTERVAL.
+
+If any check fails, the script exits with a non-zero status.
+Run from the repository root with: python -m benchmarks.workers
+'''
+import argparse
+import http.client
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+from benchmarks.routes import ROOT, ADMIN_USERNAME, ADMIN_PASSWORD, copy_data
+from benchmarks.concurrency import HOST, get_free_port, start_server
+
+sys.path.insert(0, ROOT)
+import code_params
+
+# The admin page that is requested on the other worker, and what it shows an admin and anyone else.
+ADMIN_PAGE = "/admin/tools/delete"
+ADMIN_MARKER = 'href="/admin/deletetool/'
+DENIED_MARKER = "Access Denied"
+
+
+def fetch(port, method, path, cookie=None, body=None):
+    '''Sends a request to the server on the given port, and gets its status, headers and body'''
+    headers = {"Cookie": cookie} if cookie else {}
+    if body is not None:
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+    connection = http.client.HTTPConnection(HOST, port, timeout=10)
+    try:
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        return response.status, response.getheaders(), response.read().decode(errors="replace")
+    finally:
+        connection.close()
+
+
+def log_in(port):
+    '''Logs in as the benchmark admin, and gets the cookies the server set'''
+    body = urlencode({"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+    status, headers, _ = fetch(port, "POST", "/loginregister", body=body)
+    cookies = [value.split(";", 1)[0].strip() for name, value in headers if name.lower() == "set-cookie"]
+    return "; ".join(cookies)
+
+
+def get_last_tool(directory):
+    '''Gets the id of the last tool in the copied database'''
+    db = sqlite3.connect(os.path.join(directory, "LC.db"))
+    try:
+        return db.execute("SELECT MAX(id) FROM Tools;").fetchone()[0]
+    finally:
+        db.close()
+
+
+def wait_for_status(port, path, status, seconds):
+    '''Requests a page until it gives the given status, and gets how long that took, or None'''
+    start = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - start
+        if fetch(port, "GET", path)[0] == status:
+            return elapsed
+        if elapsed > seconds:
+            return None
+        time.sleep(0.1)
+
+
+def run_checks(first, second, directory, interval, margin):
+    '''Runs each check against the two workers, and gets a list of (name, passed, detail)'''
+    results = []
+    cookie = log_in(first)
+    results.append(("login cookie set by the first worker", bool(cookie), cookie and "session cookie" or "no cookie"))
+
+    # The session is signed with the key both workers read, so the second one has to accept it.
+    status, _, page = fetch(second, "GET", ADMIN_PAGE, cookie)
+    accepted = status == 200 and ADMIN_MARKER in page and DENIED_MARKER not in page
+    results.append(("second worker accepts the login", accepted, f"status {status}"))
+
+    status, _, page = fetch(second, "GET", ADMIN_PAGE)
+    refused = DENIED_MARKER in page and ADMIN_MARKER not in page
+    results.append(("second worker refuses a client without the cookie", refused, f"status {status}"))
+
+    # Both workers build ETags from the table versions kept in the database, so they have to match.
+    etags = [dict((name.lower(), value) for name, value in fetch(port, "GET", "/moons/1")[1]).get("etag")
+             for port in (first, second)]
+    results.append(("both workers give the same ETag", etags[0] is not None and etags[0] == etags[1],
+                    f"{etags[0]} / {etags[1]}"))
+
+    # The tool's page is requested on the second worker first, so it is cached there before the delete.
+    tool = get_last_tool(directory)
+    path = f"/tools/{tool}"
+    status = fetch(second, "GET", path)[0]
+    results.append((f"second worker serves {path}", status == 200, f"status {status}"))
+
+    status = fetch(first, "GET", f"/admin/deletetool/{tool}", cookie)[0]
+    results.append((f"first worker deletes tool {tool}", status in (200, 302), f"status {status}"))
+
+    # The second worker only checks the database's data version every interval,
+    # so the delete has to show there within that, plus a little for the polling.
+    elapsed = wait_for_status(second, path, 404, interval + margin)
+    results.append((f"{path} gone from the second worker", elapsed is not None,
+                    f"after {elapsed:.2f}s" if elapsed is not None else f"still there after {interval + margin:.1f}s"))
+
+    _, _, page = fetch(second, "GET", "/tools")
+    results.append(("tool gone from the second worker's list", f'"/tools/{tool}"' not in page, ""))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that two workers agree on logins and changes.")
+    parser.add_argument("--margin", type=float, default=1.0,
+                        help="seconds allowed on top of REFERENCE_DATA_CHECK_INTERVAL for a change to show (default 1)")
+    args = parser.parse_args()
+    interval = code_params.reference_data_check_interval
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy_data(directory)
+        # Both servers run in the same directory, so they share LC.db, the images and the secret key file.
+        servers = []
+        try:
+            ports = []
+            for i in range(2):
+                ports.append(get_free_port())
+                servers.append(start_server("wsgi", directory, ports[-1], False))
+            results = run_checks(ports[0], ports[1], directory, interval, args.margin)
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+
+    print(f"{'check':<52}{'result':>8}  detail")
+    for name, passed, detail in results:
+        print(f"{name:<52}{'ok' if passed else 'FAILED':>8}  {detail}")
+    failed = [name for name, passed, _ in results if not passed]
+    if failed:
+        print(f"{len(failed)} of {len(results)} checks failed")
+        sys.exit(1)
+    print(f"All {len(results)} checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,3 +21,107 @@ moon_tier_range = 5
 upload_folder = "static/images"
 
 invalid_image = "Invalid image"
+
+# The maximum number of idle database connections kept open for reuse.
+# A pool size of 0 disables pooling, so each request opens its own connection.
+db_pool_size = 8
+
+# How often, in seconds, the cached page titles and home page links
+# are checked against the database for changes.
+reference_data_check_interval = 5
+
+# The maximum number of bytes of rendered pages kept in the page cache.
+page_cache_max_bytes = 4 * 1024 * 1024
+
+# The widths, in pixels, of the smaller copies that are made of every uploaded image.
+# The copies are kept in their own folder inside the upload folder.
+image_variant_widths = [320, 640, 1280]
+image_variant_folder = "variants"
+image_variant_quality = 80
+
+# The number of background threads that make the smaller copies of uploaded images.
+image_variant_threads = 2
+
+# Whether any schema migrations that haven't been applied are run when the app starts.
+# If this is off, they can be run with "flask migrate".
+migrate_on_startup = True
+
+# Queries that take longer than this many seconds are logged as slow queries.
+slow_query_seconds = 0.05
+
+# Whether request and database metrics are served at /metrics for Prometheus.
+metrics_enabled = True
+
+# How long, in seconds, browsers keep static files requested by their fingerprinted URL.
+# The URL changes whenever the file does, so these never need to be checked again.
+static_max_age = 365 * 24 * 60 * 60
+
+# The types of responses and static files that are sent compressed.
+# Images are already compressed, so they are sent as they are.
+compressed_types = ["text/html", "text/css", "text/javascript", "text/plain",
+                    "application/json", "image/svg+xml"]
+
+# Responses smaller than this many bytes are sent uncompressed.
+compress_min_bytes = 500
+
+# The compression level of each compression, from most to least preferred.
+# Pages are only compressed once before being cached, so fairly high levels are used.
+compress_levels = {"br": 9, "zstd": 10, "gzip": 6}
+
+# Whether the entity and tool lists and the data pages are streamed while they are rendered,
+# instead of being sent once the whole page has been rendered.
+stream_pages = False
+
+# The number of characters of a streamed page that are collected before being sent.
+stream_chunk_bytes = 4096
+
+# The most words a search uses, the most results it shows,
+# and about how many words of text are shown around the matches in each result.
+search_max_words = 10
+search_max_results = 50
+search_snippet_words = 16
+
+# The name and the list page route of each kind of search result.
+search_types = {"Moons": ("Moon", "/moons"),
+                "Entities": ("Entity", "/entity"),
+                "Tools": ("Tool", "/tools"),
+                "Weathers": ("Weather", "/weathers"),
+                "Interiors": ("Interior", "/interiors")}
+
+# The number of items in a page of an API list, if the client doesn't ask for a number,
+# and the most items a page can have.
+api_default_limit = 20
+api_max_limit = 100
+
+# The number of worker threads that run requests when the app is served as an ASGI app,
+# and how many bytes of a request body are kept in memory before it is moved to a temporary file.
+asgi_threads = 8
+asgi_spool_bytes = 64 * 1024
+
+# The file the key that signs sessions is kept in, if it isn't given in the LC_SECRET_KEY
+# environment variable. It is made the first time the app starts.
+secret_key_file = "secret_key"
+
+# Whether reads are served from an in-memory copy of the database, which is remade after every write,
+# and whether the copy is checked against the database on disk each time it is remade.
+memory_snapshot = False
+memory_snapshot_check = False
+
+# The connection profile that every connection to the database is opened with.
+# In WAL mode, pages can still be read while an admin write is being committed,
+# and with synchronous NORMAL a commit only waits for the disk when the WAL is checkpointed.
+# The memory map and cache sizes are in bytes and in pages (or KiB if negative),
+# and a setting of None leaves SQLite's default.
+db_journal_mode = "WAL"
+db_synchronous = "NORMAL"
+db_mmap_size = 64 * 1024 * 1024
+db_cache_size = -8192
+db_temp_store = "MEMORY"
+
+# How many seconds a connection waits for a locked database before giving up.
+db_busy_timeout = 5.0
+
+# The folder that "flask export-site" writes the public pages to as a static site.
+# When it is set, every admin write also exports again the pages that it changed,
+# so the folder can be served straight by a web server like nginx.
+static_export_folder = None